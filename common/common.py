@@ -19,20 +19,33 @@ OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
 
 import datetime
 import os
+import io
+import re
+import stat
 import sys
 import time
 import json
 import errno
+import atexit
+import hashlib
+import tarfile
+import select
+import socket
 import signal
+import getpass
 import smtplib
+import tempfile
 import logging
 import logging.handlers
+import posixpath
 import textwrap
 import paramiko
+import collections
 import traceback
+import threading
 import subprocess
 import multiprocessing
-# from scp import SCPClient  # TODO: (Aaron) Need to add this in when switch over to new scp.
+import multiprocessing.pool
 from functools import wraps
 
 
@@ -51,7 +64,8 @@ global_vars = {
     'commit_id': '',
     'datos_ip': '',
     'datos_install_dir': '',
-    'checkpoints': [],}
+    'checkpoints': [],
+    'databases': [],}  # DatabaseCluster instances of the run, closed at teardown.
 
 
 class DummyLock():
@@ -69,7 +83,6 @@ if not os.path.exists(directory):
     os.makedirs(directory)
 
 
-os.system('rm %s/*.log >/dev/null 2>&1' % directory)  # Make sure we're starting with clean log file.
 LOG_FILENAME = '%s/geppetto.log' % directory
 logging.getLogger('cassandra').setLevel(logging.CRITICAL)
 logging.getLogger('transport').setLevel(logging.CRITICAL)
@@ -82,6 +95,25 @@ g_logger.setLevel(logging.INFO)
 g_logger.addHandler(handler)
 
 
+def clear_logs():
+    """
+    Starts a test run with clean log files. Not done at import, so tools like recover.py that import this module don't
+    wipe the logs of the run that died.
+    """
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if name.endswith('.log') and path != LOG_FILENAME:
+            os.remove(path)
+
+    # geppetto.log is held open by the log handler; empty it in place.
+    handler.acquire()
+    try:
+        handler.stream.seek(0)
+        handler.stream.truncate()
+    finally:
+        handler.release()
+
+
 class TimeoutException(Exception):
     pass
 
@@ -263,6 +295,65 @@ def report(msg, level="info", no_date=False, no_level=False):
             sys.stdout.write(CRITICAL_COLOR + time_string + level_str + msg + END_COLOR + '\n') ; sys.stdout.flush()  # print(CRITICAL_COLOR + time_string + '[CRITICAL] ' + msg + END_COLOR)
 
 
+def _communicate(p, deadline, on_line=None):
+    """
+    Reads stdout and stderr of a subprocess concurrently until it exits or the deadline passes. Wakes up on output
+    rather than polling on a timer, so fast commands return as soon as they are done.
+    :param p: subprocess.Popen with stdout and stderr pipes.
+    :param deadline: time.time() by which the process must be done. It is killed after that.
+    :param on_line: Optional callback, gets each complete stdout line as it arrives.
+    :return: (out, err)
+    """
+    out_fd, err_fd = p.stdout.fileno(), p.stderr.fileno()
+    buffers = {out_fd: [], err_fd: []}
+    open_fds = [out_fd, err_fd]
+    partial_line = ''
+
+    try:
+        while open_fds:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise TimeoutException('Timeout Exception')
+            try:
+                readable, _, _ = select.select(open_fds, [], [], remaining)
+            except select.error as e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+
+            for fd in readable:
+                data = os.read(fd, 65536)
+                if not data:
+                    open_fds.remove(fd)
+                    continue
+                buffers[fd].append(data)
+                if on_line and fd == out_fd:
+                    lines = (partial_line + data).split('\n')
+                    partial_line = lines.pop()
+                    for line in lines:
+                        on_line(line)
+
+        if on_line and partial_line:
+            on_line(partial_line)
+
+        # Both pipes hit EOF, so the process is on its way out.
+        while p.poll() is None:
+            if time.time() >= deadline:
+                raise TimeoutException('Timeout Exception')
+            time.sleep(0.005)
+
+    except TimeoutException:
+        p.kill()
+        p.wait()
+        raise
+
+    finally:
+        p.stdout.close()
+        p.stderr.close()
+
+    return ''.join(buffers[out_fd]), ''.join(buffers[err_fd])
+
+
 def shell(command, workdir=os.getcwd(), timeout=60*20, retries=0, suppress_output=False, suppress_errors=False, print_real_time=False):
     """
     Run shell command locally on Geppetto host.
@@ -276,25 +367,17 @@ def shell(command, workdir=os.getcwd(), timeout=60*20, retries=0, suppress_outpu
                 report('[Try #%s] Shell: %s' % (i + 1, command))
             p = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True, cwd=workdir)
 
-            # Because Python 2.6 subprocess does not support timeout.
-            # Here we're going to create and process a timeout for the shell command.
-            start = time.time()
-            deadline = start + timeout
-
             # If print real time, (maybe you don't want to so everything lumped with logging.)
+            on_line = None
             if print_real_time and not suppress_output:
-                for line in iter(p.stdout.readline, b''):
-                    if line.strip('\n'):
-                        report(line.strip('\n'))
-
-            # Poll for results, print status bar if taking long time.
-            while time.time() < deadline and p.poll() == None:
-                time.sleep(1)
+                def on_line(line):
+                    if line.strip('\r'):
+                        report(line.strip('\r'))
 
-            if p.poll() == None:
+            try:
+                out, err = _communicate(p, time.time() + timeout, on_line)
+            except TimeoutException:
                 raise TimeoutException('Timeout Exception \n\t%s' % command)
-
-            out, err = p.communicate() # Grab output.
             out, err = out.strip('\n').strip('\r'), err.strip('\n').strip('\r')
 
             # Print command and try # if there is an error and we weren't printing information already.
@@ -302,7 +385,7 @@ def shell(command, workdir=os.getcwd(), timeout=60*20, retries=0, suppress_outpu
                 report('[Try #%s] %s' % (i + 1, command), level='warning')
 
             # Also print elapsed time ...
-            if not suppress_output:
+            if not suppress_output and not on_line:
                 report(out)
             if not suppress_errors:
                 report(err, level='warning')
@@ -314,7 +397,303 @@ def shell(command, workdir=os.getcwd(), timeout=60*20, retries=0, suppress_outpu
     return '', ''
 
 
-def rpc(ip, command, user, password=None, key=None, timeout=60*20, retries=1, no_tty=False, suppress_output=False, suppress_errors=False, print_real_time=False):
+class SSHConnectionPool(object):
+    """
+    Keeps authenticated paramiko connections open between rpc calls, keyed by (ip, user, key). Every command gets its
+    own channel on the shared transport, so only the first call to a host pays for the TCP + key exchange + auth
+    handshake. Idle or dead connections are evicted on access.
+    """
+    def __init__(self, max_idle=60*5, keepalive=30, channel_retries=5):
+        """
+        :param max_idle: Seconds a connection may sit unused before it is closed.
+        :param keepalive: Seconds between transport keepalive packets. 0 to disable.
+        :param channel_retries: Times to back off and retry when the server refuses a channel (MaxSessions reached).
+        """
+        self.max_idle = max_idle
+        self.keepalive = keepalive
+        self.channel_retries = channel_retries
+        self._lock = threading.RLock()
+        self._connections = {}  # (ip, user, key, compress) -> [SSHClient, last used time]
+        self._retired = []  # Unresponsive connections replaced in the pool, closed once their channels are done.
+        self._connect_locks = {}  # (ip, user, key, compress) -> Lock, so a host is never handshaked twice at once.
+        self._pid = os.getpid()
+
+    def _check_pid(self):
+        # Transports can't be shared across a fork (common.Process), so a child starts with an empty pool.
+        # Don't close the parent's sockets from here, just drop the references.
+        if os.getpid() != self._pid:
+            self._pid = os.getpid()
+            self._connections = {}
+            self._connect_locks = {}
+            self._retired = []
+            self._lock = threading.RLock()
+
+    @staticmethod
+    def is_alive(ssh):
+        transport = ssh.get_transport()
+        return transport is not None and transport.is_active()
+
+    @staticmethod
+    def has_open_channels(ssh):
+        transport = ssh.get_transport()
+        channels = getattr(transport, '_channels', None)
+        return transport is not None and transport.is_active() and channels is not None and bool(channels.values())
+
+    def _evict_idle(self):
+        now = time.time()
+        for pool_key, (ssh, last_used) in list(self._connections.items()):
+            if now - last_used > self.max_idle or not self.is_alive(ssh):
+                del self._connections[pool_key]
+                ssh.close()
+        for ssh in list(self._retired):
+            if not self.has_open_channels(ssh):
+                self._retired.remove(ssh)
+                ssh.close()
+
+    def _connect(self, ip, user, password, key, timeout, compress):
+        ssh = paramiko.SSHClient()
+        ssh.load_system_host_keys()
+        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        ssh.connect(hostname=ip, username=user, password=password, key_filename=key, look_for_keys=True, port=22, timeout=timeout, compress=compress)
+        if self.keepalive:
+            ssh.get_transport().set_keepalive(self.keepalive)
+        return ssh
+
+    def get(self, ip, user, password=None, key=None, timeout=60, compress=False):
+        """
+        Returns a connected paramiko SSHClient for the host, reusing a pooled one if it is still alive.
+        :param timeout: Connection timeout in seconds, if a new connection is needed.
+        :param compress: Use a zlib compressed transport. Compressed and plain transports are pooled separately.
+        :return: paramiko.SSHClient
+        """
+        pool_key = (ip, user, key, compress)
+        with self._lock:
+            self._check_pid()
+            self._evict_idle()
+            connect_lock = self._connect_locks.setdefault(pool_key, threading.Lock())
+
+        with connect_lock:
+            with self._lock:
+                entry = self._connections.get(pool_key)
+                if entry:
+                    entry[1] = time.time()
+                    return entry[0]
+
+            # Handshake outside the pool lock so other hosts can connect in parallel.
+            ssh = self._connect(ip, user, password, key, timeout, compress)
+
+            with self._lock:
+                self._connections[pool_key] = [ssh, time.time()]
+            return ssh
+
+    def open_channel(self, ip, user, password=None, key=None, timeout=60, compress=False):
+        """
+        Opens a new session channel on the pooled transport for the host. Reconnects once if the pooled transport
+        turns out to be dead.
+        :return: paramiko.Channel
+        """
+        # Bounded, so a half-open transport to a rebooted or unplugged host fails fast instead of hanging for paramiko's
+        # default hour.
+        return self._open(lambda transport: transport.open_session(timeout=timeout), ip, user, password, key, timeout, compress)
+
+    def open_sftp(self, ip, user, password=None, key=None, timeout=60, compress=False):
+        """
+        Opens a new SFTP session on the pooled transport for the host. Reconnects once if needed.
+        :return: paramiko.SFTPClient
+        """
+        return self._open(paramiko.SFTPClient.from_transport, ip, user, password, key, timeout, compress)
+
+    def _open(self, opener, ip, user, password, key, timeout, compress):
+        reconnected = False
+        refusals = 0
+        backoff = 0.5
+        while True:
+            ssh = self.get(ip, user, password, key, timeout, compress)
+            try:
+                return opener(ssh.get_transport())
+            except paramiko.ChannelException:
+                # The server refused this one channel (e.g. MaxSessions reached), the transport and the commands running
+                # on it are fine. Wait for some of them to finish.
+                refusals += 1
+                if refusals > self.channel_retries:
+                    raise
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 10)
+            except (paramiko.SSHException, EOFError, AttributeError, EnvironmentError):
+                if reconnected:
+                    raise
+                reconnected = True
+                if not self.is_alive(ssh):
+                    self.discard(ip, user, key, compress)
+                else:
+                    # Still active but didn't answer in time, likely half-open. New commands get a fresh connection;
+                    # the ones running on the old one keep it until they finish.
+                    self.retire(ip, user, key, compress)
+
+    def retire(self, ip, user, key=None, compress=False):
+        """
+        Takes the pooled connection for the host out of the pool without closing it. It is closed once it has no
+        open channels left.
+        """
+        with self._lock:
+            self._check_pid()
+            entry = self._connections.pop((ip, user, key, compress), None)
+            if entry:
+                self._retired.append(entry[0])
+
+    def discard_dead(self, ip, user, key=None, compress=False):
+        """
+        Discards the pooled connection for the host only if its transport is no longer active. Call after a command
+        failed, so a dead transport isn't handed out again without closing one that other commands still use.
+        """
+        with self._lock:
+            self._check_pid()
+            entry = self._connections.get((ip, user, key, compress))
+            if entry is None or self.is_alive(entry[0]):
+                return
+            del self._connections[(ip, user, key, compress)]
+        entry[0].close()
+
+    def discard(self, ip, user, key=None, compress=False):
+        """
+        Closes and forgets the pooled connection for the host, if any.
+        """
+        with self._lock:
+            self._check_pid()
+            entry = self._connections.pop((ip, user, key, compress), None)
+        if entry:
+            entry[0].close()
+
+    def close_all(self):
+        with self._lock:
+            self._check_pid()
+            connections, self._connections = self._connections, {}
+            retired, self._retired = self._retired, []
+        for ssh, _ in connections.values():
+            ssh.close()
+        for ssh in retired:
+            ssh.close()
+
+
+ssh_pool = SSHConnectionPool()
+atexit.register(ssh_pool.close_all)
+
+
+class RemoteCommand(object):
+    """
+    Runs a command on a remote host and streams its output. stdout and stderr are multiplexed on the channel, so a
+    chatty stderr can't stall stdout (or the other way around). Iterate over it to get (stream, line) tuples as lines
+    arrive, stream being 'out' or 'err'. Output is also kept in buffers that spill to a temp file past max_buffer bytes.
+
+        command = RemoteCommand(ip, 'tail -f /tmp/mass_population.log', user, password, key, timeout=None)
+        for stream, line in command:
+            ...
+        command.exit_status
+    """
+    def __init__(self, ip, command, user, password=None, key=None, timeout=60*20, no_tty=False, max_buffer=1024*1024*16):
+        """
+        :param timeout: Seconds the whole command may take. None for no limit.
+        :param max_buffer: Bytes of output per stream kept in memory before spilling to a temp file.
+        """
+        self.ip = ip
+        self.command = command
+        self.exit_status = None
+        self.start_time = time.time()
+        self.deadline = self.start_time + timeout if timeout is not None else None
+        self.out = tempfile.SpooledTemporaryFile(max_size=max_buffer)
+        self.err = tempfile.SpooledTemporaryFile(max_size=max_buffer)
+
+        self.channel = ssh_pool.open_channel(ip, user, password, key, min(timeout, 60) if timeout else 60)
+        try:
+            if not no_tty:
+                self.channel.get_pty()
+            self.channel.exec_command(command)
+            self.channel.shutdown_write()
+        except:
+            self.channel.close()
+            raise
+
+    def __iter__(self):
+        channel = self.channel
+        partial = {'out': '', 'err': ''}
+
+        def split(stream, data):
+            lines = (partial[stream] + data).split('\n')
+            partial[stream] = lines.pop()
+            return [(stream, line.rstrip('\r')) for line in lines]
+
+        try:
+            while True:
+                lines = []
+                while channel.recv_ready():
+                    data = channel.recv(32768)
+                    self.out.write(data)
+                    lines += split('out', data)
+                while channel.recv_stderr_ready():
+                    data = channel.recv_stderr(32768)
+                    self.err.write(data)
+                    lines += split('err', data)
+                for line in lines:
+                    yield line
+
+                if channel.eof_received and not channel.recv_ready() and not channel.recv_stderr_ready():
+                    break
+
+                if self.deadline is not None and time.time() >= self.deadline:
+                    raise TimeoutException('Timeout Exception \n\t{%s} %s' % (self.ip, self.command))
+
+                # The channel's fd wakes us on new data on either stream and on EOF. Cap the wait so the deadline is
+                # still honoured if nothing ever arrives.
+                wait = 1.0 if self.deadline is None else max(0, min(1.0, self.deadline - time.time()))
+                select.select([channel], [], [], wait)
+
+            for stream in ('out', 'err'):
+                if partial[stream]:
+                    yield stream, partial[stream].rstrip('\r')
+
+            self.exit_status = channel.recv_exit_status()
+        finally:
+            channel.close()
+
+    def run(self, on_line=None):
+        """
+        Runs the command to completion.
+        :param on_line: Optional callback(stream, line) called for each line as it arrives.
+        :return: Remote exit status.
+        """
+        for stream, line in self:
+            if on_line:
+                on_line(stream, line)
+        return self.exit_status
+
+    def output(self):
+        """
+        :return: (out, err) as strings. For huge outputs read self.out / self.err (file objects) instead.
+        """
+        values = []
+        for f in (self.out, self.err):
+            f.seek(0)
+            values.append(f.read())
+        return values[0], values[1]
+
+
+def rpc_stream(ip, command, user, password=None, key=None, timeout=60*20, no_tty=False, on_line=None, max_buffer=1024*1024*16):
+    """
+    Streaming rpc: runs the command on the remote host and hands every line of output to on_line as it arrives.
+    :param timeout: Seconds the whole command may take. None for no limit (e.g. tail -f).
+    :param on_line: callback(stream, line), stream being 'out' or 'err'.
+    :param max_buffer: Bytes of output per stream kept in memory before spilling to a temp file.
+    :return: RemoteCommand, finished. Has exit_status, and out / err file objects with the complete output.
+    """
+    if key:
+        key = os.path.expanduser(key)
+
+    remote_command = RemoteCommand(ip, command, user, password, key, timeout, no_tty, max_buffer)
+    remote_command.run(on_line)
+    return remote_command
+
+
+def rpc(ip, command, user, password=None, key=None, timeout=60*20, retries=1, no_tty=False, suppress_output=False, suppress_errors=False, print_real_time=False, return_exit_status=False):
     """
     Easy shell call on remote host.
     :param ip: IP of remote host.
@@ -326,8 +705,9 @@ def rpc(ip, command, user, password=None, key=None, timeout=60*20, retries=1, no
     :param retries: Number of retries.
     :param no_tty: Disables Paramiko get_pty. You may need TTY to run sudo commands if the sudoers file requires it.
     :param suppress_output: Does not print command output.
-    :param print_real_time:
-    :return: (std, err)
+    :param print_real_time: Print output lines as they arrive instead of all at the end.
+    :param return_exit_status: Also return the remote exit status (None if the command could not be run).
+    :return: (std, err) or (std, err, exit_status)
     """
     assert(retries >= 0)
     assert(timeout >= 0)
@@ -342,16 +722,19 @@ def rpc(ip, command, user, password=None, key=None, timeout=60*20, retries=1, no
             if not suppress_output:
                 report('[Try #%s] RPC: {%s} %s' % (i + 1, ip, command))
 
-            start = time.time()
-
-            ssh = paramiko.SSHClient()
-            ssh.load_system_host_keys()
-            ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            ssh.connect(hostname=ip, username=user, password=password, key_filename=key, look_for_keys=True, port=22, timeout=timeout)
-            std_in, out, err = ssh.exec_command(command, get_pty= not no_tty)
-            std_in.close()
+            remote_command = RemoteCommand(ip, command, user, password, key, timeout, no_tty)
 
-            out, err = out.read().strip('\n').strip('\r'), err.read().strip('\n').strip('\r')
+            on_line = None
+            if print_real_time and not suppress_output:
+                def on_line(stream, line):
+                    if stream == 'out':
+                        report(line)
+                    elif not suppress_errors:
+                        report(line, level='warning')
+
+            exit_status = remote_command.run(on_line)
+            out, err = remote_command.output()
+            out, err = out.strip('\n').strip('\r'), err.strip('\n').strip('\r')
 
             if 'Connection to %s closed' % ip in err:
                 err = ''
@@ -360,121 +743,458 @@ def rpc(ip, command, user, password=None, key=None, timeout=60*20, retries=1, no
             if suppress_output and err and not suppress_errors:
                 report('[Try #%s] RPC: {%s} %s' % (i + 1, ip, command), level='warning')
 
-            if not suppress_output:
+            if not suppress_output and not on_line:
                 report(out)
-            if not suppress_errors:
+            if not suppress_errors and not on_line:
                 report(err, level='warning')
 
-            ssh.close()
+            if return_exit_status:
+                return out, err, exit_status
             return out, err
 
+        except paramiko.ChannelException:
+            # The host refused a channel even after backing off; the shared transport is fine.
+            report(traceback.format_exc(), level='important')
+            time.sleep(3)
+        except (paramiko.SSHException, EOFError, socket.error):
+            report(traceback.format_exc(), level='important')
+            ssh_pool.discard_dead(ip, user, key)  # Don't hand a broken transport to the next try.
+            time.sleep(3)
         except Exception:
+            # E.g. TimeoutException: RemoteCommand closed its own channel, the other commands on the transport go on.
             report(traceback.format_exc(), level='important')
             time.sleep(3)
 
     report('Error Connecting.', 'warning')
+    if return_exit_status:
+        return '', 'Error Connecting.', None
     return '', 'Error Connecting.'
 
 
-def scp(from_path, to_path, password=None, key=None, is_dir=False, timeout=60*20, retries=0, suppress_output=False, suppress_errors=False, print_real_time=False):
+RPCResult = collections.namedtuple('RPCResult', ['out', 'err', 'exit_status', 'elapsed'])
+
+
+def rpc_many(ips, command, user, password=None, key=None, timeout=60*20, deadline=None, max_workers=32, retries=1, no_tty=False, suppress_output=False, suppress_errors=False):
     """
-    Easily scp file to remote host.
-    :param from_path: Should include user@ip if remote host, else just local file path with -r if dir.
-    :param to_path: Should include user@ip if remote host, else just local file path with -r if dir.
-    :param key: Path to pem key file.
-    :return: (std, err)
+    Runs the same command on many remote hosts concurrently through a bounded pool of worker threads.
+    :param ips: IPs of remote hosts.
+    :param command: Command to be run.
+    :param timeout: Per host command timeout in seconds.
+    :param deadline: Overall time limit in seconds for all hosts. Hosts not finished by then report a timeout.
+    :param max_workers: Maximum number of hosts worked on at once.
+    :return: OrderedDict of ip -> RPCResult(out, err, exit_status, elapsed), in the order of ips.
     """
-    assert(retries >= 0)
-    assert(timeout >= 0)
+    assert(max_workers > 0)
+    assert(deadline is None or deadline >= 0)
 
-    if is_dir:
-        dir_flag = '-r'
-    else:
-        dir_flag = ''
+    ips = list(ips)
+    results = collections.OrderedDict()
+    if not ips:
+        return results
+
+    def worker(ip):
+        start = time.time()
+        out, err, exit_status = rpc(ip, command, user, password, key, timeout, retries, no_tty=no_tty, suppress_output=suppress_output,
+                                    suppress_errors=suppress_errors, return_exit_status=True)
+        return RPCResult(out, err, exit_status, time.time() - start)
+
+    start = time.time()
+    end = start + deadline if deadline is not None else None
+
+    pool = multiprocessing.pool.ThreadPool(min(max_workers, len(ips)))
+    try:
+        pending = [(ip, pool.apply_async(worker, (ip,))) for ip in ips]
+        pool.close()
+
+        for ip, async_result in pending:
+            try:
+                if end is None:
+                    # A get() without timeout can't be interrupted by Ctrl-C in Python 2, so wait in slices.
+                    while not async_result.ready():
+                        async_result.wait(1)
+                    results[ip] = async_result.get()
+                else:
+                    results[ip] = async_result.get(max(0, end - time.time()))
+            except multiprocessing.TimeoutError:
+                report('RPC deadline of %ss reached on {%s} %s' % (deadline, ip, command), 'warning')
+                results[ip] = RPCResult('', 'Timed out.', None, time.time() - start)
+    finally:
+        # Workers still running past the deadline are daemon threads, they are simply abandoned.
+        pool.terminate()
+
+    return results
+
+
+def deliver_files(ips, user, password=None, key=None, files=None, remote_dir='~/.geppetto', max_workers=32, timeout=60*5):
+    """
+    Incrementally delivers local files to many hosts in parallel. Each host keeps a manifest of file hashes in
+    remote_dir; only files whose hash differs from the manifest are shipped, as one gzipped tar streamed over a single
+    SSH channel per host.
+    :param ips: IPs of remote hosts.
+    :param files: Dict of path relative to remote_dir -> local file path.
+    :param remote_dir: Remote directory to deliver into. Created if missing.
+    :return: OrderedDict of ip -> list of relative paths that were shipped, or None if delivery to that host failed.
+    """
+    manifest_name = '.manifest'
+    files = files or {}
+
+    if key:
+        key = os.path.expanduser(key)
+
+    # Hash everything locally once.
+    local_manifest = {}
+    for rel_path, local_path in files.items():
+        with open(local_path, 'rb') as f:
+            local_manifest[rel_path] = hashlib.sha1(f.read()).hexdigest()
+
+    tar_cache = {}  # Sorted tuple of changed paths -> tar bytes, nodes usually need the same set.
+    tar_lock = threading.Lock()
+
+    def build_tar(changed):
+        with tar_lock:
+            if changed not in tar_cache:
+                buf = io.BytesIO()
+                tar = tarfile.open(fileobj=buf, mode='w:gz')
+                for rel_path in changed:
+                    tar.add(files[rel_path], arcname=rel_path)
+
+                # Manifest goes last, so a delivery cut short never claims files it didn't extract.
+                manifest = json.dumps(local_manifest, sort_keys=True)
+                info = tarfile.TarInfo(manifest_name)
+                info.size = len(manifest)
+                info.mtime = time.time()
+                tar.addfile(info, io.BytesIO(manifest))
+                tar.close()
+                tar_cache[changed] = buf.getvalue()
+            return tar_cache[changed]
+
+    def deliver(ip):
+        try:
+            out, _, exit_status = rpc(ip, 'cat %s/%s 2>/dev/null' % (remote_dir, manifest_name), user, password, key, timeout,
+                                      no_tty=True, suppress_output=True, suppress_errors=True, return_exit_status=True)
+            try:
+                remote_manifest = json.loads(out) if exit_status == 0 else {}
+            except ValueError:
+                remote_manifest = {}
+
+            changed = tuple(sorted(p for p, h in local_manifest.items() if remote_manifest.get(p) != h))
+            if not changed:
+                return ip, []
+
+            payload = build_tar(changed)
+
+            # No pty, the tar goes over stdin as raw bytes.
+            channel = ssh_pool.open_channel(ip, user, password, key)
+            try:
+                channel.settimeout(timeout)
+                channel.exec_command('mkdir -p %s && tar -xzf - -C %s' % (remote_dir, remote_dir))
+                channel.sendall(payload)
+                channel.shutdown_write()
+                err = channel.makefile_stderr('rb').read()
+                exit_status = channel.recv_exit_status()
+            finally:
+                channel.close()
+
+            if exit_status != 0:
+                report('Delivery to {%s} failed: %s' % (ip, err.strip()), 'warning')
+                return ip, None
+            return ip, list(changed)
+
+        except Exception:
+            report('Delivery to {%s} failed:\n%s' % (ip, traceback.format_exc()), 'warning')
+            return ip, None
+
+    ips = list(ips)
+    results = collections.OrderedDict((ip, None) for ip in ips)
+    if not ips:
+        return results
+
+    pool = multiprocessing.pool.ThreadPool(min(max_workers, len(ips)))
+    try:
+        for ip, shipped in pool.imap_unordered(deliver, ips):
+            results[ip] = shipped
+    finally:
+        pool.terminate()
+
+    return results
+
+
+TransferResult = collections.namedtuple('TransferResult', ['source', 'destination', 'bytes', 'elapsed'])
 
-    if password:
-        command = '''sshpass -p %s scp -o "StrictHostKeyChecking no" %s %s %s''' % (password, dir_flag, from_path, to_path)
-    elif key:
-        command = '''scp -i %s -o "StrictHostKeyChecking no" %s %s %s''' % (key, dir_flag, from_path, to_path)
+
+def _sftp_path(path):
+    # SFTP sessions start in the home directory and don't expand ~, so make home relative paths relative.
+    if path == '~':
+        return '.'
+    if path.startswith('~/'):
+        return path[2:] or '.'
+    return path
+
+
+def _sftp_is_dir(sftp, path):
+    try:
+        return stat.S_ISDIR(sftp.stat(path).st_mode)
+    except IOError:
+        return False
+
+
+def _sftp_makedirs(sftp, path):
+    if not path or path in ('.', '/') or _sftp_is_dir(sftp, path):
+        return
+    _sftp_makedirs(sftp, posixpath.dirname(path.rstrip('/')))
+    try:
+        sftp.mkdir(path)
+    except IOError:
+        if not _sftp_is_dir(sftp, path):
+            raise
+
+
+def _plan_put(sftp, local_path, remote_path):
+    """
+    Works out (local file, remote file) pairs for a put, creating remote directories. Like scp -r, a source copied
+    onto an existing remote directory lands inside it.
+    """
+    local_path = os.path.expanduser(local_path).rstrip('/') or '/'
+    remote_path = _sftp_path(remote_path)
+    if remote_path.endswith('/') or _sftp_is_dir(sftp, remote_path):
+        remote_path = posixpath.join(remote_path, os.path.basename(local_path))
+
+    if not os.path.isdir(local_path):
+        return [(local_path, remote_path)]
+
+    pairs = []
+    for root, dirs, file_names in os.walk(local_path):
+        relative_root = os.path.relpath(root, local_path)
+        remote_root = remote_path if relative_root == '.' else posixpath.join(remote_path, *relative_root.split(os.sep))
+        _sftp_makedirs(sftp, remote_root)
+        for file_name in file_names:
+            pairs.append((os.path.join(root, file_name), posixpath.join(remote_root, file_name)))
+    return pairs
+
+
+def _plan_get(sftp, remote_path, local_path):
+    """
+    Works out (remote file, local file) pairs for a get, creating local directories.
+    """
+    remote_path = _sftp_path(remote_path).rstrip('/') or '/'
+    local_path = os.path.expanduser(local_path)
+    if local_path.endswith('/') or os.path.isdir(local_path):
+        local_path = os.path.join(local_path, posixpath.basename(remote_path))
+
+    if not _sftp_is_dir(sftp, remote_path):
+        return [(remote_path, local_path)]
+
+    pairs = []
+    pending = [(remote_path, local_path)]
+    while pending:
+        remote_dir, local_dir = pending.pop()
+        if not os.path.isdir(local_dir):
+            os.makedirs(local_dir)
+        for attr in sftp.listdir_attr(remote_dir):
+            remote_file = posixpath.join(remote_dir, attr.filename)
+            local_file = os.path.join(local_dir, attr.filename)
+            if stat.S_ISDIR(attr.st_mode):
+                pending.append((remote_file, local_file))
+            else:
+                pairs.append((remote_file, local_file))
+    return pairs
+
+
+def _sftp_copy(sftp, mode, source, destination):
+    """
+    Copies one file. Writes are pipelined (no waiting on an ack per block) and reads are prefetched.
+    :return: Number of bytes copied.
+    """
+    copied = 0
+    if mode == 'put':
+        with open(source, 'rb') as local_file:
+            remote_file = sftp.open(destination, 'wb')
+            try:
+                remote_file.set_pipelined(True)
+                while True:
+                    data = local_file.read(32768)
+                    if not data:
+                        break
+                    remote_file.write(data)
+                    copied += len(data)
+            finally:
+                remote_file.close()  # Waits for all the pipelined writes to be acknowledged.
+        sftp.chmod(destination, stat.S_IMODE(os.stat(source).st_mode))
     else:
-        command = '''scp -o "StrictHostKeyChecking no" %s %s %s''' % (dir_flag, from_path, to_path)
+        remote_file = sftp.open(source, 'rb')
+        try:
+            remote_file.prefetch()
+            with open(destination, 'wb') as local_file:
+                while True:
+                    data = remote_file.read(32768)
+                    if not data:
+                        break
+                    local_file.write(data)
+                    copied += len(data)
+        finally:
+            remote_file.close()
+    return copied
+
+
+def sftp_transfer(mode, ip, user, local_path, remote_path, password=None, key=None, compress=False, max_workers=4, timeout=60*20, suppress_output=False):
+    """
+    In-process file transfer over pooled paramiko transports. Files and whole directories are supported; the files of a
+    directory are copied in parallel, each worker with its own SFTP session on the shared transport.
+    :param mode: 'put' (local to remote) or 'get' (remote to local).
+    :param compress: Use a zlib compressed transport. Worth it for text (logs, schemas) on slow links.
+    :param max_workers: Files copied at once.
+    :param timeout: Seconds without progress before a file transfer fails.
+    :return: List of TransferResult(source, destination, bytes, elapsed), one per file.
+    """
+    assert(mode in ['put', 'get'])
+    assert(max_workers > 0)
 
-    for i in xrange(retries + 1):
+    if key:
+        key = os.path.expanduser(key)
+
+    start = time.time()
+    sessions = []
+    sessions_lock = threading.Lock()
+    local = threading.local()
+
+    def open_sftp():
+        sftp = ssh_pool.open_sftp(ip, user, password, key, min(timeout, 60), compress)
+        sftp.get_channel().settimeout(timeout)
+        with sessions_lock:
+            sessions.append(sftp)
+        return sftp
+
+    def copy(pair):
+        if not hasattr(local, 'sftp'):
+            local.sftp = open_sftp()
+        source, destination = pair
+        file_start = time.time()
+        copied = _sftp_copy(local.sftp, mode, source, destination)
+        result = TransferResult(source, destination, copied, time.time() - file_start)
+        if not suppress_output:
+            report('[SFTP %s] {%s} %s -> %s  %s in %.2fs (%s/s)' % (mode.upper(), ip, source, destination, bytes_to_str(result.bytes),
+                                                                   result.elapsed, bytes_to_str(result.bytes / max(result.elapsed, 0.001))))
+        return result
+
+    try:
+        planner = open_sftp()
+        if mode == 'put':
+            pairs = _plan_put(planner, local_path, remote_path)
+        else:
+            pairs = _plan_get(planner, remote_path, local_path)
+
+        if len(pairs) <= 1 or max_workers == 1:
+            local.sftp = planner
+            results = [copy(pair) for pair in pairs]
+        else:
+            pool = multiprocessing.pool.ThreadPool(min(max_workers, len(pairs)))
+            try:
+                results = pool.map(copy, pairs)
+            finally:
+                pool.terminate()
+    finally:
+        for sftp in sessions:
+            sftp.close()
+
+    if not suppress_output and len(results) > 1:
+        total = sum(r.bytes for r in results)
+        elapsed = time.time() - start
+        report('[SFTP %s] {%s} %s files, %s in %.2fs (%s/s)' % (mode.upper(), ip, len(results), bytes_to_str(total), elapsed,
+                                                               bytes_to_str(total / max(elapsed, 0.001))))
+    return results
+
+
+def sftp_put(ip, user, local_path, remote_path, password=None, key=None, **kwargs):
+    """
+    Copies a local file or directory to a remote host. See sftp_transfer.
+    """
+    return sftp_transfer('put', ip, user, local_path, remote_path, password, key, **kwargs)
+
+
+def sftp_get(ip, user, remote_path, local_path, password=None, key=None, **kwargs):
+    """
+    Copies a remote file or directory to the local host. See sftp_transfer.
+    """
+    return sftp_transfer('get', ip, user, local_path, remote_path, password, key, **kwargs)
+
+
+def transfer_many(transfers, max_workers=16, **kwargs):
+    """
+    Runs many sftp transfers (e.g. the same file to a whole cluster, or logs from every node) in parallel.
+    :param transfers: List of (mode, ip, user, local_path, remote_path, password, key) tuples.
+    :param kwargs: Passed to every sftp_transfer.
+    :return: List of result lists, in the order of transfers. A failed transfer's entry is the exception.
+    """
+    transfers = list(transfers)
+    if not transfers:
+        return []
+
+    def run(transfer):
         try:
-            if not suppress_output:
-                report('[Try #%s] %s' % (i + 1, command))
-            p = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            return sftp_transfer(*transfer, **kwargs)
+        except Exception as e:
+            report('Transfer failed %s:\n%s' % (transfer[:5], traceback.format_exc()), 'warning')
+            return e
 
-            # Because Python 2.6 subprocess does not support timeout.
-            # Here we're going to create and process a timeout for the shell command.
-            start = time.time()
-            deadline = start + timeout
+    pool = multiprocessing.pool.ThreadPool(min(max_workers, len(transfers)))
+    try:
+        return pool.map(run, transfers)
+    finally:
+        pool.terminate()
 
-            # If print real time, (maybe you don't want to so everything lumped with logging.)
-            if print_real_time and not suppress_output:
-                for line in iter(p.stdout.readline, b''):
-                    if line.strip('\n'):
-                        report(line.strip('\n'))
 
-            # Poll for results, print status bar if taking long time.
-            while time.time() < deadline and p.poll() == None:
-                time.sleep(1)
+def _split_remote_path(path):
+    # [user@]host:path -> (user, host, path), or None for a local path.
+    match = re.match(r'^(?:([^@/:]+)@)?([^@/:]+):(.*)$', path)
+    if not match:
+        return None
+    user, host, remote_path = match.groups()
+    return user or getpass.getuser(), host, remote_path or '.'
 
-            if p.poll() == None:
-                if i >= retries:
-                    raise TimeoutException('Timeout Exception: \n\t%s' % command)
-                continue
 
-            out, err = p.communicate()  # Grab output.
-            out, err = out.strip('\n').strip('\r'), err.strip('\n').strip('\r')
+def scp(from_path, to_path, password=None, key=None, is_dir=False, timeout=60*20, retries=0, suppress_output=False, suppress_errors=False, print_real_time=False):
+    """
+    Easily scp file to remote host. Runs in process over SFTP on the pooled connections, no scp/sshpass binaries.
+    :param from_path: Should include user@ip if remote host, else just local file path.
+    :param to_path: Should include user@ip if remote host, else just local file path.
+    :param key: Path to pem key file.
+    :param is_dir: Kept for compatibility, directories are detected.
+    :return: (std, err)
+    """
+    assert(retries >= 0)
+    assert(timeout >= 0)
 
-            # Print command and try # if there is an error and we weren't printing information already.
-            if suppress_output and err and not suppress_errors:
-                report('[Try #%s] %s' % (i + 1, command), level='warning')
+    source, destination = _split_remote_path(from_path), _split_remote_path(to_path)
+    if (source is None) == (destination is None):
+        err = 'scp needs exactly one remote path: %s -> %s' % (from_path, to_path)
+        report(err, level='warning')
+        return '', err
 
+    for i in xrange(retries + 1):
+        try:
             if not suppress_output:
-                report(out)
-            report(err, level='warning')
-            if not suppress_errors:
-                return out, err
+                report('[Try #%s] SCP %s %s' % (i + 1, from_path, to_path))
 
-        except TimeoutException as te:
-            report(te, level='critical')
+            if destination:
+                user, ip, remote_path = destination
+                results = sftp_put(ip, user, from_path, remote_path, password, key, timeout=timeout, suppress_output=not print_real_time)
+            else:
+                user, ip, remote_path = source
+                results = sftp_get(ip, user, remote_path, to_path, password, key, timeout=timeout, suppress_output=not print_real_time)
 
-    return '', ''
+            out = '%s files, %s' % (len(results), bytes_to_str(sum(r.bytes for r in results)))
+            if not suppress_output:
+                report(out)
+            return out, ''
 
+        except Exception:
+            err = traceback.format_exc()
+            if suppress_output and not suppress_errors:
+                report('[Try #%s] SCP %s %s' % (i + 1, from_path, to_path), level='warning')
+            if not suppress_errors:
+                report(err, level='warning')
 
-# New scp coming in soon.
-
-# def scp(mode='put', local_path='.', remote_path='.', ip='127.0.0.1', user=getpass.getuser(), password=None, key=None, timeout=60*60):
-#     """
-#
-#     :param mode:
-#     :param local_path:
-#     :param remote_path:
-#     :param ip:
-#     :param user:
-#     :param password:
-#     :param key:
-#     :param timeout:
-#     :return: None
-#     """
-#     assert(timeout >= 0)
-#     assert(mode in ['get', 'put'])
-#
-#     ssh = paramiko.SSHClient()
-#     ssh.load_system_host_keys()
-#     ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-#     ssh.connect(hostname=ip, username=user, password=password, key_filename=key, look_for_keys=True, port=22, timeout=timeout)
-#     with SCPClient(ssh.get_transport()) as scp:
-#         if mode == 'put':
-#             print('[SCP PUT] %s to <%s>:%s' % (local_path, ip, remote_path))
-#             scp.put(files=local_path, remote_path=remote_path, recursive=True)
-#         else:
-#             print("[SCP GET] <%s>:%s to %s" % (ip, remote_path, local_path))
-#             scp.get(local_path=local_path, remote_path=remote_path, recursive=True)
-#
-#     ssh.close()
+    return '', 'Error transferring.'
 
 
 def convert_datos_output_to_json(cli_out):
@@ -666,14 +1386,18 @@ def is_ssh_ready(ip, username, password=None, key=None):
     :param key: pass to *.pem key
     :return: boolean of the connection state
     """
+    if key:
+        key = os.path.expanduser(key)
+
     try:
-        private_key = paramiko.RSAKey.from_private_key_file(os.path.expanduser(key))
-        ssh = paramiko.SSHClient()
-        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        ssh.connect(ip, username=username, password=password, pkey=private_key)
-        ssh.close()
+        # Opening a channel proves the pooled transport is really usable, e.g. the host was not rebooted under us.
+        channel = ssh_pool.open_channel(ip, username, password, key, timeout=60)
+        channel.close()
         return True
+    except paramiko.ChannelException:
+        return True  # Too many sessions open right now, but the host answered.
     except Exception:
+        ssh_pool.discard_dead(ip, username, key)
         report("SSH is not responsive for %s:\n%s" % (ip, traceback.format_exc()))
         return False
 
@@ -688,15 +1412,65 @@ def wait_for_ssh_ready(ip, username, password=None, key=None, timeout=600):
     :param timeout: try for timeout seconds
     :return: boolean of the connection state
     """
+    if wait_until(lambda: is_ssh_ready(ip, username, password, key), timeout=timeout, max_interval=20):
+        report("SSH for %s is working" % ip, level="important")
+        return True
+    return False
+
+
+def wait_until(condition, timeout=600, interval=1, max_interval=30, backoff=2, description=None):
+    """
+    Polls condition until it holds or the deadline passes. The poll interval starts short and grows exponentially, so
+    fast convergence is seen within a second while slow convergence isn't polled hard.
+    :param condition: Callable without arguments, polled until it returns something true.
+    :param timeout: Seconds until giving up.
+    :param interval: First poll interval in seconds.
+    :param max_interval: Upper bound of the poll interval in seconds.
+    :param backoff: Factor the poll interval grows by after each poll.
+    :param description: What is waited for, reported on success and timeout.
+    :return: The last value returned by condition, i.e. false on timeout.
+    """
+    assert(timeout >= 0)
+    assert(interval > 0 and backoff >= 1)
+
     start = time.time()
-    while(True):
-        if is_ssh_ready(ip, username, password, key):
-            report("SSH for %s is working" % ip, level="important")
-            return True
-        elapsed = time.time() - start
-        if elapsed > timeout:
-            return False
-        time.sleep(20)
+    deadline = start + timeout
+    while True:
+        result = condition()
+        if result:
+            if description:
+                report('%s after %.1f seconds.' % (description, time.time() - start))
+            return result
+
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            if description:
+                report('Timed out after %s seconds waiting until %s.' % (timeout, description), 'warning')
+            return result
+
+        time.sleep(min(interval, remaining))
+        interval = min(interval * backoff, max_interval)
+
+
+def is_port_open(ip, port, timeout=3):
+    """
+    Checks if something accepts TCP connections on ip:port.
+    """
+    try:
+        connection = socket.create_connection((ip, port), timeout)
+        connection.close()
+        return True
+    except (socket.error, socket.timeout):
+        return False
+
+
+def wait_for_port(ip, port, timeout=300, closed=False):
+    """
+    Waits until ip:port accepts connections, or with closed=True until it stops accepting them.
+    :return: boolean status
+    """
+    return wait_until(lambda: is_port_open(ip, port) != closed, timeout=timeout, max_interval=10,
+                      description='port %s on {%s} is %s' % (port, ip, 'closed' if closed else 'open'))
 
 
 def get_file_content(filename):
@@ -847,11 +1621,4 @@ def wait_for_host(host, timeout=600):
     :param timeout: How long to wait.
     :return: boolean status
     """
-    start = time.time()
-    while True:
-        if is_host_alive(host):
-            return True
-        elapsed = time.time() - start
-        if elapsed > timeout:
-            return False
-        time.sleep(20)
+    return wait_until(lambda: is_host_alive(host), timeout=timeout, max_interval=20)
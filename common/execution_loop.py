@@ -0,0 +1,639 @@
+"""
+The MIT License (MIT)
+Copyright (c) Datos IO, Inc. 2015.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit
+persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the
+Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+
+import os
+import time
+import Queue
+import select
+import fcntl
+import subprocess
+import collections
+import multiprocessing.pool
+
+
+from common import report, ssh_pool, scp, RPCResult, TimeoutException
+
+
+# Single threaded event loop for driving many remote and local commands at once.
+#
+# Commands are multiplexed with poll() on the paramiko channel and subprocess pipe descriptors, so hundreds of nodes
+# cost hundreds of file descriptors instead of hundreds of OS threads. Only the blocking bits (the SSH handshake when
+# the pool has no connection yet, and file transfers) go to a small worker pool.
+#
+# Orchestration code is written as generator coroutines:
+#
+#     def check_node(loop, ip):
+#         result = yield loop.rpc(ip, 'nodetool status', user, password, key)
+#         results = yield [loop.rpc(ip, 'uptime', user, password, key), loop.shell('hostname')]  # Wait for both.
+#         yield 5  # Sleep 5 seconds without blocking other coroutines.
+#         raise Return(result.out)
+#
+#     out = run_coroutine(lambda loop: check_node(loop, ip), timeout=60)
+
+
+class TaskCancelled(Exception):
+    pass
+
+
+class Return(Exception):
+    """
+    Raise Return(value) to return a value from a coroutine. Python 2 generators can't use return with a value.
+    """
+    def __init__(self, value=None):
+        Exception.__init__(self, value)
+        self.value = value
+
+
+class Task(object):
+    """
+    Handle for a unit of work scheduled on an ExecutionLoop.
+    """
+    def __init__(self, loop, name, timeout=None):
+        self.loop = loop
+        self.name = name
+        self.start_time = time.time()
+        self.deadline = self.start_time + timeout if timeout is not None else None
+        self._done = False
+        self._result = None
+        self._exception = None
+        self._callbacks = []
+        loop._tasks.add(self)
+
+    def done(self):
+        return self._done
+
+    def cancelled(self):
+        return isinstance(self._exception, TaskCancelled)
+
+    def result(self):
+        """
+        :return: Result of the task. Raises the task's exception if it failed, was cancelled or timed out.
+        """
+        assert self._done, 'Task %s is not done yet.' % self.name
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+    def exception(self):
+        return self._exception
+
+    def add_done_callback(self, fn):
+        if self._done:
+            self.loop._call_soon(fn, self)
+        else:
+            self._callbacks.append(fn)
+
+    def cancel(self, exception=None):
+        """
+        Cancels the task and anything it is waiting on. Does nothing if it already finished.
+        """
+        if self._done:
+            return False
+        self._abort()
+        self._finish(exception=exception or TaskCancelled('Cancelled: %s' % self.name))
+        return True
+
+    def _abort(self):
+        # Overridden to release whatever the task holds (channel, process ...).
+        pass
+
+    def _finish(self, result=None, exception=None):
+        if self._done:
+            return
+        self._done = True
+        self._result = result
+        self._exception = exception
+        self.loop._task_finished(self)
+        for fn in self._callbacks:
+            self.loop._call_soon(fn, self)
+        self._callbacks = []
+
+    def _check(self):
+        # Called by the loop every iteration, for tasks that need to notice things select can't see.
+        pass
+
+    def _needs_check_soon(self):
+        # True if _check should run again shortly, rather than whenever poll happens to wake up.
+        return False
+
+    def __repr__(self):
+        return '<%s %s>' % (self.__class__.__name__, self.name)
+
+
+class _SleepTask(Task):
+    def __init__(self, loop, seconds):
+        Task.__init__(self, loop, 'sleep(%s)' % seconds)
+        self.wake_time = self.start_time + seconds
+
+    def _check(self):
+        if time.time() >= self.wake_time:
+            self._finish()
+
+
+class _WorkerTask(Task):
+    """
+    Runs a blocking function in the loop's worker pool. Cancelling can't interrupt the function, the result is just
+    thrown away.
+    """
+    def __init__(self, loop, name, timeout, fn, args=(), kwargs=None):
+        Task.__init__(self, loop, name, timeout)
+        loop._submit(self, fn, args, kwargs or {})
+
+    def _on_worker_done(self, result, exception):
+        self._finish(result, exception)
+
+
+class _CommandTask(Task):
+    """
+    Base for commands whose stdout and stderr arrive on file descriptors watched by the loop.
+    """
+    def __init__(self, loop, name, timeout, suppress_output=False, suppress_errors=False):
+        Task.__init__(self, loop, name, timeout)
+        self.suppress_output = suppress_output
+        self.suppress_errors = suppress_errors
+        self.out = []
+        self.err = []
+
+    def _complete(self, exit_status):
+        out = ''.join(self.out).strip('\n').strip('\r')
+        err = ''.join(self.err).strip('\n').strip('\r')
+        if not self.suppress_output:
+            report(out)
+        if not self.suppress_errors:
+            report(err, level='warning')
+        self._finish(RPCResult(out, err, exit_status, time.time() - self.start_time))
+
+
+class _RemoteCommandTask(_CommandTask):
+    def __init__(self, loop, ip, command, user, password, key, timeout, no_tty, suppress_output, suppress_errors, on_line=None):
+        _CommandTask.__init__(self, loop, '{%s} %s' % (ip, command), timeout, suppress_output, suppress_errors)
+        self.ip = ip
+        self.user = user
+        self.key = os.path.expanduser(key) if key else None
+        self.channel = None
+        self.fd = None
+        self.on_line = on_line
+        self.partial = {'out': '', 'err': ''}
+
+        if not suppress_output:
+            report('[Loop] RPC: {%s} %s' % (ip, command))
+
+        # Opening the channel may need a full handshake, so it happens in the worker pool. The channel is handed
+        # back to the loop thread once the command is running.
+        def open_channel():
+            channel = ssh_pool.open_channel(ip, user, password, self.key, min(timeout or 60, 60))
+            if not no_tty:
+                channel.get_pty()
+            channel.exec_command(command)
+            channel.shutdown_write()
+            channel.setblocking(0)
+            return channel
+
+        loop._submit(self, open_channel, (), {})
+
+    def _on_worker_done(self, channel, exception):
+        if exception is not None:
+            ssh_pool.discard_dead(self.ip, self.user, self.key)
+            self._finish(exception=exception)
+        elif self._done:
+            channel.close()  # Cancelled while connecting.
+        else:
+            self.channel = channel
+            self.fd = channel.fileno()
+            self.loop._watch(self.fd, self)
+
+    def _on_readable(self, fd):
+        self._check()
+
+    def _check(self):
+        channel = self.channel
+        if channel is None:
+            return
+        while channel.recv_ready():
+            self._received('out', self.out, channel.recv(32768))
+        while channel.recv_stderr_ready():
+            self._received('err', self.err, channel.recv_stderr(32768))
+        if channel.exit_status_ready() and (channel.eof_received or channel.closed):
+            if channel.recv_ready() or channel.recv_stderr_ready():
+                return
+            self.loop._unwatch(self.fd)
+            exit_status = channel.recv_exit_status()
+            channel.close()
+            self.channel = None
+            if self.on_line:
+                for stream in ('out', 'err'):
+                    if self.partial[stream]:
+                        self.on_line(stream, self.partial[stream])
+            self._complete(exit_status)
+
+    def _received(self, stream, chunks, data):
+        # With on_line the output goes to the callback line by line and is not kept, so following a log for hours
+        # doesn't grow memory.
+        if not self.on_line:
+            chunks.append(data)
+            return
+        lines = (self.partial[stream] + data).split('\n')
+        self.partial[stream] = lines.pop()
+        for line in lines:
+            self.on_line(stream, line.rstrip('\r'))
+
+    def _abort(self):
+        if self.channel is not None:
+            self.loop._unwatch(self.fd)
+            self.channel.close()
+            self.channel = None
+
+
+class _ShellTask(_CommandTask):
+    def __init__(self, loop, command, workdir, timeout, suppress_output, suppress_errors):
+        _CommandTask.__init__(self, loop, command, timeout, suppress_output, suppress_errors)
+
+        if not suppress_output:
+            report('[Loop] Shell: %s' % command)
+
+        self.process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True, cwd=workdir)
+        self.open_fds = {
+            self.process.stdout.fileno(): self.out,
+            self.process.stderr.fileno(): self.err,
+        }
+        for fd in self.open_fds:
+            flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+            fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+            loop._watch(fd, self)
+
+    def _on_readable(self, fd):
+        try:
+            data = os.read(fd, 32768)
+        except OSError:
+            return
+        if data:
+            self.open_fds[fd].append(data)
+        else:
+            self.loop._unwatch(fd)
+            del self.open_fds[fd]
+        self._check()
+
+    def _needs_check_soon(self):
+        return not self.open_fds  # Pipes are closed, only waiting on the process to exit.
+
+    def _check(self):
+        if not self.open_fds and self.process.poll() is not None:
+            self.process.stdout.close()
+            self.process.stderr.close()
+            self._complete(self.process.returncode)
+
+    def _abort(self):
+        for fd in self.open_fds:
+            self.loop._unwatch(fd)
+        self.open_fds = {}
+        if self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+        self.process.stdout.close()
+        self.process.stderr.close()
+
+
+class _GatherTask(Task):
+    """
+    Finishes when all children finish, with a list of their results. If one child fails the others are cancelled.
+    """
+    def __init__(self, loop, tasks, timeout=None):
+        Task.__init__(self, loop, 'gather(%s)' % len(tasks), timeout)
+        self.tasks = list(tasks)
+        self.remaining = len(self.tasks)
+        if not self.tasks:
+            self._finish([])
+        for task in self.tasks:
+            task.add_done_callback(self._child_done)
+
+    def _child_done(self, task):
+        if self._done:
+            return
+        if task.exception() is not None:
+            self._abort()
+            self._finish(exception=task.exception())
+            return
+        self.remaining -= 1
+        if self.remaining == 0:
+            self._finish([t.result() for t in self.tasks])
+
+    def _abort(self):
+        for task in self.tasks:
+            task.cancel()
+
+
+class _CoroutineTask(Task):
+    """
+    Drives a generator coroutine. The coroutine may yield a Task, a list of Tasks (waits for all of them) or a number
+    of seconds to sleep. Cancelling the coroutine cancels whatever it is waiting on and raises TaskCancelled (or
+    TimeoutException) inside it, so try/finally blocks in the coroutine run.
+    """
+    def __init__(self, loop, coroutine, name=None, timeout=None):
+        Task.__init__(self, loop, name or getattr(coroutine, '__name__', 'coroutine'), timeout)
+        self.coroutine = coroutine
+        self.waiting_on = None
+        loop._call_soon(self._step)
+
+    def _step(self, value=None, exception=None):
+        if self._done:
+            return
+        self.waiting_on = None
+        try:
+            if exception is not None:
+                yielded = self.coroutine.throw(exception)
+            else:
+                yielded = self.coroutine.send(value)
+        except Return as r:
+            self._finish(r.value)
+            return
+        except StopIteration:
+            self._finish(None)
+            return
+        except Exception as e:
+            self._finish(exception=e)
+            return
+
+        if isinstance(yielded, (list, tuple)):
+            yielded = _GatherTask(self.loop, yielded)
+        elif isinstance(yielded, (int, long, float)):
+            yielded = _SleepTask(self.loop, yielded)
+        elif not isinstance(yielded, Task):
+            self.loop._call_soon(self._step, None, TypeError('Coroutine %s yielded %r, expected a Task.' % (self.name, yielded)))
+            return
+
+        self.waiting_on = yielded
+        yielded.add_done_callback(self._wakeup)
+
+    def _wakeup(self, task):
+        if task is not self.waiting_on:
+            return
+        if task.exception() is not None:
+            self._step(exception=task.exception())
+        else:
+            self._step(task.result())
+
+    def cancel(self, exception=None):
+        if self._done:
+            return False
+        exception = exception or TaskCancelled('Cancelled: %s' % self.name)
+        if self.waiting_on is not None:
+            waiting_on, self.waiting_on = self.waiting_on, None
+            waiting_on.cancel()
+
+        # Give the coroutine a chance to clean up. If it swallows the exception and waits on something else, that is
+        # cancelled too and the coroutine is closed, it's finished anyway.
+        try:
+            yielded = self.coroutine.throw(exception)
+        except Return as r:
+            Task._finish(self, r.value)
+            return True
+        except StopIteration:
+            pass
+        except Exception as e:
+            exception = e
+        else:
+            self._cancel_yielded(yielded)
+            try:
+                self.coroutine.close()
+            except RuntimeError as e:
+                report('Coroutine %s kept running after being cancelled: %s' % (self.name, e), level='warning')
+        self._finish(exception=exception)
+        return True
+
+    @staticmethod
+    def _cancel_yielded(yielded):
+        # Whatever the coroutine yields is already scheduled, nobody will wait on it now.
+        for task in yielded if isinstance(yielded, (list, tuple)) else [yielded]:
+            if isinstance(task, Task):
+                task.cancel()
+
+
+class ExecutionLoop(object):
+    """
+    Event loop for remote (rpc), local (shell) and transfer (scp) commands. Not thread safe, use it from one thread.
+    """
+    def __init__(self, max_workers=16):
+        """
+        :param max_workers: Size of the worker pool used for SSH handshakes and file transfers.
+        """
+        self.max_workers = max_workers
+        self._pool = None
+        self._tasks = set()
+        self._ready = collections.deque()
+        self._watched = {}  # fd -> task
+        self._completions = Queue.Queue()  # (task, result, exception) posted by the worker pool.
+        self._wake_read, self._wake_write = os.pipe()
+        for fd in (self._wake_read, self._wake_write):
+            flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+            fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        self._poller = select.poll()
+        self._poller.register(self._wake_read, select.POLLIN)
+
+    # Coroutine versions of rpc, shell and scp. Each returns a Task, yield it from a coroutine to wait for it.
+
+    def rpc(self, ip, command, user, password=None, key=None, timeout=60*20, no_tty=False, suppress_output=False, suppress_errors=False, on_line=None):
+        """
+        Runs a command on a remote host over a pooled SSH connection.
+        :param timeout: Seconds the command may take. None for no limit (e.g. tail -f).
+        :param on_line: callback(stream, line), stream being 'out' or 'err'. Called on the loop thread as lines arrive;
+                        the output is then not kept, so the result's out and err are empty.
+        :return: Task with an RPCResult(out, err, exit_status, elapsed) result.
+        """
+        return _RemoteCommandTask(self, ip, command, user, password, key, timeout, no_tty, suppress_output, suppress_errors, on_line)
+
+    def shell(self, command, workdir=None, timeout=60*20, suppress_output=False, suppress_errors=False):
+        """
+        Runs a command locally on the Geppetto host.
+        :return: Task with an RPCResult(out, err, exit_status, elapsed) result.
+        """
+        return _ShellTask(self, command, workdir or os.getcwd(), timeout, suppress_output, suppress_errors)
+
+    def scp(self, from_path, to_path, password=None, key=None, is_dir=False, timeout=60*20, suppress_output=False, suppress_errors=False):
+        """
+        Copies files with common.scp in the worker pool.
+        :return: Task with the (out, err) result of common.scp.
+        """
+        kwargs = {'is_dir': is_dir, 'timeout': timeout, 'suppress_output': suppress_output, 'suppress_errors': suppress_errors}
+        return _WorkerTask(self, 'scp %s %s' % (from_path, to_path), timeout, scp, (from_path, to_path, password, key), kwargs)
+
+    def run_in_worker(self, fn, *args, **kwargs):
+        """
+        Runs any other blocking function in the worker pool.
+        :return: Task with the function's return value as result.
+        """
+        return _WorkerTask(self, getattr(fn, '__name__', 'worker'), None, fn, args, kwargs)
+
+    def sleep(self, seconds):
+        return _SleepTask(self, seconds)
+
+    def gather(self, tasks, timeout=None):
+        return _GatherTask(self, tasks, timeout)
+
+    def spawn(self, coroutine, name=None, timeout=None):
+        """
+        Schedules a generator coroutine on the loop.
+        :param timeout: Seconds until the coroutine is cancelled with a TimeoutException.
+        :return: Task with the coroutine's Return value as result.
+        """
+        return _CoroutineTask(self, coroutine, name, timeout)
+
+    # Sync facade.
+
+    def run_until_complete(self, tasks, timeout=None):
+        """
+        Runs the loop until the given task (or list of tasks) is done.
+        :param timeout: Overall deadline in seconds. Everything still running is cancelled when it passes.
+        :return: Result of the task, or list of results. Raises the task's exception if it failed.
+        """
+        if isinstance(tasks, (list, tuple)):
+            task = self.gather(tasks)
+        else:
+            task = tasks
+
+        deadline = time.time() + timeout if timeout is not None else None
+        try:
+            while not task.done():
+                if deadline is not None and time.time() >= deadline:
+                    task.cancel(TimeoutException('Timed out after %s seconds: %s' % (timeout, task.name)))
+                    break
+                self._run_once(deadline)
+        except (KeyboardInterrupt, SystemExit):
+            self.cancel_all()
+            raise
+
+        return task.result()
+
+    def cancel_all(self):
+        for task in list(self._tasks):
+            task.cancel()
+        self._run_ready()
+
+    def close(self):
+        self.cancel_all()
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool = None
+        os.close(self._wake_read)
+        os.close(self._wake_write)
+
+    # Internals.
+
+    def _run_once(self, deadline=None):
+        self._run_ready()
+
+        # Work out how long poll may block: until the nearest task deadline, but never long, since some things
+        # (a process exit after its pipes closed, a sleep) don't wake poll up.
+        timeout = 0.5
+        if self._ready:
+            timeout = 0
+        elif any(t._needs_check_soon() for t in self._tasks):
+            timeout = 0.01
+        now = time.time()
+        for task_deadline in [t.deadline for t in self._tasks if t.deadline is not None] + [deadline]:
+            if task_deadline is not None:
+                timeout = max(0, min(timeout, task_deadline - now))
+        for task in self._tasks:
+            if isinstance(task, _SleepTask):
+                timeout = max(0, min(timeout, task.wake_time - now))
+
+        try:
+            events = self._poller.poll(timeout * 1000)
+        except select.error:
+            events = []  # Interrupted by a signal.
+
+        for fd, _ in events:
+            if fd == self._wake_read:
+                try:
+                    while os.read(self._wake_read, 4096):
+                        pass
+                except OSError:
+                    pass
+                continue
+            task = self._watched.get(fd)
+            if task is not None:
+                task._on_readable(fd)
+
+        while True:
+            try:
+                task, result, exception = self._completions.get_nowait()
+            except Queue.Empty:
+                break
+            task._on_worker_done(result, exception)
+
+        now = time.time()
+        for task in list(self._tasks):
+            if task.done():
+                continue
+            if task.deadline is not None and now >= task.deadline:
+                task.cancel(TimeoutException('Timed out after %.0f seconds: %s' % (now - task.start_time, task.name)))
+            else:
+                task._check()
+
+        self._run_ready()
+
+    def _run_ready(self):
+        while self._ready:
+            fn, args = self._ready.popleft()
+            fn(*args)
+
+    def _call_soon(self, fn, *args):
+        self._ready.append((fn, args))
+
+    def _task_finished(self, task):
+        self._tasks.discard(task)
+
+    def _watch(self, fd, task):
+        self._watched[fd] = task
+        self._poller.register(fd, select.POLLIN | select.POLLHUP | select.POLLERR)
+
+    def _unwatch(self, fd):
+        if self._watched.pop(fd, None) is not None:
+            self._poller.unregister(fd)
+
+    def _submit(self, task, fn, args, kwargs):
+        if self._pool is None:
+            self._pool = multiprocessing.pool.ThreadPool(self.max_workers)
+
+        def run():
+            try:
+                result = fn(*args, **kwargs)
+                self._completions.put((task, result, None))
+            except Exception as e:
+                self._completions.put((task, None, e))
+            try:
+                os.write(self._wake_write, 'x')
+            except OSError:
+                pass  # Pipe full, the loop is awake anyway. Or closed, the loop is gone.
+
+        self._pool.apply_async(run)
+
+
+def run_coroutine(coroutine, timeout=None, max_workers=16):
+    """
+    Sync facade: runs one coroutine on a fresh loop and returns its result.
+    :param coroutine: Generator, or a function taking the loop and returning a generator.
+    :param timeout: Overall deadline in seconds.
+    """
+    loop = ExecutionLoop(max_workers)
+    try:
+        if callable(coroutine):
+            coroutine = coroutine(loop)
+        return loop.run_until_complete(loop.spawn(coroutine), timeout)
+    finally:
+        loop.close()
@@ -0,0 +1,208 @@
+"""
+The MIT License (MIT)
+Copyright (c) Datos IO, Inc. 2015.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit
+persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the
+Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+
+
+import os
+import json
+import time
+import uuid
+import threading
+
+
+from common import report, rpc, wait_for_ssh_ready
+
+# Survives the test process, so faults of a run that died can still be rolled back by the next one.
+JOURNAL_FILE = os.path.expanduser('~/.geppetto/fault_journal.jsonl')
+
+# Tags the entries of one run. Set in the environment, so forked workers and subprocesses of the run share it.
+RUN_ID_VARIABLE = 'GEPPETTO_RUN_ID'
+
+
+class FaultJournal(object):
+    """
+    On disk journal of injected faults. A fault is recorded, with the shell commands that undo it, before it is applied
+    and marked recovered once those have run. recover() replays whatever is still pending, so a run killed half way
+    through a failure scenario doesn't leave nodes with their interface down, a netem qdisc or firewall rules in place.
+
+    The file is JSON lines: {"op": "inject", "id": ..., "ip": ..., "recover": [commands], ...} and {"op": "resolve",
+    "id": ...}. Recovery commands must be idempotent; they may run more than once.
+    """
+    def __init__(self, path=JOURNAL_FILE):
+        self.path = path
+        self.run_id = os.environ.setdefault(RUN_ID_VARIABLE, uuid.uuid4().hex)
+        self._passwords = {}  # id -> password, kept in memory only.
+        self._injectors = []  # Background fault injectors, see track().
+        self._lock = threading.RLock()
+
+    def _append(self, entry):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(entry, sort_keys=True) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def record(self, fault, ip, recover_commands, user, password=None, key=None, wait_for_ssh=False, note=''):
+        """
+        Journals a fault. Call right before applying it.
+        :param recover_commands: Idempotent shell commands, run on ip in order, that undo the fault.
+        :param wait_for_ssh: The node may be unreachable for a while (reboot, interface down), wait for SSH first.
+        :return: Entry id to resolve() once the fault is recovered.
+        """
+        entry_id = uuid.uuid4().hex
+        entry = {
+            'op': 'inject',
+            'id': entry_id,
+            'time': round(time.time(), 3),
+            'pid': os.getpid(),
+            'run': self.run_id,
+            'fault': fault,
+            'ip': ip,
+            'user': user,
+            'key': key,
+            'recover': list(recover_commands),
+            'wait_for_ssh': wait_for_ssh,
+            'note': note,
+        }
+        with self._lock:
+            self._append(entry)
+            self._passwords[entry_id] = password
+        return entry_id
+
+    def resolve(self, entry_id):
+        """
+        Marks a fault as recovered.
+        """
+        if entry_id is None:
+            return
+        with self._lock:
+            self._append({'op': 'resolve', 'id': entry_id, 'time': round(time.time(), 3)})
+            self._passwords.pop(entry_id, None)
+
+    def pending(self, pid=None, run=None):
+        """
+        :param pid: Only faults injected by this process.
+        :param run: Only faults injected by this run (run_id), i.e. the test process and every worker it started.
+        :return: Unresolved inject entries, oldest first.
+        """
+        with self._lock:
+            if not os.path.exists(self.path):
+                return []
+            entries = []
+            resolved = set()
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # Torn last line of a process that died mid write.
+                    if entry.get('op') == 'resolve':
+                        resolved.add(entry['id'])
+                    elif entry.get('op') == 'inject':
+                        entries.append(entry)
+            return [entry for entry in entries if entry['id'] not in resolved and (pid is None or entry['pid'] == pid) and
+                    (run is None or entry.get('run') == run)]
+
+    def recover(self, pid=None, entry_ids=None, credentials=None, ssh_timeout=60*10, run=None):
+        """
+        Runs the recovery commands of pending faults, newest first, and resolves those that succeed.
+        :param pid: Only faults injected by this process.
+        :param run: Only faults injected by this run, see pending().
+        :param entry_ids: Only these faults.
+        :param credentials: Callable ip -> (user, password, key) or None, for faults journaled by another process,
+                            whose password isn't known here.
+        :return: (number recovered, number failed)
+        """
+        # Snapshot under the lock, then do the slow SSH work without it so record() and resolve() from other threads
+        # don't wait on a node that takes minutes to come back.
+        with self._lock:
+            entries = self.pending(pid, run)
+            if entry_ids is not None:
+                entries = [entry for entry in entries if entry['id'] in entry_ids]
+            passwords = dict(self._passwords)
+
+        recovered = failed = 0
+        for entry in reversed(entries):
+            ip = entry['ip']
+            user, password, key = entry['user'], passwords.get(entry['id']), entry['key']
+            if entry['id'] not in passwords and credentials is not None:
+                user, password, key = credentials(ip) or (user, password, key)
+
+            report('Recovering %s on {%s} injected at %s.' % (entry['fault'], ip, time.ctime(entry['time'])), 'warning')
+            if entry['wait_for_ssh'] and not wait_for_ssh_ready(ip, user, password, key, timeout=ssh_timeout):
+                report('Could not reach {%s} to recover %s.' % (ip, entry['fault']), 'critical')
+                failed += 1
+                continue
+
+            ok = True
+            for command in entry['recover']:
+                _, err, exit_status = rpc(ip, command, user, password, key, timeout=60*5, retries=2, return_exit_status=True)
+                if exit_status != 0:
+                    report('Recovery of %s on {%s} failed: %s' % (entry['fault'], ip, err), 'critical')
+                    ok = False
+                    break
+
+            if ok:
+                self.resolve(entry['id'])
+                recovered += 1
+            else:
+                failed += 1
+
+        with self._lock:
+            if not self.pending():
+                self.clear()
+        return recovered, failed
+
+    def track(self, injector):
+        """
+        Registers something that injects faults in the background (e.g. a ChaosScheduler), so stop_injectors() can halt
+        it before the journal is replayed. Anything with a stop() method.
+        """
+        with self._lock:
+            self._injectors.append(injector)
+
+    def untrack(self, injector):
+        with self._lock:
+            if injector in self._injectors:
+                self._injectors.remove(injector)
+
+    def stop_injectors(self):
+        """
+        Stops every tracked injector, so none of them injects a new fault after recover() rolled the old ones back.
+        """
+        with self._lock:
+            injectors = list(self._injectors)
+        for injector in injectors:
+            try:
+                injector.stop()
+            except Exception as e:
+                report('Could not stop fault injector %s: %s' % (injector, e), 'critical')
+            self.untrack(injector)
+
+    def clear(self):
+        """
+        Drops the journal. Only once nothing in it is pending.
+        """
+        with self._lock:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+
+journal = FaultJournal()
@@ -7,7 +7,8 @@ permission is obtained from Datos IO, Inc.
 """
 
 
-from common import get_hostname_ip, shell, rpc
+from common import get_hostname_ip, shell, rpc_many
+from fault_journal import journal
 
 
 class Firewall(object):
@@ -17,6 +18,7 @@ class Firewall(object):
         self.password = password
         self.key = key
         self.host = get_hostname_ip()
+        self.journal_ids = []  # Fault journal entries of the rules blocking ports, resolved by clear().
 
         if not self.ips:
             self.cli = shell
@@ -26,8 +28,7 @@ class Firewall(object):
             self.cli = self._rpc_mask
 
     def _rpc_mask(self, command, suppress_output=False, no_tty=False, timeout=60 * 20):
-        for ip in self.ips:
-            rpc(ip, command, self.username, self.password, self.key, timeout, no_tty=no_tty, suppress_output=suppress_output)
+        return rpc_many(self.ips, command, self.username, self.password, self.key, timeout, no_tty=no_tty, suppress_output=suppress_output)
 
     def activate(self):
         self.cli('sudo service iptables start')
@@ -41,10 +42,17 @@ class Firewall(object):
 
     def port_block(self, port, connection_type='tcp'):
         assert connection_type in ['tcp', 'udp']
-        self.cli('iptables -A INPUT -p %s --dport %s -j DROP' % (connection_type, port))
+        rule = 'INPUT -p %s --dport %s -j DROP' % (connection_type, port)
+        if self.cli == self._rpc_mask:  # The journal replays over SSH, so only remote nodes are journaled.
+            for ip in self.ips:
+                self.journal_ids.append(journal.record('port_block', ip, ['while sudo iptables -D %s 2>/dev/null; do :; done' % rule],
+                                                       self.username, self.password, self.key))
+        self.cli('iptables -A %s' % rule)
 
     def clear(self):
         self.cli('sudo iptables --flush')
+        while self.journal_ids:
+            journal.resolve(self.journal_ids.pop())
 
     def save(self):
         self.cli('sudo service iptables save')
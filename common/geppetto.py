@@ -30,6 +30,7 @@ import multiprocessing
 
 import common
 from common import report, email, update_status, seconds_to_days_hours_min_sec_string
+from fault_journal import journal
 
 
 class Geppetto(object):
@@ -37,6 +38,8 @@ class Geppetto(object):
     Parent class of Test Runner. Implements many instance variable and Geppetto utils.
     """
     def __init__(self):
+        common.clear_logs()  # Make sure we're starting with clean log files.
+
         self.test_name = ''
         self.config_name = ''
         self.configuration_dict = ''
@@ -118,9 +121,34 @@ class Geppetto(object):
         :return:
         """
         report(' ', no_date=True, no_level=True)
+
+        self.close_databases()
+
+        # Roll back faults this run (this process and the workers it started) left in place, e.g. when it died in the
+        # middle of a failure scenario. Stop background injectors first, so none adds a fault after the rollback.
+        journal.stop_injectors()
+        if journal.pending(run=journal.run_id):
+            report('Recovering faults left behind by this run.', 'critical')
+            recovered, failed = journal.recover(run=journal.run_id)
+            if failed:
+                common.add_test_note('%s faults could not be recovered, run "python -m recover -c <config>".' % failed)
+
         update_status('Test Complete')
         self.complete()
 
+    def close_databases(self):
+        """
+        Closes every database cluster the test created: stops their fault schedules and metrics collection and drops
+        their client sessions.
+        """
+        databases = common.global_vars['databases']
+        while databases:
+            database = databases.pop()
+            try:
+                database.close()
+            except Exception as e:
+                report('Could not close database %s: %s' % (database, e), 'critical')
+
     def send_update(self, datos=None):
         """
         Sends an email update with status of run.
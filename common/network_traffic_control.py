@@ -17,7 +17,8 @@ OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
 """
 
 
-from common import report, get_hostname_ip, shell, rpc
+from common import report, get_hostname_ip, shell, rpc, rpc_many
+from fault_journal import journal
 
 
 class NetworkTrafficControl(object):
@@ -27,6 +28,7 @@ class NetworkTrafficControl(object):
         self.password = password
         self.key = key
         self.host = get_hostname_ip()
+        self.journal_ids = {}  # ip -> fault journal entries of its netem qdiscs, resolved by reset().
 
         if not self.ips:
             self.cli = shell
@@ -37,17 +39,30 @@ class NetworkTrafficControl(object):
 
     def _rpc_mask(self, command, ip=None, suppress_output=False, no_tty=False, timeout=60 * 20):
         if ip:
-            rpc(ip, command, self.username, self.password, self.key, timeout, no_tty=no_tty, suppress_output=suppress_output)
+            return rpc(ip, command, self.username, self.password, self.key, timeout, no_tty=no_tty, suppress_output=suppress_output)
         else:
-            for ip in self.ips:
-                rpc(ip, command, self.username, self.password, self.key, timeout, no_tty=no_tty, suppress_output=suppress_output)
+            return rpc_many(self.ips, command, self.username, self.password, self.key, timeout, no_tty=no_tty, suppress_output=suppress_output)
 
-    def slow(self, delay=200, ip=None):
-        self.cli('tc qdisc add dev eth0 root netem delay %sms' % delay, ip=ip)
+    @staticmethod
+    def recover_command(interface='eth0'):
+        """
+        Idempotent command removing the netem qdisc of slow(): succeeds if there is none, fails if it can't be removed.
+        """
+        return '! tc qdisc show dev %s | grep -q netem || sudo tc qdisc del dev %s root' % (interface, interface)
 
-    def status(self, ip=None):
-        self.cli('tc -s qdisc ls dev eth0', ip=ip)
+    def slow(self, delay=200, ip=None, interface='eth0'):
+        if self.cli == self._rpc_mask:  # The journal replays over SSH, so only remote nodes are journaled.
+            for target in [ip] if ip else self.ips:
+                entry_id = journal.record('netem', target, [self.recover_command(interface)], self.username, self.password, self.key)
+                self.journal_ids.setdefault(target, []).append(entry_id)
+        self.cli('sudo tc qdisc add dev %s root netem delay %sms' % (interface, delay), ip=ip)
 
-    def reset(self, ip=None):
-        self.cli('sudo tc qdisc del dev eth0 root', ip=ip)
-        self.cli('tc -s qdisc ls dev eth0', ip=ip)
+    def status(self, ip=None, interface='eth0'):
+        self.cli('tc -s qdisc ls dev %s' % interface, ip=ip)
+
+    def reset(self, ip=None, interface='eth0'):
+        self.cli('sudo tc qdisc del dev %s root' % interface, ip=ip)
+        self.cli('tc -s qdisc ls dev %s' % interface, ip=ip)
+        for target in [ip] if ip else self.ips:
+            for entry_id in self.journal_ids.pop(target, []):
+                journal.resolve(entry_id)
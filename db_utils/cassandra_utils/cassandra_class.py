@@ -17,19 +17,30 @@ OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
 """
 
 
+import os
 import sys
+import json
 import time
 import threading
+import collections
 from random import randint
 
 
 import common.common
-from common.common import report, rpc, scp, pause_execution_for_input
+from common.common import report, rpc, rpc_many, deliver_files, transfer_many, pause_execution_for_input, \
+    wait_until, wait_for_port
+from common.execution_loop import ExecutionLoop, Return
 from db_utils.database import DatabaseCluster
 from common.network_traffic_control import NetworkTrafficControl
 from db_utils.cassandra_utils.failures import CassandraFailures
+from db_utils.cassandra_utils.cluster_state import ClusterState
+from db_utils.cassandra_utils.node_metrics import MetricsCollector, parse_cfstats
 from db_utils.cassandra_utils.data_population import CassandraTestingCluster, do_insert
 
+# Latency and throughput snapshots written by the population workloads on the nodes, see collect_population_metrics().
+MASS_METRICS_FILE = '/tmp/mass_population_metrics.jsonl'
+DELTA_METRICS_FILE = '/tmp/delta_population_metrics.jsonl'
+
 
 class Cassandra(DatabaseCluster):  # TODO: (Aaron) Handle non service installs.
     def __init__(self, source_params):
@@ -66,6 +77,14 @@ class Cassandra(DatabaseCluster):  # TODO: (Aaron) Handle non service installs.
         self.db_user = source_params['db_user'] if 'db_user' in source_params else ''
         self.db_pass = source_params['db_pass'] if 'db_pass' in source_params else ''
 
+        # Optional driver routing and pool sizing, see CassandraTestingCluster.
+        driver_params = ['local_dc', 'protocol_version', 'core_connections', 'max_connections', 'max_requests_per_connection']
+        self.driver_options = dict((param, source_params[param]) for param in driver_params if param in source_params)
+
+        # nodetool status snapshot shared by status(), the failure scenarios and waiters.
+        self.cluster_state = ClusterState(self._fetch_nodetool_status, ttl=source_params.get('status_ttl', 5.0))
+        self.native_port = source_params.get('native_port', 9042)
+
         # Create a faults instance.
         self.failures = CassandraFailures(self)
 
@@ -74,68 +93,230 @@ class Cassandra(DatabaseCluster):  # TODO: (Aaron) Handle non service installs.
 
         self.do_delta_population = False
         self.do_mass_population = False
+        self.delta_populations = {}  # keyspace.table -> ip of the node running its delta population.
+
+        self.metrics_collector = None  # See start_metrics_collection().
+
+        # Driver session shared by query(), remove() etc. Connected on first use, see _get_cluster().
+        self._cluster = None
+        self._cluster_lock = threading.Lock()
+
+    def _get_cluster(self, reconnect=False):
+        """
+        Returns the long lived CassandraTestingCluster, connecting it first if needed.
+        :param reconnect: Throw away the current session and connect a new one.
+        :return: Connected CassandraTestingCluster, or None if the cluster can't be reached.
+        """
+        with self._cluster_lock:
+            if reconnect and self._cluster is not None:
+                self._cluster.disconnect()
+                self._cluster = None
+
+            if self._cluster is None:
+                cluster = CassandraTestingCluster(list(self.ips), self.db_user, self.db_pass, **self.driver_options)
+                if not cluster.connect():
+                    return None
+                self._cluster = cluster
+
+            return self._cluster
+
+    def _script_options(self):
+        """
+        Returns the data_population.py options for authentication, routing and pool sizing.
+        """
+        options = []
+        if self.db_user:
+            options.append('--db_user %s --db_pass %s' % (self.db_user, self.db_pass))
+        for option, value in sorted(self.driver_options.items()):
+            options.append('--%s %s' % (option, value))
+        return ' '.join(options)
+
+    def close(self):
+        """
+        Recovers scheduled faults, shuts down metrics collection and the driver session. Call at test teardown.
+        """
+        self.failures.stop_schedules()
+        self.stop_metrics_collection()
+        with self._cluster_lock:
+            if self._cluster is not None:
+                self._cluster.disconnect()
+                self._cluster = None
 
     def _deliver_payload(self):
         """
         Delivers population scripts and other goodies to the cassandra source cluster. Most stored in ~/.geppetto/
         """
-        common_script_path = '%s/common/common.py' % (common.common.global_vars['geppetto_install_dir'])
-        population_script_path = '%s/db_utils/cassandra_utils/data_population.py' % (common.common.global_vars['geppetto_install_dir'])
-        schema_folder_path = '%s/db_utils/cassandra_utils/schema' % (common.common.global_vars['geppetto_install_dir'])
-        for ip in self.ips:
-            report('Updating Geppetto payload on {%s}.' % ip)
-            to_path = '%s@%s:~/.geppetto/' % (self.username, ip)
-            # rpc(ip, 'rm -rf ~/.geppetto', self.username, self.password, self.key, suppress_output=True)
-            rpc(ip, 'mkdir -p ~/.geppetto/common', self.username, self.password, self.key, suppress_output=True)
-            rpc(ip, 'touch ~/.geppetto/common/__init__.py', self.username, self.password, self.key, suppress_output=True)
-            scp(common_script_path, '%s/common/' % to_path, self.password, self.key, suppress_output=True)
-            scp(population_script_path, to_path, self.password, self.key, suppress_output=True)
-            scp(schema_folder_path, to_path, self.password, self.key, is_dir=True, suppress_output=True)
+        install_dir = common.common.global_vars['geppetto_install_dir']
+        files = {
+            'common/__init__.py': '%s/common/__init__.py' % install_dir,
+            'common/common.py': '%s/common/common.py' % install_dir,
+            'data_population.py': '%s/db_utils/cassandra_utils/data_population.py' % install_dir,
+        }
+        schema_folder_path = '%s/db_utils/cassandra_utils/schema' % install_dir
+        for file_name in os.listdir(schema_folder_path):
+            files['schema/%s' % file_name] = os.path.join(schema_folder_path, file_name)
+
+        # Only changed files get shipped, to all nodes at once.
+        results = deliver_files(self.ips, self.username, self.password, self.key, files, remote_dir='~/.geppetto')
+        for ip, shipped in results.items():
+            if shipped is None:
+                report('Could not update Geppetto payload on {%s}.' % ip, 'critical')
+                return False
+            if shipped:
+                report('Updated Geppetto payload on {%s}: %s' % (ip, ', '.join(shipped)))
 
         self.payload = True
         return True
 
-    def nodetool_status(self):
-        # Cycle through the nodes until we get a result from nodetool status.
-        for ip in self.source_params['ips']:
-            out, err = rpc(ip, "nodetool status | grep 'UN\|UL\|UJ\|UM\|DN\|DL\|DJ\|DM\|===='", self.username, self.password, self.key, suppress_output=True)
+    def _fetch_nodetool_status(self):
+        """
+        Runs nodetool status, cycling through the nodes until one answers.
+        :return: nodetool status output, or None if no node answered.
+        """
+        for ip in self.ips:
+            out, _ = rpc(ip, 'nodetool status', self.username, self.password, self.key, suppress_output=True)
             if any(x in out for x in ['UN', 'UL', 'UJ', 'UM', 'DN', 'DL', 'DJ', 'DM']):
                 return out
+        return None
+
+    def nodetool_status(self, max_age=None):
+        """
+        :param max_age: Accept a cached result up to this many seconds old, see ClusterState.nodes().
+        :return: The datacenter and node lines of nodetool status.
+        """
+        self.cluster_state.nodes(max_age)
+        out = self.cluster_state.raw
+        if out:
+            return '\n'.join(line for line in out.splitlines()
+                              if any(x in line for x in ['UN', 'UL', 'UJ', 'UM', 'DN', 'DL', 'DJ', 'DM', '====']))
         response = pause_execution_for_input('No status received from Cassandra Nodetool', level='info')
         if response == 'r':
-            self.nodetool_status()
+            return self.nodetool_status(max_age=0)
 
-    def cfstats(self):
-        # Cycle through the nodes until we get a result from nodetool cfstats.
-        for ip in self.ips:
-            out, _ = rpc(ip, "nodetool cfstats", self.username, self.password, self.key)
-            # TODO: (Aaron) finish ...
-            return out
+    def cfstats(self, keyspaces=None):
+        """
+        Table stats of every node, from all nodes at once.
+        :param keyspaces: Keyspaces to report, default all but the system keyspaces.
+        :return: OrderedDict of ip -> {'table.<ks>.<table>.<metric>': number, 'keyspace.<ks>.<metric>': number}, empty
+                 for nodes that didn't answer.
+        """
+        cmd = 'nodetool cfstats %s' % ' '.join(keyspaces or [])
+        results = rpc_many(self.ips, cmd, self.username, self.password, self.key, suppress_output=True)
+        return collections.OrderedDict((ip, parse_cfstats(result.out, keyspaces)) for ip, result in results.items())
+
+    def start_metrics_collection(self, path=None, interval=10, intervals=None, keyspaces=None):
+        """
+        Starts sampling tpstats, table stats, compactions, GC and heap of all nodes in the background, see
+        node_metrics.MetricsCollector. Read the file back with node_metrics.read_metrics().
+        :param path: Local time series file, default cassandra_metrics.jsonl in the test's log directory.
+        :param interval: Seconds between samples.
+        :param intervals: nodetool section -> seconds, to sample some sections less often.
+        """
+        if self.metrics_collector is not None:
+            return self.metrics_collector
+
+        if path is None:
+            path = os.path.join(common.common.global_vars['save_dir'] or '.', 'cassandra_metrics.jsonl')
+        self.metrics_collector = MetricsCollector(self.ips, self.username, self.password, self.key, path, interval=interval,
+                                                  intervals=intervals, keyspaces=keyspaces)
+        self.metrics_collector.start()
+        return self.metrics_collector
+
+    def stop_metrics_collection(self):
+        if self.metrics_collector is not None:
+            self.metrics_collector.stop()
+            self.metrics_collector = None
 
     def status(self):
         return self.nodetool_status()
 
     def db_stop(self, ip):
         rpc(ip, 'sudo service cassandra stop', self.username, self.password, self.key, timeout=60*2)
+        self.cluster_state.invalidate()
 
     def db_start(self, ip):
         rpc(ip, 'sudo service cassandra start', self.username, self.password, self.key, timeout=60*2)
+        self.cluster_state.invalidate()
 
     def node_reboot(self, ip):
         rpc(ip, 'sudo reboot now', self.username, self.password, self.key, timeout=60*2)
+        self.cluster_state.invalidate()
 
     def node_shutdown(self, ip):
         rpc(ip, 'sudo halt', self.username, self.password, self.key, timeout=60*2)
+        self.cluster_state.invalidate()
 
     def node_restore(self, ip):
         pass
 
+    def wait_until_all_up(self, ips=None, timeout=60*10):
+        """
+        Waits until nodetool status shows the nodes up and normal (UN) and they accept CQL connections.
+        :param ips: Nodes to wait for, defaults to all nodes of the cluster.
+        :return: True if they came up before the timeout.
+        """
+        ips = list(ips or self.ips)
+        deadline = time.time() + timeout
+        if not wait_until(lambda: self.cluster_state.all_up(ips, max_age=0), timeout=timeout, max_interval=15,
+                          description='{%s} up and normal' % ', '.join(ips)):
+            report(self.cluster_state.summary(), 'warning')
+            return False
+        return all(wait_for_port(ip, self.native_port, timeout=max(0, deadline - time.time())) for ip in ips)
+
+    def wait_until_node_down(self, ip, timeout=60*5):
+        """
+        Waits until the other nodes see ip as down or ip has left the ring.
+        :return: True if it went down before the timeout.
+        """
+        def is_down():
+            node = self.cluster_state.node(ip, max_age=0)
+            return node is None or node.status == 'down'
+
+        return wait_until(is_down, timeout=timeout, max_interval=10, description='{%s} down' % ip)
+
+    def wait_until_stopped(self, ips=None, timeout=60*2):
+        """
+        Waits until no Cassandra process runs on the nodes, for when nodetool can't tell because all of them are stopped.
+        :return: True if they all stopped before the timeout.
+        """
+        ips = list(ips or self.ips)
+
+        def stopped():
+            results = rpc_many(ips, 'pgrep -f [C]assandraDaemon', self.username, self.password, self.key, timeout=30,
+                               suppress_output=True, suppress_errors=True)
+            return all(result.exit_status == 1 for result in results.values())
+
+        return wait_until(stopped, timeout=timeout, max_interval=10, description='Cassandra stopped on {%s}' % ', '.join(ips))
+
+    def wait_for_port(self, ip, port=None, timeout=60*5):
+        """
+        Waits until ip accepts connections on port, the CQL native port by default.
+        """
+        return wait_for_port(ip, port or self.native_port, timeout=timeout)
+
+    def wait_for_gossip_settled(self, timeout=60*10, stable_polls=3):
+        """
+        Waits until no node is joining, leaving or moving and the ring as nodetool status shows it stopped changing for
+        stable_polls polls in a row.
+        :return: True if gossip settled before the timeout.
+        """
+        history = []
+
+        def settled():
+            nodes = self.cluster_state.nodes(max_age=0)
+            history.append(tuple(sorted((node.address, node.status, node.state) for node in nodes)))
+            del history[:-stable_polls]
+            return bool(nodes) and all(node.state == 'normal' for node in nodes) and \
+                len(history) == stable_polls and len(set(history)) == 1
+
+        return wait_until(settled, timeout=timeout, interval=2, max_interval=10, backoff=1.5, description='gossip settled')
+
     def shutdown(self):
         """
         Shutdown the whole db cluster.
         """
-        for ip in self.ips:
-            rpc(ip, 'sudo service cassandra stop', self.username, self.password, self.key, timeout=60*2)
+        rpc_many(self.ips, 'sudo service cassandra stop', self.username, self.password, self.key, timeout=60*2)
+        self.cluster_state.invalidate()
 
     def query(self, query, no_pause=False, suppress_reporting=False, retries=5):
         """
@@ -152,8 +333,8 @@ class Cassandra(DatabaseCluster):  # TODO: (Aaron) Handle non service installs.
         if query[-1] != ';':
             query += ' ;'
 
-        cluster = CassandraTestingCluster(self.ips, self.db_user, self.db_pass)
-        if not cluster.connect():
+        cluster = self._get_cluster()
+        if cluster is None:
             report('Error cannot connect to Cassandra cluster', 'critical')
             if not no_pause:
                 response = pause_execution_for_input('Error cannot connect to Cassandra cluster.')
@@ -186,40 +367,42 @@ class Cassandra(DatabaseCluster):  # TODO: (Aaron) Handle non service installs.
                 time.sleep(retry_time)
                 i += 1
 
+                # The driver reconnects to individual nodes by itself, only start over if it lost all of them.
+                if not cluster.isConnected():
+                    cluster = self._get_cluster(reconnect=True) or cluster
+
             # If retries did not produce successful query, then prompt user for input if we allow pausing.
             if not success and not no_pause:
                 response = pause_execution_for_input('Error')
                 if response == 'r':  # 'retry'.
                     result, success = self.query(query, retries=0)  # Only try once on manual retries.
 
-        cluster.disconnect()
-
         return result, success
 
-    def insert(self, mgmt_object, schema_file, record_size, start_record, record_count, uuid4=None, suppress_reporting=False, cluster=None):
+    def insert(self, mgmt_object, schema_file, record_size, start_record, record_count, uuid4=None, suppress_reporting=False, cluster=None, prepared=False):
         """
         Does batch inserts into db from geppetto node.
+        :param prepared: Bind typed values to prepared statements instead of building CQL strings.
         """
         if not cluster:
-            cluster = CassandraTestingCluster(self.ips, self.db_user, self.db_pass)
-            if not cluster.connect():
+            cluster = self._get_cluster()
+            if cluster is None:
                 report('ERROR: cannot connect to Cassandra cluster', 'critical')
                 sys.exit(-1)
 
         if uuid4:
             if not suppress_reporting : report('%s do_insert(%s, %s, %s, %s, %s, %s, %s)' % (self.name, 'cluster', mgmt_object, schema_file, record_size, start_record, record_count, uuid4))
-            do_insert(cluster, mgmt_object, schema_file, record_size, start_record, record_count, uuid4, suppress_output=suppress_reporting)
+            do_insert(cluster, mgmt_object, schema_file, record_size, start_record, record_count, uuid4, suppress_output=suppress_reporting, prepared=prepared)
         else:
             if not suppress_reporting : report('%s do_insert(%s, %s, %s, %s, %s, %s)' % (self.name, 'cluster', mgmt_object, schema_file, record_size, start_record, record_count))
-            do_insert(cluster, mgmt_object, schema_file, record_size, start_record, record_count, suppress_output=suppress_reporting)
+            do_insert(cluster, mgmt_object, schema_file, record_size, start_record, record_count, suppress_output=suppress_reporting, prepared=prepared)
 
-        if not cluster:
-            cluster.disconnect()
-
-    def mass_population(self, schema_file='~/.geppetto/schema/schema1.txt', record_size=1024, start_record=1, record_count=50, mgmt_object='ks1.table1', replication=3, on_max_nodes=3, async=True):
+    def mass_population(self, schema_file='~/.geppetto/schema/schema1.txt', record_size=1024, start_record=1, record_count=50, mgmt_object='ks1.table1', replication=3, on_max_nodes=3, async=True, prepared=False, workers=1, seed=None):
         """
         Sets mass population on the cassandra cluster. Runs a script on multiple nodes.
-
+        :param workers: Number of population processes the script forks on each node.
+        :param seed: Write reproducible rows that verify_population can check later.
+        :return: With async=False, True if the population succeeded on every node.
         """
         if 'geppetto/schema' not in schema_file:
             schema_file = '~/.geppetto/schema/cassandra/' + schema_file
@@ -233,18 +416,22 @@ class Cassandra(DatabaseCluster):  # TODO: (Aaron) Handle non service installs.
         population_ips = self.ips[:on_max_nodes]
 
         def mass_worker():
-            record_count_per_node = int(record_count / len(population_ips))
+            nodes_left = len(population_ips)
+            records_left = int(record_count)
             node_start_record = start_record
 
-            auth_string = ''
-            if self.db_user:
-                auth_string = '--db_user %s --db_pass %s' % (self.db_user, self.db_pass)
+            auth_string = self._script_options() + ' --metrics %s' % MASS_METRICS_FILE
 
             for ip in population_ips:
                 report('Setting mass population on cluster {%s} node {%s}.' % (self.name, ip), 'warning')
 
+                # Spread the remainder so no records are dropped.
+                record_count_per_node = records_left / nodes_left
+                records_left -= record_count_per_node
+                nodes_left -= 1
+
                 # Clean log first.
-                cmd = 'sudo rm /tmp/mass_population.log'
+                cmd = 'sudo rm -f /tmp/mass_population.log /tmp/mass_population.status %s' % MASS_METRICS_FILE
                 rpc(ip, cmd, self.username, self.password, self.key)
 
                 cmd = '(python ~/.geppetto/data_population.py ' \
@@ -255,133 +442,218 @@ class Cassandra(DatabaseCluster):  # TODO: (Aaron) Handle non service installs.
                       '-n %s ' \
                       '-t %s ' \
                       '--replication %s ' \
-                      ') > /tmp/mass_population.log &' % \
+                      '--workers %s %s' \
+                      '; echo $? > /tmp/mass_population.status) > /tmp/mass_population.log & echo $! > /tmp/mass_population.pid' % \
                       (ip, schema_file, auth_string,
                        record_size,
                        node_start_record,
                        record_count_per_node,
                        mgmt_object,
-                       replication)
+                       replication,
+                       workers,
+                       ('--prepared ' if prepared else '') + ('--seed %s ' % seed if seed is not None else ''))
 
                 node_start_record += record_count_per_node
 
                 rpc(ip, cmd, self.username, self.password, self.key, no_tty=True)  # No tty so we can run as bg & disconnect.
 
             if not async:
-                cmd = 'ps -ef | grep geppetto | grep -v grep | wc -l'
-                cmd2 = 'tail -1 /tmp/mass_population.log'
-                while True:
-                    try:
-                        report('Populating ...')
-
-                        processes_running = 0
-                        for ip in population_ips:
-                            out, err = rpc(ip, cmd, self.username, self.password, self.key, suppress_output=True)
-                            out2, err2 = rpc(ip, cmd2, self.username, self.password, self.key, suppress_output=True)
-                            report('<%s> %s' % (ip, out2))
-                            try:
-                                processes_running += int(out)
-                            except Exception as e:
-                                report(e, 'critical')
-                                raise
-                        if processes_running == 0:
-                            break
-                    except Exception as e:
-                        report(e, 'critical')
-                        break
-
-                    time.sleep(15)
-
-        mass_worker()
-
-    def delta_population(self, schema_file='~/.geppetto/schema/schema1.txt', record_size=1024, start_record=1, mgmt_object='ks1.table1', insert_percentage=70, bytes_per_hour=1, replication=3):
-        """
-        Creates a delta population on the cassandra cluster. Runs a script on one cassandra node and checks status.
+                # Follow each node's log until its population process exits, rather than polling ps and tail.
+                cmd = 'tail -n +1 -f /tmp/mass_population.log --pid=$(cat /tmp/mass_population.pid)'
+
+                # One coroutine per node, all multiplexed on the loop thread; only SSH handshakes use the worker pool.
+                loop = ExecutionLoop(max_workers=min(len(population_ips), 16))
+
+                def follow(ip):
+                    last = {'time': 0, 'line': ''}
+
+                    def on_line(stream, line):
+                        # Population logs a line every 100 rows, only pass on one every 15 seconds.
+                        if line.strip():
+                            last['line'] = line.strip()
+                            if time.time() - last['time'] >= 15:
+                                report('<%s> %s' % (ip, last['line']))
+                                last['time'] = time.time()
+
+                    yield loop.rpc(ip, cmd, self.username, self.password, self.key, timeout=None, suppress_output=True, on_line=on_line)
+                    result = yield loop.rpc(ip, 'cat /tmp/mass_population.status', self.username, self.password, self.key,
+                                            suppress_output=True, suppress_errors=True)
+                    if result.out.strip() != '0':
+                        report('<%s> Population failed with exit status %s. %s' % (ip, result.out.strip() or 'unknown', last['line']), 'error')
+                        raise Return(False)
+                    report('<%s> Population finished. %s' % (ip, last['line']))
+                    raise Return(True)
+
+                report('Populating ...')
+                try:
+                    return all(loop.run_until_complete([loop.spawn(follow(ip), 'follow %s' % ip) for ip in population_ips]))
+                except Exception as e:
+                    report(e, 'critical')
+                    return False
+                finally:
+                    loop.close()
+
+        return mass_worker()
+
+    def delta_population(self, schema_file='~/.geppetto/schema/schema1.txt', record_size=1024, start_record=1, mgmt_object='ks1.table1', insert_percentage=70, bytes_per_hour=1, replication=3, mix=None, distribution='uniform'):
+        """
+        Starts a long running, rate limited update workload on one cassandra node. It keeps bytes_per_hour with a token
+        bucket until stopped; change its rate or mix while it runs with set_delta_population().
         :param record_size: Record size.
         :param start_record: Starting record number.
         :param mgmt_object: keyspace.table format.
         :param insert_percentage: Insert percentage.
+        :param bytes_per_hour: Target write rate, at least one record (record_size bytes) per hour.
+        :param mix: Operation weights such as 'read=50,update=40,insert=10', instead of insert_percentage.
+        :param distribution: How existing records are picked: uniform, sequential, zipfian, latest or hotspot.
         :return:
         """
-
-        DELAY_MS = 1000
-        LOOP_MIN = 5  # Minimum of 1
-
         if not self.payload:
             self._deliver_payload()
 
         workload_ip = self.ips[randint(0, len(self.ips) - 1)]
+        control_file = '/tmp/delta_population_%s.json' % mgmt_object
 
-        # Need to start separate thread ...
         self.do_delta_population = True
+        self.delta_populations[mgmt_object] = workload_ip
+
+        # Stop a previous delta population of this table, in the case it is still going.
+        cmd = "ps -ef | grep -v grep | grep 'control %s' | awk '{print $2}' | xargs kill" % control_file
+        rpc(workload_ip, cmd, self.username, self.password, self.key)
+
+        auth_string = self._script_options() + ' --metrics %s' % DELTA_METRICS_FILE
+
+        cmd = 'rm -f %s ; (python ~/.geppetto/data_population.py ' \
+              '%s %s %s ' \
+              'update ' \
+              '-r %s ' \
+              '-s %s ' \
+              '-t %s ' \
+              '-i %s ' \
+              '--bytes_rate %s ' \
+              '--control %s ' \
+              '--replication %s ' \
+              '--distribution %s %s' \
+              ') > /tmp/delta_updater.log &' % \
+              (control_file,
+               workload_ip, schema_file, auth_string,
+               record_size,
+               start_record,
+               mgmt_object,
+               insert_percentage,
+               bytes_per_hour / 3600.0,
+               control_file,
+               replication,
+               distribution,
+               '--mix %s ' % mix if mix else '')
+
+        rpc(workload_ip, cmd, self.username, self.password, self.key, no_tty=True)  # No tty so we can run as bg & disconnect.
+        report('{%s} delta population set on node %s.' % (mgmt_object, workload_ip))
+
+    def set_delta_population(self, mgmt_object='ks1.table1', bytes_per_hour=None, insert_percentage=None, mix=None, stop=False):
+        """
+        Changes a running delta population without restarting it. Takes effect within a second.
+        :param mgmt_object: keyspace.table format.
+        :param bytes_per_hour: New target write rate, at least one record per hour. 0 pauses the workload.
+        :param insert_percentage: New insert percentage.
+        :param mix: New operation weights such as 'read=90,update=10'.
+        :param stop: End the workload.
+        """
+        if mgmt_object not in self.delta_populations:
+            report('No delta population running on %s.' % mgmt_object, 'warning')
+            return
 
-        # Do rate calculations.
-        records_per_hour = max(1, bytes_per_hour / record_size)
-        records_per_min = max(1, records_per_hour / 60)
-        records_per_interval = records_per_min * LOOP_MIN
+        settings = {}
+        if bytes_per_hour is not None:
+            settings['bytes_rate'] = bytes_per_hour / 3600.0
+            settings['rate'] = 0  # Applies if bytes_per_hour is 0.
+        if insert_percentage is not None:
+            settings['insert_percentage'] = insert_percentage
+        if mix is not None:
+            settings['mix'] = mix
+        if stop:
+            settings['stop'] = True
+
+        # Write and rename, so the workload never reads a half written file.
+        control_file = '/tmp/delta_population_%s.json' % mgmt_object
+        cmd = "echo '%s' > %s.tmp && mv %s.tmp %s" % (json.dumps(settings), control_file, control_file, control_file)
+        rpc(self.delta_populations[mgmt_object], cmd, self.username, self.password, self.key)
+
+    def verify_population(self, seed, schema_file='~/.geppetto/schema/schema1.txt', record_size=1024, start_record=1, record_count=50, mgmt_object='ks1.table1', version=0):
+        """
+        Checks rows written by mass_population(seed=...) against their regenerated values, from one cassandra node.
+        :param seed: Seed the rows were populated with. record_size must match the population too.
+        :return: True if every row was found with the expected content.
+        """
+        if 'geppetto/schema' not in schema_file:
+            schema_file = '~/.geppetto/schema/cassandra/' + schema_file
 
-        # Batch calculations.
-        num_batches = max(60 * 1, 60 * (LOOP_MIN - 1))  # We keep an empty minute at the end for everything to complete and reduce stress on system.
-        batch_size = max(1, records_per_interval / num_batches)
+        if not self.payload:
+            self._deliver_payload()
 
-        # If we don't need that many batches, recalculate the num_batches and batch_size.
-        if records_per_interval < num_batches:
-            num_batches = records_per_interval  # We know this should be done 1 minute before next loop.
-            batch_size = 1
+        auth_string = self._script_options()
 
-        # Build command to stop previous delta populations.
-        cmd1 = '''ps -ef | grep gepp | grep -v grep | grep %s | grep "\-b" | tr -s " " | cut -d" " -f2 | xargs kill''' % mgmt_object
+        ip = self.ips[0]
+        cmd = 'python ~/.geppetto/data_population.py %s %s %s verify -r %s -s %s -n %s -t %s --seed %s --version %s' % \
+              (ip, schema_file, auth_string, record_size, start_record, record_count, mgmt_object, seed, version)
+        out, err, exit_status = rpc(ip, cmd, self.username, self.password, self.key, timeout=60 * 60 * 12, return_exit_status=True)
+        if exit_status != 0:
+            # None means the check never ran (or its status was lost), which is no proof the rows are there either.
+            report('Population verify on {%s} failed with exit status %s.' % (ip, exit_status), 'error')
+            return False
+        return True
 
-        auth_string = ''
-        if self.db_user:
-            auth_string = '--db_user %s --db_pass %s' % (self.db_user, self.db_pass)
-
-        cmd2 = '(python ~/.geppetto/data_population.py ' \
-               '%s %s %s ' \
-               'update ' \
-               '-r %s ' \
-               '-s %s ' \
-               '-t %s ' \
-               '-i %s ' \
-               '-b %s ' \
-               '-d %s ' \
-               '-c %s ' \
-               '--replication %s ' \
-               ') > /tmp/delta_updater.log &' % \
-               (workload_ip, schema_file, auth_string,
-                record_size,
-                start_record,
-                mgmt_object,
-                insert_percentage,
-                batch_size,
-                DELAY_MS,
-                num_batches,
-                replication)
-
-        def delta_worker():
-            # Loop every 5 minutes and reinitialize delta.
-            while self.do_delta_population:
-                # Stop previous populations, in the case they are still going.
-                rpc(workload_ip, cmd1, self.username, self.password, self.key)
-                time.sleep(2)
-
-                # Start new batch of populations.
-                rpc(workload_ip, cmd2, self.username, self.password, self.key, no_tty=True)  # No tty so we can run as bg & disconnect.
-                report('{%s} delta population set on node %s.' % (mgmt_object, workload_ip))
-                time.sleep(60 * LOOP_MIN)  # Sleep LOOP_MIN min, allow delta to complete and settle, then cycle again. (A more dependable way)
-
-        t = threading.Thread(target=delta_worker)
-        t.setDaemon(True)
-        t.start()
+    def compare_tables(self, first, second, ranges=256, schema_file='~/.geppetto/schema/schema1.txt'):
+        """
+        Diffs two tables in keyspace.table format, from one cassandra node, by token range digests.
+        :return: True if both tables hold the same rows.
+        """
+        if 'geppetto/schema' not in schema_file:
+            schema_file = '~/.geppetto/schema/cassandra/' + schema_file
+
+        if not self.payload:
+            self._deliver_payload()
+
+        auth_string = self._script_options()
+
+        ip = self.ips[0]
+        cmd = 'python ~/.geppetto/data_population.py %s %s %s compare %s %s --ranges %s' % \
+              (ip, schema_file, auth_string, first, second, ranges)
+        out, err, exit_status = rpc(ip, cmd, self.username, self.password, self.key, timeout=60 * 60 * 12, return_exit_status=True)
+        if exit_status != 0:
+            report('Table compare %s / %s on {%s} failed with exit status %s.' % (first, second, ip, exit_status), 'error')
+            return False
+        return True
+
+    def collect_population_metrics(self, local_dir):
+        """
+        Copies the population metrics files (one JSON snapshot per line, see data_population.WorkloadMetrics) from every
+        node into local_dir, as <ip>_<file name>.
+        :return: List of local paths collected.
+        """
+        if not os.path.exists(local_dir):
+            os.makedirs(local_dir)
+
+        transfers = []
+        for ip in self.ips:
+            for remote_path in [MASS_METRICS_FILE, DELTA_METRICS_FILE]:
+                local_path = os.path.join(local_dir, '%s_%s' % (ip, os.path.basename(remote_path)))
+                transfers.append(('get', ip, self.username, local_path, remote_path, self.password, self.key))
+
+        # Nodes that ran no workload have no file; those transfers fail and are left out.
+        results = transfer_many(transfers, suppress_output=True)
+        return [transfer[3] for transfer, result in zip(transfers, results) if not isinstance(result, Exception)]
 
     def stop_mass_population(self):
         self.do_mass_population = False
         cmd = '''ps -ef | grep -v grep | grep geppetto | awk '{print $2}' | xargs kill -9'''
-        for ip in self.ips:
-            rpc(ip, cmd, self.username, self.password, self.key)
+        rpc_many(self.ips, cmd, self.username, self.password, self.key)
 
     def stop_delta_population(self):
         self.do_delta_population = False
+        for mgmt_object in self.delta_populations.keys():
+            self.set_delta_population(mgmt_object, stop=True)
+        self.delta_populations = {}
 
     def stop_population(self):
         """
@@ -397,10 +669,10 @@ class Cassandra(DatabaseCluster):  # TODO: (Aaron) Handle non service installs.
         """
         report('Cleaning data and commitlog directories for cluster {%s}' % (self.name), 'warning')
         cmd = 'sudo service cassandra stop'
-        for ip in self.ips:
-            rpc(ip, cmd, self.username, self.password, self.key)
+        rpc_many(self.ips, cmd, self.username, self.password, self.key)
+        self.cluster_state.invalidate()
 
-        time.sleep(10)
+        self.wait_until_stopped()
 
         cmd_list = [
             'rm -f ~/.__jmxcmd*',
@@ -408,17 +680,14 @@ class Cassandra(DatabaseCluster):  # TODO: (Aaron) Handle non service installs.
             'sudo rm -rf %s/*' % self.commitlog_dir,
             'sudo service cassandra start',
         ]
-        for ip in self.ips[:1]:
-            for cmd in cmd_list:
-                rpc(ip, cmd, self.username, self.password, self.key)
+        cmd = ' ; '.join(cmd_list)
 
-        time.sleep(30)
-
-        for ip in self.ips[1:]:
-            for cmd in cmd_list:
-                rpc(ip, cmd, self.username, self.password, self.key)
+        # Bring up the first node alone so the others have a seed to join.
+        rpc(self.ips[0], cmd, self.username, self.password, self.key)
+        self.wait_until_all_up(self.ips[:1])
 
-        time.sleep(30)
+        rpc_many(self.ips[1:], cmd, self.username, self.password, self.key)
+        self.wait_until_all_up()
         report('Status cluster {%s} \n %s' % (self.name, self.status()))
 
     def remove(self, ks, table=None):
@@ -477,11 +746,10 @@ class Cassandra(DatabaseCluster):  # TODO: (Aaron) Handle non service installs.
         self.query(cql)
 
     def get_compaction_history(self):
+        # Cycle through the nodes until one answers.
         cmd = 'nodetool compactionhistory'
         for ip in self.ips:
-            try:
-                out, err = rpc()
+            out, err, exit_status = rpc(ip, cmd, self.username, self.password, self.key, suppress_output=True, return_exit_status=True)
+            if exit_status == 0:
                 return out
-            except:
-                pass
         return ''
@@ -0,0 +1,360 @@
+"""
+The MIT License (MIT)
+Copyright (c) Datos IO, Inc. 2015.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit
+persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the
+Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+
+
+import json
+import time
+import heapq
+import random
+import threading
+import multiprocessing.pool
+
+
+from common.common import report, rpc, add_test_note, wait_for_ssh_ready
+from common.fault_journal import journal
+from common.network_traffic_control import NetworkTrafficControl
+
+
+# A fault schedule is a list of events, e.g.
+#
+#     [
+#         {'fault': 'db_stop', 'at': 60, 'duration': 300, 'target': 'random', 'jitter': 30},
+#         {'fault': 'netem', 'at': 120, 'duration': 600, 'target': 'all', 'delay': 200},
+#         {'fault': 'firewall', 'at': 400, 'duration': 120, 'target': 'random:2', 'port': 7000},
+#         {'fault': 'reboot', 'at': 900, 'target': '10.0.0.3'},
+#     ]
+#
+# at:       Seconds after the schedule starts.
+# duration: Seconds the fault lasts before it is recovered. Reboots recover as soon as the node is back.
+# jitter:   Up to this many seconds are added to at, at random.
+# target:   'random' (one node not already faulted, if there is one), 'random:N', 'all', 'node:<index>', an ip or a list
+#           of ips. Random targets are picked when the event fires, not when the schedule is built.
+# interface: Network interface of ifdown and netem faults, eth0 by default.
+#
+# Faults run from one scheduler thread; the injections and recoveries it fires run on a small pool of workers, so a
+# slow SSH call doesn't hold up the rest of the timeline and faults overlap as declared.
+
+
+class Fault(object):
+    """
+    A fault type: inject() breaks a node, recover() heals it. recover() must be safe to run more than once.
+    recover_commands() are the shell commands the fault journal replays if the process dies before recover() ran.
+    """
+    wait_for_ssh = False  # The node may be unreachable until the fault wears off.
+
+    def __init__(self, cassandra):
+        self.cassandra = cassandra
+
+    def _rpc(self, ip, command, timeout=60*2):
+        return rpc(ip, command, self.cassandra.username, self.cassandra.password, self.cassandra.key, timeout=timeout)
+
+    def inject(self, ip, event):
+        raise NotImplementedError()
+
+    def recover(self, ip, event):
+        raise NotImplementedError()
+
+    def recover_commands(self, event):
+        raise NotImplementedError()
+
+
+class DbStopFault(Fault):
+    def inject(self, ip, event):
+        self.cassandra.db_stop(ip)
+
+    def recover(self, ip, event):
+        self.cassandra.db_start(ip)
+
+    def recover_commands(self, event):
+        return ['sudo service cassandra start']
+
+
+class IfdownFault(Fault):
+    # The node can't be reached while its interface is down, so it brings the interface back up by itself.
+    wait_for_ssh = True
+
+    def inject(self, ip, event):
+        interface = event.get('interface', 'eth0')
+        self._rpc(ip, '(nohup sudo ifdown %s; sleep %s ; sudo ifup %s ; ) > /tmp/datos_failure.log 2>&1 &' % (
+            interface, int(event['duration']), interface))
+
+    def recover(self, ip, event):
+        wait_for_ssh_ready(ip, self.cassandra.username, self.cassandra.password, self.cassandra.key, timeout=60*10)
+        self._rpc(ip, self.recover_commands(event)[0])
+
+    def recover_commands(self, event):
+        return ['sudo ifup %s' % event.get('interface', 'eth0')]
+
+
+class RebootFault(Fault):
+    wait_for_ssh = True
+
+    def inject(self, ip, event):
+        self.cassandra.node_reboot(ip)
+
+    def recover(self, ip, event):
+        self.cassandra.wait_until_node_down(ip, timeout=60*2)
+        wait_for_ssh_ready(ip, self.cassandra.username, self.cassandra.password, self.cassandra.key, timeout=60*15)
+        self.cassandra.db_start(ip)
+
+    def recover_commands(self, event):
+        return ['sudo service cassandra start']
+
+
+class NetemFault(Fault):
+    def inject(self, ip, event):
+        self.cassandra.network.slow(event.get('delay', 200), ip=ip, interface=event.get('interface', 'eth0'))
+
+    def recover(self, ip, event):
+        self.cassandra.network.reset(ip=ip, interface=event.get('interface', 'eth0'))
+
+    def recover_commands(self, event):
+        return [NetworkTrafficControl.recover_command(event.get('interface', 'eth0'))]
+
+
+class FirewallFault(Fault):
+    def _rule(self, event):
+        return 'INPUT -p %s --dport %s -j DROP' % (event.get('protocol', 'tcp'), event.get('port', 7000))
+
+    def inject(self, ip, event):
+        self._rpc(ip, 'sudo iptables -I %s' % self._rule(event))
+
+    def recover(self, ip, event):
+        self._rpc(ip, self.recover_commands(event)[0])
+
+    def recover_commands(self, event):
+        # Delete every copy of the rule, in case it was injected more than once.
+        return ['while sudo iptables -D %s 2>/dev/null; do :; done' % self._rule(event)]
+
+
+FAULTS = {
+    'db_stop': DbStopFault,
+    'ifdown': IfdownFault,
+    'reboot': RebootFault,
+    'netem': NetemFault,
+    'firewall': FirewallFault,
+}
+
+
+class ChaosScheduler(object):
+    """
+    Runs a fault schedule (see above) against a Cassandra cluster in the background and records every injection and
+    recovery with timestamps.
+    """
+    def __init__(self, cassandra, events, seed=None, log_path=None, max_workers=8):
+        """
+        :param events: List of event dicts.
+        :param seed: Seed for jitter and random targets, to replay a schedule.
+        :param log_path: Also append every record to this file, one JSON object per line.
+        """
+        for event in events:
+            assert event.get('fault') in FAULTS, 'Unknown fault: %s' % event.get('fault')
+            assert event.get('at', 0) >= 0 and event.get('duration', 0) >= 0 and event.get('jitter', 0) >= 0
+            assert event['fault'] == 'reboot' or event.get('duration', 0) > 0, 'Fault %s needs a duration.' % event['fault']
+
+        self.cassandra = cassandra
+        self.events = [dict(event) for event in events]
+        self.rng = random.Random(seed)
+        self.log_path = log_path
+        self.faults = dict((name, fault(cassandra)) for name, fault in FAULTS.items())
+        self.records = []
+        self.active = {}  # (event index, ip) -> injection time, faults injected and not yet recovered
+        self.journal_ids = {}  # (event index, ip) -> fault journal entry
+        self.start_time = None
+
+        self._queue = []  # heap of (time, sequence, action, event index, ips)
+        self._sequence = 0
+        self._pending = 0  # actions queued or running
+        self._lock = threading.Condition()
+        self._stop = threading.Event()
+        self._pool = multiprocessing.pool.ThreadPool(max_workers)
+        self._thread = None
+
+    def _schedule(self, at, action, index, ips=None):
+        with self._lock:
+            heapq.heappush(self._queue, (at, self._sequence, action, index, ips))
+            self._sequence += 1
+            self._pending += 1
+            self._lock.notify_all()
+
+    def _done(self):
+        with self._lock:
+            self._pending -= 1
+            self._lock.notify_all()
+
+    def _record(self, index, action, ip, scheduled, started, error=None):
+        event = self.events[index]
+        record = {
+            'event': index,
+            'fault': event['fault'],
+            'action': action,
+            'ip': ip,
+            'scheduled': round(scheduled, 3),
+            'started': round(started, 3),
+            'finished': round(time.time(), 3),
+            'ok': error is None,
+        }
+        if error is not None:
+            record['error'] = str(error)
+        with self._lock:
+            self.records.append(record)
+            if self.log_path:
+                with open(self.log_path, 'a') as f:
+                    f.write(json.dumps(record, sort_keys=True) + '\n')
+
+        level = 'info' if error is None else 'warning'
+        report('Chaos: %s %s on {%s}%s' % (action, event['fault'], ip, '' if error is None else ' failed: %s' % error), level)
+        if action == 'inject' and error is None:
+            add_test_note('Chaos: %s on {%s} at %s.' % (event['fault'], ip, time.strftime('%H:%M:%S', time.localtime(started))))
+
+    def select_targets(self, target):
+        """
+        Resolves a target selector to a list of ips.
+        """
+        ips = list(self.cassandra.ips)
+        if isinstance(target, (list, tuple)):
+            return list(target)
+        if target == 'all':
+            return ips
+        if target.startswith('node:'):
+            return [ips[int(target.split(':', 1)[1])]]
+        if target == 'random' or target.startswith('random:'):
+            count = int(target.split(':', 1)[1]) if ':' in target else 1
+            with self._lock:
+                busy = set(ip for _, ip in self.active)
+            healthy = [ip for ip in ips if ip not in busy]
+            candidates = healthy if len(healthy) >= count else ips
+            return self.rng.sample(candidates, min(count, len(candidates)))
+        return [target]
+
+    def _inject(self, index, scheduled):
+        event = self.events[index]
+        try:
+            ips = self.select_targets(event.get('target', 'random'))
+            for ip in ips:
+                started = time.time()
+                fault = self.faults[event['fault']]
+                entry_id = journal.record(event['fault'], ip, fault.recover_commands(event), self.cassandra.username,
+                                          self.cassandra.password, self.cassandra.key, fault.wait_for_ssh, note='chaos event %d' % index)
+                with self._lock:
+                    self.active[(index, ip)] = started
+                    self.journal_ids[(index, ip)] = entry_id
+                try:
+                    fault.inject(ip, event)
+                    self._record(index, 'inject', ip, scheduled, started)
+                except Exception as e:
+                    self._record(index, 'inject', ip, scheduled, started, e)
+
+            # Recovery is due duration seconds after the injection, and runs even if it failed half way.
+            if not self._stop.is_set():
+                self._schedule(time.time() + event.get('duration', 0), 'recover', index, ips)
+            else:
+                self._recover(index, ips, time.time())
+        finally:
+            self._done()
+
+    def _recover(self, index, ips, scheduled):
+        event = self.events[index]
+        for ip in ips:
+            started = time.time()
+            try:
+                self.faults[event['fault']].recover(ip, event)
+                self._record(index, 'recover', ip, scheduled, started)
+                journal.resolve(self.journal_ids.get((index, ip)))
+            except Exception as e:
+                self._record(index, 'recover', ip, scheduled, started, e)  # Stays in the journal for recovery at exit.
+            with self._lock:
+                self.active.pop((index, ip), None)
+                self.journal_ids.pop((index, ip), None)
+
+    def _recover_task(self, index, ips, scheduled):
+        try:
+            self._recover(index, ips, scheduled)
+        finally:
+            self._done()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._stop.is_set() and (not self._queue or self._queue[0][0] > time.time()):
+                    if not self._queue and self._pending == 0:
+                        return
+                    self._lock.wait(min(1.0, self._queue[0][0] - time.time()) if self._queue else 1.0)
+                if self._stop.is_set():
+                    return
+                at, _, action, index, ips = heapq.heappop(self._queue)
+
+            if action == 'inject':
+                self._pool.apply_async(self._inject, (index, at))
+            else:
+                self._pool.apply_async(self._recover_task, (index, ips, at))
+
+    def start(self):
+        """
+        Starts the timeline. Returns right away; use join() to wait for it.
+        """
+        assert self._thread is None, 'A schedule runs only once.'
+        self.start_time = time.time()
+        for index, event in enumerate(self.events):
+            at = self.start_time + event.get('at', 0) + self.rng.uniform(0, event.get('jitter', 0))
+            self._schedule(at, 'inject', index)
+
+        report('Chaos: scheduled %d fault events over %.0f seconds.' % (len(self.events), max(
+            [event.get('at', 0) + event.get('jitter', 0) + event.get('duration', 0) for event in self.events] or [0])))
+        journal.track(self)  # So an exiting test stops it before replaying the journal.
+        self._thread = threading.Thread(target=self._run, name='chaos-scheduler')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def join(self, timeout=None):
+        """
+        Waits until every event was injected and recovered.
+        :return: True if the schedule finished.
+        """
+        deadline = time.time() + timeout if timeout is not None else None
+        with self._lock:
+            while self._pending > 0:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._lock.wait(min(remaining, 1.0) if remaining is not None else 1.0)
+        return True
+
+    def stop(self):
+        """
+        Drops the events that haven't fired yet and recovers every fault that is still active, right away.
+        """
+        self._stop.set()
+        with self._lock:
+            self._lock.notify_all()
+            recoveries = [(index, ips) for _, _, action, index, ips in self._queue if action == 'recover']
+            self._pending -= len(self._queue)
+            self._queue = []
+        if self._thread is not None:
+            self._thread.join()
+
+        # Recoveries can take minutes each (a rebooted node coming back), so they run side by side on the pool.
+        results = [self._pool.apply_async(self._recover, (index, ips, time.time())) for index, ips in recoveries]
+        for result in results:
+            result.wait()
+        self.join()  # Injections already running schedule their own recovery once stopped.
+        self._pool.close()
+        self._pool.join()
+        journal.untrack(self)
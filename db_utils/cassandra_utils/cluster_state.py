@@ -0,0 +1,198 @@
+"""
+The MIT License (MIT)
+Copyright (c) Datos IO, Inc. 2015.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit
+persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the
+Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+
+
+import re
+import time
+import threading
+from collections import namedtuple
+
+
+# One node line of nodetool status, e.g.
+# UN  10.0.0.1  1.21 GB  256  33.4%  2a8c3bd9-4b6d-4f53-9d6a-4f0a2e1c7d55  rack1
+NODE_LINE = re.compile(r'^([UD])([NLJM])\s+(\S+)\s+(\?|[\d.,]+\s*[A-Za-z]+)\s+(\S+)\s+(\?|[\d.,]+%)\s+(\S+)\s*(.*)$')
+# Without vnodes the columns are Load, Owns, Host ID, Token, e.g.
+# UN  10.0.0.1  1.21 GB  33.4%  2a8c3bd9-4b6d-4f53-9d6a-4f0a2e1c7d55  -9223372036854775808  rack1
+SINGLE_TOKEN_NODE_LINE = re.compile(r'^([UD])([NLJM])\s+(\S+)\s+(\?|[\d.,]+\s*[A-Za-z]+)\s+(\?|[\d.,]+%)\s+(\S+)\s+(-?\d+)\s*(.*)$')
+DATACENTER_LINE = re.compile(r'^Datacenter:\s*(\S+)')
+
+LOAD_UNITS = {
+    'bytes': 1,
+    'KB': 1024, 'MB': 1024 ** 2, 'GB': 1024 ** 3, 'TB': 1024 ** 4,
+    'KiB': 1024, 'MiB': 1024 ** 2, 'GiB': 1024 ** 3, 'TiB': 1024 ** 4,
+}
+
+STATUSES = {'U': 'up', 'D': 'down'}
+STATES = {'N': 'normal', 'L': 'leaving', 'J': 'joining', 'M': 'moving'}
+
+# load is in bytes, owns in percent; both None when nodetool reports '?'. tokens is an int for vnodes, else the token.
+NodeStatus = namedtuple('NodeStatus', ['address', 'dc', 'status', 'state', 'load', 'tokens', 'owns', 'host_id', 'rack'])
+
+
+def parse_load(load):
+    """
+    Converts a nodetool load column ('47.66 KB', '1.2 GiB', '?') to bytes.
+    """
+    if load == '?':
+        return None
+    match = re.match(r'([\d.,]+)\s*([A-Za-z]+)', load)
+    if not match or match.group(2) not in LOAD_UNITS:
+        return None
+    return int(float(match.group(1).replace(',', '')) * LOAD_UNITS[match.group(2)])
+
+
+def format_load(load):
+    """
+    Inverse of parse_load, e.g. 1299227607 -> '1.21 GB'.
+    """
+    if load is None:
+        return '?'
+    for unit in ['TB', 'GB', 'MB', 'KB']:
+        if load >= LOAD_UNITS[unit]:
+            return '%.2f %s' % (load / float(LOAD_UNITS[unit]), unit)
+    return '%d bytes' % load
+
+
+def parse_nodetool_status(out):
+    """
+    Parses the output of nodetool status.
+    :param out: Text output of nodetool status.
+    :return: List of NodeStatus, in the order nodetool printed them.
+    """
+    nodes = []
+    dc = None
+    for line in out.splitlines():
+        line = line.strip()
+        match = DATACENTER_LINE.match(line)
+        if match:
+            dc = match.group(1)
+            continue
+
+        match = NODE_LINE.match(line)
+        if match:
+            status, state, address, load, tokens, owns, host_id, rack = match.groups()
+        else:
+            match = SINGLE_TOKEN_NODE_LINE.match(line)
+            if not match:
+                continue
+            status, state, address, load, owns, host_id, tokens, rack = match.groups()
+        nodes.append(NodeStatus(
+            address=address,
+            dc=dc,
+            status=STATUSES[status],
+            state=STATES[state],
+            load=parse_load(load),
+            tokens=int(tokens) if tokens.isdigit() else tokens,
+            owns=None if owns == '?' else float(owns.rstrip('%').replace(',', '.')),
+            host_id=host_id,
+            rack=rack or None,
+        ))
+    return nodes
+
+
+class ClusterState(object):
+    """
+    Short lived cache of the cluster membership as nodetool status reports it. Callers share one snapshot until it is
+    ttl seconds old, so polling "are all nodes up?" doesn't cost an SSH round trip and a nodetool JVM start each time.
+    Only one refresh runs at a time; callers arriving during a refresh wait for its result.
+    """
+    def __init__(self, fetch, ttl=5.0):
+        """
+        :param fetch: Callable returning nodetool status text, or None if no node answered.
+        :param ttl: Seconds a snapshot is served before it is refreshed.
+        """
+        self.fetch = fetch
+        self.ttl = ttl
+        self.raw = None
+        self.fetched_at = None
+        self._nodes = []
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        """
+        Forces the next read to refresh, e.g. right after stopping or starting a node.
+        """
+        with self._lock:
+            self.fetched_at = None
+
+    def age(self):
+        if self.fetched_at is None:
+            return None
+        return time.time() - self.fetched_at
+
+    def nodes(self, max_age=None):
+        """
+        :param max_age: Refresh if the snapshot is older than this many seconds. Defaults to the ttl, 0 forces a refresh.
+        :return: List of NodeStatus, empty if no node answered.
+        """
+        max_age = self.ttl if max_age is None else max_age
+        with self._lock:
+            if self.fetched_at is None or time.time() - self.fetched_at >= max_age:
+                out = self.fetch()
+                self.raw = out
+                self._nodes = parse_nodetool_status(out) if out else []
+                self.fetched_at = time.time()
+            return list(self._nodes)
+
+    def node(self, address, max_age=None):
+        """
+        :return: NodeStatus of address, or None if nodetool status doesn't list it.
+        """
+        for node in self.nodes(max_age):
+            if node.address == address:
+                return node
+        return None
+
+    def is_up(self, address, max_age=None):
+        """
+        True if address is up and normal (UN).
+        """
+        node = self.node(address, max_age)
+        return node is not None and node.status == 'up' and node.state == 'normal'
+
+    def all_up(self, addresses=None, max_age=None):
+        """
+        True if every node (or every one of addresses) is up and normal. False if no node answered.
+        """
+        nodes = self.nodes(max_age)
+        if not nodes:
+            return False
+        up = set(node.address for node in nodes if node.status == 'up' and node.state == 'normal')
+        if addresses is None:
+            return len(up) == len(nodes)
+        return set(addresses) <= up
+
+    def down(self, max_age=None):
+        """
+        :return: Addresses of nodes that are down or not in the normal state.
+        """
+        return [node.address for node in self.nodes(max_age) if node.status != 'up' or node.state != 'normal']
+
+    def summary(self, max_age=None):
+        """
+        One line per datacenter, e.g. 'dc1: 10.0.0.1 UN 1.2 GB, 10.0.0.2 DN ?'.
+        """
+        lines = []
+        by_dc = {}
+        for node in self.nodes(max_age):
+            if node.dc not in by_dc:
+                by_dc[node.dc] = []
+                lines.append(node.dc)
+            by_dc[node.dc].append('%s %s%s %s' % (node.address, node.status[0].upper(), node.state[0].upper(), format_load(node.load)))
+        return '\n'.join('%s: %s' % (dc, ', '.join(by_dc[dc])) for dc in lines)
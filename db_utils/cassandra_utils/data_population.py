@@ -21,12 +21,20 @@ import os
 import sys
 import time
 import uuid
+import json
 import random
+import hashlib
+import decimal
+import cPickle
 import argparse
 import datetime
 import binascii
 import itertools
+import threading
 import subprocess
+import collections
+import multiprocessing
+import multiprocessing.pool
 
 
 import cassandra.util as CU
@@ -36,6 +44,9 @@ from cassandra.query import tuple_factory
 from cassandra.query import BatchStatement
 from cassandra.query import SimpleStatement
 from cassandra.auth import PlainTextAuthProvider
+from cassandra.policies import HostDistance
+from cassandra.policies import TokenAwarePolicy
+from cassandra.policies import DCAwareRoundRobinPolicy
 
 
 import common.common
@@ -51,6 +62,17 @@ def parse_args():
     parser.add_argument('--db_user', default='', help='Authentication username')
     parser.add_argument('--db_pass', default='', help='Authentication password')
 
+    # for latency and throughput metrics
+    parser.add_argument('--metrics', dest='metrics_file', default=None, help='Append JSON metrics snapshots to this file')
+    parser.add_argument('--metrics_interval', default=10, type=float, help='Seconds between metrics snapshots')
+
+    # for driver routing and connection pooling
+    parser.add_argument('--local_dc', default=None, help='Datacenter to route requests to, inferred if not given')
+    parser.add_argument('--protocol_version', default=None, type=int, help='Native protocol version, negotiated if not given')
+    parser.add_argument('--core_connections', default=None, type=int, help='Connections per host (protocol v1/v2)')
+    parser.add_argument('--max_connections', default=None, type=int, help='Maximum connections per host (protocol v1/v2)')
+    parser.add_argument('--max_requests_per_connection', default=None, type=int, help='Requests per connection (protocol v1/v2)')
+
     subparsers = parser.add_subparsers(dest='command', help='commands')
 
     # for insert command
@@ -61,6 +83,12 @@ def parse_args():
     insert_parser.add_argument('-t', action='store', dest='target_db', default='ks1.table1', help='keyspace.table format')
     insert_parser.add_argument('-u', action='store', dest='uuid4', default=None, help='uuid4 to use if given.')
     insert_parser.add_argument('--replication', default=3, type=int, help='Keyspace replication factor.')
+    insert_parser.add_argument('--prepared', action='store_true', help='Use prepared statements with bound values.')
+    insert_parser.add_argument('--concurrency', default=64, type=int, help='Maximum number of writes in flight.')
+    insert_parser.add_argument('--batch_size', default=1, type=int, help='Batch up to this many rows of the same partition.')
+    insert_parser.add_argument('--workers', default=1, type=int, help='Number of worker processes, each with its own session.')
+    insert_parser.add_argument('--seed', default=None, type=int, help='Generate rows reproducibly from this seed (implies --prepared).')
+    insert_parser.add_argument('--version', default=0, type=int, help='Row version mixed into the seed.')
 
     # for update command
     update_parser = subparsers.add_parser('update', help='Update records')
@@ -72,13 +100,51 @@ def parse_args():
     update_parser.add_argument('-d', action='store', dest='delay', default='1000', help='Delay time in ms')
     update_parser.add_argument('-c', action='store', dest='batch_count', default='-1', help='Number of batches to execute')
     update_parser.add_argument('--replication', dest='replication', default=3, type=int, help='Keyspace replication factor.')
+    update_parser.add_argument('--prepared', action='store_true', help='Use prepared statements with bound values.')
+    update_parser.add_argument('--rate', default=None, type=float, help='Target operations per second, instead of -b/-d.')
+    update_parser.add_argument('--bytes_rate', default=None, type=float, help='Target bytes per second, instead of -b/-d.')
+    update_parser.add_argument('--control', dest='control_file', default=None, help='JSON file polled to change rate and mix at runtime.')
+    update_parser.add_argument('--concurrency', default=64, type=int, help='Maximum number of operations in flight.')
+    update_parser.add_argument('--mix', default=None, help='Operation weights, e.g. read=50,update=40,insert=10 (overrides -i).')
+    update_parser.add_argument('--distribution', default='uniform', choices=['uniform', 'sequential', 'zipfian', 'latest', 'hotspot'],
+                               help='How existing records are picked for reads, updates and deletes.')
+    update_parser.add_argument('--scan_length', default=100, type=int, help='Rows per range scan.')
+
+    # for read command
+    read_parser = subparsers.add_parser('read', help='Read existing records')
+    read_parser.add_argument('-s', action='store', dest='start_record', default='1', help='Starting record number')
+    read_parser.add_argument('-n', action='store', dest='record_count', default='10000', help='Number of populated records')
+    read_parser.add_argument('-t', action='store', dest='target_db', default='ks1.table1', help='keyspace.table format')
+    read_parser.add_argument('-c', action='store', dest='max_ops', default='-1', help='Number of operations to execute')
+    read_parser.add_argument('--duration', default=None, type=float, help='Seconds to run for.')
+    read_parser.add_argument('--rate', default=None, type=float, help='Target operations per second, unlimited if not given.')
+    read_parser.add_argument('--mix', default='read=100', help='Point read and range scan weights, e.g. read=90,scan=10.')
+    read_parser.add_argument('--distribution', default='uniform', choices=['uniform', 'sequential', 'zipfian', 'latest', 'hotspot'],
+                             help='How records are picked.')
+    read_parser.add_argument('--scan_length', default=100, type=int, help='Rows per range scan.')
+    read_parser.add_argument('--concurrency', default=64, type=int, help='Maximum number of reads in flight.')
+    read_parser.add_argument('--control', dest='control_file', default=None, help='JSON file polled to change rate and mix at runtime.')
+
+    # for verify command
+    verify_parser = subparsers.add_parser('verify', help='Check rows written with --seed against their regenerated values')
+    verify_parser.add_argument('-r', action='store', dest='record_size', default='1000', help='Record size used on insert')
+    verify_parser.add_argument('-s', action='store', dest='start_record', default='1', help='Starting record number')
+    verify_parser.add_argument('-n', action='store', dest='record_count', default='10000', help='Record count')
+    verify_parser.add_argument('-t', action='store', dest='target_db', default='ks1.table1', help='keyspace.table format')
+    verify_parser.add_argument('-u', action='store', dest='uuid4', default=None, help='uuid4 used on insert, if any.')
+    verify_parser.add_argument('--seed', required=True, type=int, help='Seed used on insert.')
+    verify_parser.add_argument('--version', default=0, type=int, help='Row version used on insert.')
+    verify_parser.add_argument('--concurrency', default=64, type=int, help='Maximum number of reads in flight.')
 
     # for compare command
-    compare_parser = subparsers.add_parser('compare', help='Update records')
+    compare_parser = subparsers.add_parser('compare', help='Compare the rows of two tables')
     compare_parser.add_argument('first', action='store', default='ks1.table1',
                                 help='First table to compare in keyspace.table format')
     compare_parser.add_argument('second', action='store', default='ks1.table101',
                                 help='Second table to compare in keyspace.table format')
+    compare_parser.add_argument('--ranges', default=256, type=int, help='Number of token ranges to digest.')
+    compare_parser.add_argument('--concurrency', default=16, type=int, help='Number of ranges scanned in parallel.')
+    compare_parser.add_argument('--page_size', default=1000, type=int, help='Rows fetched per page.')
 
     compare_parser = subparsers.add_parser('describe', help='get schema information')
     compare_parser.add_argument('dbname', action='store', default='k1.t1',
@@ -88,33 +154,78 @@ def parse_args():
 
 
 class CassandraTestingCluster():
-    def __init__(self, ip_list, db_user='', db_pass=''):
+    def __init__(self, ip_list, db_user='', db_pass='', local_dc=None, protocol_version=None, core_connections=None,
+                 max_connections=None, max_requests_per_connection=None):
+        """
+        :param local_dc: Datacenter whose replicas are preferred. Inferred from the contact points if not given.
+        :param protocol_version: Pin the native protocol version, negotiate the highest supported one if not given.
+        :param core_connections: Connections opened per local host (protocol v1/v2 only).
+        :param max_connections: Connections allowed per local host (protocol v1/v2 only).
+        :param max_requests_per_connection: In-flight requests per connection before another is opened (protocol v1/v2
+        only; v3 and later multiplex thousands of requests over one connection per host).
+        """
         self.ip_list = ip_list
         self.session = None
         self.datacenter = None
         self.db_user = db_user
         self.db_pass = db_pass
         self.cluster_auth = PlainTextAuthProvider(username=self.db_user, password=self.db_pass)
+        self.local_dc = local_dc
+        self.protocol_version = protocol_version
+        self.core_connections = core_connections
+        self.max_connections = max_connections
+        self.max_requests_per_connection = max_requests_per_connection
+
+    def getSettings(self):
+        """
+        :return: Keyword arguments that build an equally configured CassandraTestingCluster, e.g. in another process.
+        """
+        return dict(ip_list=list(self.ip_list), db_user=self.db_user, db_pass=self.db_pass, local_dc=self.local_dc,
+                    protocol_version=self.protocol_version, core_connections=self.core_connections,
+                    max_connections=self.max_connections, max_requests_per_connection=self.max_requests_per_connection)
 
     def connect(self, ip_list = None):
         if ip_list is not None:
             self.ip_list.append(ip_list)
 
         try:
+            # Send each request straight to a replica of its partition in the local datacenter.
+            kwargs = {'load_balancing_policy': TokenAwarePolicy(DCAwareRoundRobinPolicy(local_dc=self.local_dc or ''))}
             if self.db_user:
-                cluster = CC.Cluster(self.ip_list, auth_provider=self.cluster_auth)
-            else:
-                cluster = CC.Cluster(self.ip_list)
-            cluster.protocol_version = 2
+                kwargs['auth_provider'] = self.cluster_auth
+            if self.protocol_version:
+                kwargs['protocol_version'] = self.protocol_version
+            cluster = CC.Cluster(self.ip_list, **kwargs)
 
             self.session = cluster.connect()
             self.updateIPList()
+            self.setPoolSize()
             return True
 
         except Exception:
             self.session = None
             return False
 
+    def setPoolSize(self):
+        cluster = self.session.cluster
+        try:
+            if self.max_requests_per_connection:
+                cluster.set_max_requests_per_connection(HostDistance.LOCAL, self.max_requests_per_connection)
+            if self.max_connections:
+                cluster.set_max_connections_per_host(HostDistance.LOCAL, self.max_connections)
+            if self.core_connections:
+                cluster.set_core_connections_per_host(HostDistance.LOCAL, self.core_connections)
+        except Exception as e:
+            report('Pool sizing ignored with protocol v%s: %s' % (cluster.protocol_version, e), 'warning')
+
+    def isConnected(self):
+        """
+        True if the session is open and the driver still has at least one node up.
+        """
+        if self.session is None or self.session.cluster.is_shutdown:
+            return False
+        return any(host.is_up for host in self.session.cluster.metadata.all_hosts())
+
     def disconnect(self):
         if self.session is not None:
             self.session.cluster.shutdown()
@@ -144,6 +255,12 @@ class CassandraTestingCluster():
 
         return result, True
 
+    def getSchemaVersion(self):
+        result, success = self.runQuery('SELECT schema_version FROM system.local')
+        if not success or not result:
+            return None
+        return result[0].schema_version
+
     def updateIPList(self):
         if self.session is None:
             return False
@@ -161,175 +278,465 @@ class CassandraTestingCluster():
         return True
 
 
-def getRandomValue4CompositeType(dataType, arg1=0, arg2=0):
+def addSingleQuote(str):
+    return '\'%s\'' % str
+
+
+class FillerPool():
+    """
+    One large buffer of hex text that filler strings are sliced out of, instead of concatenating uuid4 strings until a
+    record is long enough.
+    """
+    def __init__(self, seed=None, size=1 << 20):
+        rng = random.Random(seed)
+        text = '%0*x' % (size, rng.getrandbits(size * 4))
+        self.size = size
+        self.text = text + text  # Any slice of up to `size` characters can start anywhere in the first half.
+
+    def slice(self, rng, length):
+        start = rng.randrange(self.size)
+        if length <= self.size:
+            return self.text[start:start + length]
+        return (self.text[start:start + self.size] * (length / self.size + 1))[:length]
+
+
+fillerPool = None
+
+
+def getFillerPool():
+    global fillerPool
+    if fillerPool is None:
+        fillerPool = FillerPool(random.getrandbits(64))  # Follows random.seed() like the rest of the string path.
+    return fillerPool
+
+
+def literalBoolean(arg1, arg2, uuid4):
+    if random.randint(0, 100) > 50:
+        return 'True', 1
+    return 'False', 1
+
+
+def literalFiller(arg1, arg2, uuid4):
+    return addSingleQuote(getFillerPool().slice(random, arg1)), arg1
+
+
+def literalUUID(arg1, arg2, uuid4):
+    if uuid4:
+        return uuid4, 16
+    return str(uuid.uuid4()), 16
+
+
+def literalTimestamp(arg1, arg2, uuid4):
+    ts_str = str(datetime.datetime.now()).split('.')[0]
+    return addSingleQuote(ts_str), 16
+
+
+def literalInet(arg1, arg2, uuid4):
+    return addSingleQuote('%d.%d.%d.%d' % (random.randint(0, 255), random.randint(0, 255), random.randint(0, 255), random.randint(0, 255))), 4
+
+
+def literalBytes(arg1, arg2, uuid4):
+    size = random.randint(1, arg1 * 8)
+    bits = '%x' % random.getrandbits(size)
+    return 'textAsBlob(%s)' % addSingleQuote(bits), size
+
+
+def literalVarint(arg1, arg2, uuid4):
+    size = random.randint(1, arg1 * 8)
+    return '%d' % random.getrandbits(size), size
+
+
+# Random CQL literals per type. They draw from the module random, so random.seed() still makes runs repeatable.
+literalEncoders = {
+    'BooleanType': literalBoolean,
+    'Int32Type': lambda arg1, arg2, uuid4: (str(random.randint(100000, 999999)), 4),
+    'DecimalType': lambda arg1, arg2, uuid4: (str(random.randint(100000, 999999)), 4),
+    'LongType': lambda arg1, arg2, uuid4: (str(random.randint(1000000000, 9999999999)), 8),
+    'UTF8Type': literalFiller,
+    'AsciiType': literalFiller,
+    'UUIDType': literalUUID,
+    'TimestampType': literalTimestamp,
+    'DateType': literalTimestamp,
+    'DoubleType': lambda arg1, arg2, uuid4: (str(random.random()), 8),
+    'FloatType': lambda arg1, arg2, uuid4: (str(random.random()), 8),
+    'InetAddressType': literalInet,
+    'TimeUUIDType': lambda arg1, arg2, uuid4: (str(uuid.uuid1()), 16),
+    'CounterColumnType': lambda arg1, arg2, uuid4: (str(random.randint(1000000000, 9999999999)), 8),
+    'BytesType': literalBytes,
+    'IntegerType': literalVarint,
+}
+
+
+def compileLiteralComposite(dataType):
     dataTypes = dataType.split('/')
     superType = dataTypes[0]
 
     if superType == 'ListType' or superType == 'SetType' or superType == 'TupleType':
-        entryType = dataTypes[1]
-        if superType == 'ListType':
-            value_string = '['
-        elif superType == 'TupleType':
-            value_string = '('
+        opening, closing = {'ListType': '[]', 'SetType': '{}', 'TupleType': '()'}[superType]
+        entry = compileLiteralValue(dataTypes[1])
+
+        def encode(arg1, arg2, uuid4):
+            values = []
+            value_len = 0
+            for i in range(arg2):
+                v, l = entry(arg1, 0, None)
+                values.append(v)
+                value_len += l
+            return opening + ','.join(values) + closing, value_len
+        return encode
+
+    if superType == 'MapType':
+        key_entry = compileLiteralValue(dataTypes[1])
+        value_entry = compileLiteralValue(dataTypes[2])
+
+        def encode(arg1, arg2, uuid4):
+            values = []
+            value_len = 0
+            for i in range(arg2):
+                k, lk = key_entry(arg1, 0, None)
+                v, lv = value_entry(arg1, 0, None)
+                values.append('%s:%s' % (k, v))
+                value_len += lv + lk
+            return '{' + ','.join(values) + '}', value_len
+        return encode
+
+    print('ERROR: cannot handle %s' % dataType)
+    raise Exception()
+
+
+compiledLiteralValues = {}
+
+
+def compileLiteralValue(dataType):
+    """
+    CQL literal counterpart of compileSeededValue: resolves a column type once into a function
+    (arg1, arg2, uuid4) -> (literal, length), so building query strings does no dispatch on type names.
+    """
+    encode = compiledLiteralValues.get(dataType)
+    if encode is None:
+        if isinstance(dataType, UDT):
+            encode = lambda arg1, arg2, uuid4: dataType.getRandomValue(arg1, arg2)
+        elif '/' in dataType:
+            encode = compileLiteralComposite(dataType)
+        elif dataType in literalEncoders:
+            encode = literalEncoders[dataType]
         else:
-            value_string = '{'
+            print('ERROR: cannot handle %s' % dataType)
+            raise Exception()
+        compiledLiteralValues[dataType] = encode
+    return encode
+
+
+def getRandomValue(dataType, arg1=0, arg2=0, uuid4=None):
+    return compileLiteralValue(dataType)(arg1, arg2, uuid4)
+
+
+def literalRowKeyUUID(rowkey):
+    rstr = '%016d' % rowkey
+    return '%s-%s-%s-%s-%s' % (rstr[:8], rstr[8:12], rstr[12:], rstr[:4], rstr[4:]), 16
+
+
+def literalRowKeyText(rowkey):
+    rstr = str(rowkey)
+    return addSingleQuote(rstr), len(rstr)
+
+
+def literalRowKeyBytes(rowkey):
+    rstr = '%#x' % rowkey
+    return rstr, len(rstr) - 2
+
+
+def literalRowKeyVarint(rowkey):
+    rstr = str(rowkey)
+    return rstr, len(rstr)
+
+
+def literalRowKeyInet(rowkey):
+    i = rowkey % 256
+    return '%d.%d.%d.%d' % (i, i, i, i), 4
+
+
+# CQL literals of key columns, derived from the row number.
+rowKeyLiterals = {
+    'Int32Type': lambda rowkey: (str(rowkey), 4),
+    'DecimalType': lambda rowkey: (str(rowkey), 4),
+    'LongType': lambda rowkey: (str(rowkey), 8),
+    'UTF8Type': literalRowKeyText,
+    'AsciiType': literalRowKeyText,
+    'TimeUUIDType': lambda rowkey: (str(uuid.uuid1()), 16),
+    'UUIDType': literalRowKeyUUID,
+    'TimestampType': lambda rowkey: (addSingleQuote(time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(116233200 + rowkey))), 16),
+    'DateType': lambda rowkey: (addSingleQuote(time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(116233200 + rowkey))), 16),
+    'DoubleType': lambda rowkey: (str(rowkey), 8),
+    'FloatType': lambda rowkey: (str(rowkey), 8),
+    'CounterColumnType': lambda rowkey: (str(rowkey), 8),
+    'BooleanType': lambda rowkey: ('True' if rowkey % 2 == 1 else 'False', 1),
+    'BytesType': literalRowKeyBytes,
+    'IntegerType': literalRowKeyVarint,
+    'InetAddressType': literalRowKeyInet,
+}
+
+
+def getValueFromRowKey(dataType, rowkey):
+    if dataType not in rowKeyLiterals:
+        raise Exception()
+    return rowKeyLiterals[dataType](rowkey)
+
+
+def getTypedRandomValue4CompositeType(dataType, arg1=0, arg2=0):
+    dataTypes = dataType.split('/')
+    superType = dataTypes[0]
+
+    if superType == 'ListType' or superType == 'SetType' or superType == 'TupleType':
+        values = []
         value_len = 0
         for i in range(arg2):
-            v, l = getRandomValue(entryType, arg1)
-            if value_len > 0:
-                value_string += ','
-            value_string += v
+            v, l = getTypedRandomValue(dataTypes[1], arg1)
+            values.append(v)
             value_len += l
         if superType == 'ListType':
-            value_string += ']'
-        elif superType == 'TupleType':
-            value_string = ')'
-        else:
-            value_string += '}'
-
-        return value_string, value_len
+            return values, value_len
+        if superType == 'TupleType':
+            return tuple(values), value_len
+        return set(values), value_len
 
     if superType == 'MapType':
-        keyType = dataTypes[1]
-        entryType = dataTypes[2]
-        value_string = '{'
+        values = {}
         value_len = 0
         for i in range(arg2):
-            k, lk = getRandomValue(keyType, arg1)
-            v, lv = getRandomValue(entryType, arg1)
-            if value_len > 0:
-                value_string += ','
-            value_string += "%s:%s" % (k, v)
+            k, lk = getTypedRandomValue(dataTypes[1], arg1)
+            v, lv = getTypedRandomValue(dataTypes[2], arg1)
+            values[k] = v
             value_len += lv + lk
-        value_string += '}'
+        return values, value_len
 
-        return value_string, value_len
-
-
-def addSingleQuote(str):
-    return '\'%s\'' % str
 
-
-def getRandomValue(dataType, arg1=0, arg2=0, uuid4=None):
+def getTypedRandomValue(dataType, arg1=0, arg2=0, uuid4=None):
+    """
+    Same as getRandomValue, but returns a Python value to bind to a prepared statement instead of a CQL literal.
+    """
     if isinstance(dataType, UDT):
-        return dataType.getRandomValue(arg1, arg2)
+        return dataType.getTypedRandomValue(arg1, arg2)
 
     if '/' in dataType:
-        return getRandomValue4CompositeType(dataType, arg1, arg2)
+        return getTypedRandomValue4CompositeType(dataType, arg1, arg2)
 
     if dataType == 'BooleanType':
-        if random.randint(0, 100) > 50:
-            b = 'True'
-        else:
-            b = 'False'
-        return b, 1
+        return random.randint(0, 100) > 50, 1
+
+    if dataType == 'Int32Type':
+        return random.randint(100000, 999999), 4
 
-    if dataType == 'Int32Type' or dataType =='DecimalType':
-        return str(random.randint(100000, 999999)), 4
+    if dataType == 'DecimalType':
+        return decimal.Decimal(random.randint(100000, 999999)), 4
 
     if dataType == 'LongType':
-        return str(random.randint(1000000000, 9999999999)), 8
+        return random.randint(1000000000, 9999999999), 8
 
     if dataType == 'UTF8Type' or dataType == 'AsciiType':
-        rstr = ''
-        while len(rstr) < arg1:
-            rstr += str(uuid.uuid4())
-        return addSingleQuote(rstr[:arg1]), arg1
+        return getFillerPool().slice(random, arg1), arg1
 
     if dataType == 'UUIDType':
         if uuid4:
-            return uuid4, 16
-        return str(uuid.uuid4()), 16
+            return uuid.UUID(uuid4), 16
+        return uuid.uuid4(), 16
 
     if dataType == 'TimestampType' or dataType == 'DateType':
-        ts = datetime.datetime.now()
-        ts_str = str(ts).split('.')[0]
-        return addSingleQuote(ts_str), 16
+        return datetime.datetime.now().replace(microsecond=0), 16
 
     if dataType == 'DoubleType' or dataType == 'FloatType':
-        return str(random.random()), 8
+        return random.random(), 8
 
     if dataType == 'InetAddressType':
-        i1 = random.randint(0, 255)
-        i2 = random.randint(0, 255)
-        i3 = random.randint(0, 255)
-        i4 = random.randint(0, 255)
-        return addSingleQuote('%d.%d.%d.%d' % (i1, i2, i3, i4)), 4
+        return '%d.%d.%d.%d' % (random.randint(0, 255), random.randint(0, 255), random.randint(0, 255), random.randint(0, 255)), 4
 
     if dataType == 'TimeUUIDType':
-        #t = time.time()
-        return str(uuid.uuid1()), 16
+        return uuid.uuid1(), 16
 
     if dataType == 'CounterColumnType':
-        return str(random.randint(1000000000, 9999999999)), 8
+        return random.randint(1000000000, 9999999999), 8
 
     if dataType == 'BytesType':
         size = random.randint(1, arg1 * 8)
-        bits = '%x' % random.getrandbits(size)
-        rstr = 'textAsBlob(%s)' % addSingleQuote(bits)
-        return rstr, size
+        return '%x' % random.getrandbits(size), size
 
     if dataType == 'IntegerType':
         size = random.randint(1, arg1 * 8)
-        rstr = '%d' % random.getrandbits(size)
-        return rstr, size
+        return random.getrandbits(size), size
 
     print('ERROR: cannot handle %s' % dataType)
     raise Exception()
 
 
-def getValueFromRowKey(dataType, rowkey):
-    if dataType == 'Int32Type' or dataType =='DecimalType':
-        return str(rowkey), 4
+def getSeededTimeUUID(rng):
+    # Version 1 layout, with the timestamp, clock sequence and node drawn from rng instead of the clock and MAC.
+    ts = 0x01b21dd213814000 + rng.randrange(1400000000, 1500000000) * 10000000 + rng.randrange(10000000)
+    return uuid.UUID(fields=(ts & 0xffffffff, (ts >> 32) & 0xffff, ((ts >> 48) & 0x0fff) | 0x1000,
+                             0x80 | rng.getrandbits(6), rng.getrandbits(8), rng.getrandbits(48)))
 
-    if dataType == 'LongType':
-        return str(rowkey), 8
 
-    if dataType == 'UTF8Type' or dataType == 'AsciiType':
-        rstr = str(rowkey)
-        return addSingleQuote(rstr), len(rstr)
+def seededFiller(rng, pool, arg1, arg2, uuid4):
+    return pool.slice(rng, arg1), arg1
 
-    if dataType == 'TimeUUIDType':
-        return str(uuid.uuid1()), 16
 
-    if dataType == 'UUIDType':
-        rstr = '%016d' % rowkey
-        ruuid = '%s-%s-%s-%s-%s' % (rstr[:8], rstr[8:12], rstr[12:], rstr[:4], rstr[4:])
+def seededUUID(rng, pool, arg1, arg2, uuid4):
+    if uuid4:
+        return uuid.UUID(uuid4), 16
+    return uuid.UUID(int=rng.getrandbits(128), version=4), 16
 
-        return ruuid, 16
 
-    if dataType == 'TimestampType' or dataType == 'DateType':
-        ts_str = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(116233200 + rowkey))
-        return addSingleQuote(ts_str), 16
+def seededBytes(rng, pool, arg1, arg2, uuid4):
+    size = rng.randint(1, arg1)
+    return pool.slice(rng, size), size
 
-    if dataType == 'DoubleType' or dataType == 'FloatType':
-        return str(rowkey), 8
 
-    if dataType == 'CounterColumnType':
-        return str(rowkey), 8
+def seededVarint(rng, pool, arg1, arg2, uuid4):
+    size = rng.randint(1, arg1 * 8)
+    return rng.getrandbits(size), size
 
-    if dataType == 'BooleanType':
-        if rowkey % 2 == 1:
-            rstr = 'True'
-        else:
-            rstr = 'False'
-        return rstr, 1
 
-    if dataType == 'BytesType':
-        rstr = '%#x' % rowkey
-        return rstr, len(rstr) - 2
+seededEncoders = {
+    'BooleanType': lambda rng, pool, arg1, arg2, uuid4: (rng.random() < 0.5, 1),
+    'Int32Type': lambda rng, pool, arg1, arg2, uuid4: (rng.randint(100000, 999999), 4),
+    'DecimalType': lambda rng, pool, arg1, arg2, uuid4: (decimal.Decimal(rng.randint(100000, 999999)), 4),
+    'LongType': lambda rng, pool, arg1, arg2, uuid4: (rng.randint(1000000000, 9999999999), 8),
+    'UTF8Type': seededFiller,
+    'AsciiType': seededFiller,
+    'UUIDType': seededUUID,
+    'TimestampType': lambda rng, pool, arg1, arg2, uuid4: (datetime.datetime.utcfromtimestamp(116233200 + rng.randrange(1 << 30)), 16),
+    'DateType': lambda rng, pool, arg1, arg2, uuid4: (datetime.datetime.utcfromtimestamp(116233200 + rng.randrange(1 << 30)), 16),
+    'DoubleType': lambda rng, pool, arg1, arg2, uuid4: (rng.randrange(1 << 20) / 1024.0, 8),
+    'FloatType': lambda rng, pool, arg1, arg2, uuid4: (rng.randrange(1 << 20) / 1024.0, 8),
+    'InetAddressType': lambda rng, pool, arg1, arg2, uuid4: ('%d.%d.%d.%d' % (rng.randint(0, 255), rng.randint(0, 255),
+                                                                              rng.randint(0, 255), rng.randint(0, 255)), 4),
+    'TimeUUIDType': lambda rng, pool, arg1, arg2, uuid4: (getSeededTimeUUID(rng), 16),
+    'CounterColumnType': lambda rng, pool, arg1, arg2, uuid4: (rng.randint(1000000000, 9999999999), 8),
+    'BytesType': seededBytes,
+    'IntegerType': seededVarint,
+}
 
-    if dataType == 'IntegerType':
-        rstr = str(rowkey)
-        return rstr, len(rstr)
 
-    if dataType == 'InetAddressType':
-        i = rowkey % 256
-        return '%d.%d.%d.%d' % (i, i, i, i), 4
+def compileSeededComposite(dataType):
+    dataTypes = dataType.split('/')
+    superType = dataTypes[0]
+
+    if superType == 'ListType' or superType == 'SetType' or superType == 'TupleType':
+        container = {'ListType': list, 'SetType': set, 'TupleType': tuple}[superType]
+        entry = compileSeededValue(dataTypes[1])
+
+        def encode(rng, pool, arg1, arg2, uuid4):
+            values = []
+            value_len = 0
+            for i in range(arg2):
+                v, l = entry(rng, pool, arg1, 0, None)
+                values.append(v)
+                value_len += l
+            return container(values), value_len
+        return encode
+
+    if superType == 'MapType':
+        key_entry = compileSeededValue(dataTypes[1])
+        value_entry = compileSeededValue(dataTypes[2])
+
+        def encode(rng, pool, arg1, arg2, uuid4):
+            values = {}
+            value_len = 0
+            for i in range(arg2):
+                k, lk = key_entry(rng, pool, arg1, 0, None)
+                v, lv = value_entry(rng, pool, arg1, 0, None)
+                values[k] = v
+                value_len += lv + lk
+            return values, value_len
+        return encode
 
+    print('ERROR: cannot handle %s' % dataType)
     raise Exception()
 
 
+compiledSeededValues = {}
+
+
+def compileSeededValue(dataType):
+    """
+    Resolves a column type once into a function (rng, pool, arg1, arg2, uuid4) -> (value, length), so per-row code
+    does no dispatch on type names. Values are drawn from rng and pool only, so the same rng state always yields the
+    same value. Floats are multiples of 1/1024 so they read back exactly from float columns too.
+    """
+    encode = compiledSeededValues.get(dataType)
+    if encode is None:
+        if isinstance(dataType, UDT):
+            members = [compileSeededValue(member_type) for member_name, member_type in dataType.members]
+
+            def encode(rng, pool, arg1, arg2, uuid4):
+                # The driver binds a tuple to a UDT field by field, in member order.
+                total_length = 0
+                values = []
+                for member in members:
+                    v, l = member(rng, pool, arg1, arg2, None)
+                    values.append(v)
+                    total_length += l
+                return tuple(values), total_length
+        elif '/' in dataType:
+            encode = compileSeededComposite(dataType)
+        elif dataType in seededEncoders:
+            encode = seededEncoders[dataType]
+        else:
+            print('ERROR: cannot handle %s' % dataType)
+            raise Exception()
+        compiledSeededValues[dataType] = encode
+    return encode
+
+
+def rowKeyUUID(rowkey):
+    rstr = '%016d' % rowkey
+    return uuid.UUID('%s-%s-%s-%s-%s' % (rstr[:8], rstr[8:12], rstr[12:], rstr[:4], rstr[4:])), 16
+
+
+def rowKeyBytes(rowkey):
+    rstr = '%x' % rowkey
+    return binascii.unhexlify(rstr.zfill(len(rstr) + len(rstr) % 2)), len(rstr)
+
+
+def rowKeyText(rowkey):
+    rstr = str(rowkey)
+    return rstr, len(rstr)
+
+
+def rowKeyInet(rowkey):
+    i = rowkey % 256
+    return '%d.%d.%d.%d' % (i, i, i, i), 4
+
+
+rowKeyEncoders = {
+    'Int32Type': lambda rowkey: (int(rowkey), 4),
+    'DecimalType': lambda rowkey: (decimal.Decimal(rowkey), 4),
+    'LongType': lambda rowkey: (long(rowkey), 8),
+    'UTF8Type': rowKeyText,
+    'AsciiType': rowKeyText,
+    'TimeUUIDType': lambda rowkey: (uuid.uuid1(), 16),
+    'UUIDType': rowKeyUUID,
+    # Local naive datetime, matching the literal getValueFromRowKey builds from time.localtime().
+    'TimestampType': lambda rowkey: (datetime.datetime.fromtimestamp(116233200 + rowkey), 16),
+    'DateType': lambda rowkey: (datetime.datetime.fromtimestamp(116233200 + rowkey), 16),
+    'DoubleType': lambda rowkey: (float(rowkey), 8),
+    'FloatType': lambda rowkey: (float(rowkey), 8),
+    'CounterColumnType': lambda rowkey: (long(rowkey), 8),
+    'BooleanType': lambda rowkey: (rowkey % 2 == 1, 1),
+    'BytesType': rowKeyBytes,
+    'IntegerType': lambda rowkey: (long(rowkey), len(str(rowkey))),
+    'InetAddressType': rowKeyInet,
+}
+
+
+def getTypedValueFromRowKey(dataType, rowkey):
+    """
+    Same as getValueFromRowKey, but returns a Python value to bind to a prepared statement instead of a CQL literal.
+    """
+    if dataType not in rowKeyEncoders:
+        raise Exception()
+    return rowKeyEncoders[dataType](rowkey)
+
+
 def splitParenthesis(s):
     left = s.find('(')
     right = s.rfind(')')
@@ -379,8 +786,32 @@ class UDT():
 
         return ret_str, total_length
 
+    def getTypedRandomValue(self, arg1, arg2):
+        # The driver binds a tuple to a UDT field by field, in member order.
+        total_length = 0
+        values = []
+        for member_name, member_type in self.members:
+            v, l = getTypedRandomValue(member_type, arg1, arg2)
+            values.append(v)
+            total_length += l
+
+        return tuple(values), total_length
+
+
+parsedTypes = {}
+
 
 def getType(validator):
+    """
+    Parses a validator class string into the type names used here, e.g. 'MapType/Int32Type/UTF8Type', or a UDT.
+    Results are kept, so each distinct validator is parsed once.
+    """
+    if validator not in parsedTypes:
+        parsedTypes[validator] = parseType(validator)
+    return parsedTypes[validator]
+
+
+def parseType(validator):
     parentType = validator
     columntype = None
 
@@ -413,6 +844,121 @@ def getType(validator):
     return columntype
 
 
+schemaCache = {}
+SCHEMA_CACHE_FILE = os.path.expanduser('~/.geppetto/schema_cache.pickle')
+
+
+def loadCachedSchema(keyspace_name, table_name, schema_version):
+    """
+    :return: (columns, spaceFiller, nr_regular_columns, counter_table) parsed under schema_version, or None.
+    """
+    key = (keyspace_name, table_name)
+    if key not in schemaCache and os.path.exists(SCHEMA_CACHE_FILE):
+        try:
+            with open(SCHEMA_CACHE_FILE, 'rb') as fp:
+                schemaCache.update(cPickle.load(fp))
+        except Exception:
+            pass  # A damaged cache only costs a schema query.
+
+    version, schema = schemaCache.get(key, (None, None))
+    if schema_version is None or version != schema_version:
+        return None
+    return schema
+
+
+def storeCachedSchema(keyspace_name, table_name, schema_version, schema):
+    if schema_version is None:
+        return
+    schemaCache[(keyspace_name, table_name)] = (schema_version, schema)
+
+    # Several population processes may share the file, write it whole and rename it into place.
+    tmp_file = '%s.%d' % (SCHEMA_CACHE_FILE, os.getpid())
+    try:
+        with open(tmp_file, 'wb') as fp:
+            cPickle.dump(schemaCache, fp, cPickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_file, SCHEMA_CACHE_FILE)
+    except Exception:
+        pass
+
+
+class RowEncoder():
+    """
+    A table's column list compiled once into one value function per column, so encoding a row does no dispatch on
+    type names. Key columns are derived from the row number, the others drawn by compileSeededValue functions.
+    """
+    def __init__(self, ts, uuid4=None):
+        self.uuid4 = uuid4
+        self.fields = []
+        for column_name, data_type, column_type in ts.columns:
+            is_filler = column_name == ts.spaceFiller
+            if column_type == 'regular':
+                self.fields.append((False, is_filler, compileSeededValue(data_type)))
+            elif data_type == 'TimeUUIDType':  # The only key type not derived from rownum alone.
+                self.fields.append((True, is_filler, lambda rownum, rng: (getSeededTimeUUID(rng), 16)))
+            else:
+                if data_type not in rowKeyEncoders:
+                    raise Exception('Cannot derive %s from a row number.' % data_type)
+                encode = rowKeyEncoders[data_type]
+                self.fields.append((True, is_filler, lambda rownum, rng, encode=encode: encode(rownum)))
+
+    def encode(self, rownum, record_size, rng, pool):
+        """
+        :return: Values for ts.columns, in order. The space filler takes what is left of record_size.
+        """
+        uuid4 = self.uuid4
+        values = []
+        for is_key, is_filler, encode in self.fields:
+            if is_key:
+                column_value, l = encode(rownum, rng)
+            else:
+                item_length = record_size if is_filler and record_size > 16 else 16
+                column_value, l = encode(rng, pool, item_length, 4, uuid4)
+
+            values.append(column_value)
+            record_size -= l
+
+        return values
+
+
+class QueryEncoder():
+    """
+    CQL string counterpart of RowEncoder, for the default (unprepared) path: the INSERT column list and one literal
+    function per column are built once, so a row is a list of calls and one join.
+    """
+    def __init__(self, ts):
+        self.insert_prefix = 'INSERT INTO %s.%s (%s) VALUES (' % (ts.keyspace_name, ts.table_name,
+                                                                 ','.join(column_name for column_name, _, _ in ts.columns))
+        self.fields = []
+        self.key_fields = []
+        for column_name, data_type, column_type in ts.columns:
+            if column_type == 'regular':
+                self.fields.append((False, column_name == ts.spaceFiller, compileLiteralValue(data_type)))
+                continue
+            encode = rowKeyLiterals.get(data_type)
+            if encode is None:  # Fails like getValueFromRowKey, once a row is built.
+                encode = lambda rowkey, data_type=data_type: getValueFromRowKey(data_type, rowkey)
+            self.fields.append((True, False, encode))
+            self.key_fields.append((column_name, encode))
+
+    def insertQuery(self, rownum, record_size, uuid4=None):
+        """
+        :return: INSERT of a row with random values. The space filler takes what is left of record_size.
+        """
+        values = []
+        for is_key, is_filler, encode in self.fields:
+            if is_key:
+                column_value, l = encode(rownum)
+            else:
+                item_length = record_size if is_filler and record_size > 16 else 16
+                column_value, l = encode(item_length, 4, uuid4)
+            values.append(column_value)
+            record_size -= l
+        return self.insert_prefix + ','.join(values) + ');'
+
+    def wherePart(self, rownum):
+        return ' and '.join('%s = %s' % (column_name, encode(rownum)[0]) for column_name, encode in self.key_fields)
+
+
 class TestSchema():
     def __init__(self, cluster, keyspace_name, table_name):
         self.cluster = cluster
@@ -424,7 +970,24 @@ class TestSchema():
         self.nr_regular_columns = 0
         self.counter_table = False
 
+        # Prepared statements, see prepareStatements().
+        self.insert_statement = None
+        self.update_statements = {}  # column name -> statement, SET column = ? (counters: column = column + ?)
+        self.delete_statement = None
+        self.read_statement = None
+        self.scan_statements = {}  # LIMIT -> statement
+        self.scan_lengths = [100]  # LIMITs prepareStatements() prepares range scans for.
+        self.row_encoder = None
+        self.query_encoder = None
+
     def getSchema(self):
+        self.row_encoder = self.query_encoder = None  # Compiled for the previous column list.
+        schema_version = self.cluster.getSchemaVersion()
+        schema = loadCachedSchema(self.keyspace_name, self.table_name, schema_version)
+        if schema is not None:
+            self.columns, self.spaceFiller, self.nr_regular_columns, self.counter_table = schema
+            self.columns = list(self.columns)
+            return True
 
         query = "select column_name, validator, type from system.schema_columns where keyspace_name = '%s' and columnfamily_name = '%s'" % \
                 (self.keyspace_name, self.table_name)
@@ -434,6 +997,9 @@ class TestSchema():
         if not success:
             return success
 
+        self.columns = []
+        self.spaceFiller = None
+        self.counter_table = False
         self.nr_regular_columns = 0
         for row in result:
             if row.type == 'regular':
@@ -456,10 +1022,24 @@ class TestSchema():
         if self.spaceFiller is not None:
             self.columns.append((self.spaceFiller, 'UTF8Type', 'regular'))
 
+        if self.columns:  # No columns means no such table yet, nothing worth keeping.
+            storeCachedSchema(self.keyspace_name, self.table_name, schema_version,
+                              (self.columns, self.spaceFiller, self.nr_regular_columns, self.counter_table))
+
         return success
 
-    def getRandomTargetColumn(self):
-        target_column = random.randrange(1, self.nr_regular_columns + 1)
+    def getRowEncoder(self, uuid4=None):
+        if self.row_encoder is None or self.row_encoder.uuid4 != uuid4:
+            self.row_encoder = RowEncoder(self, uuid4)
+        return self.row_encoder
+
+    def getQueryEncoder(self):
+        if self.query_encoder is None:
+            self.query_encoder = QueryEncoder(self)
+        return self.query_encoder
+
+    def getRandomTargetColumn(self, rng=random):
+        target_column = rng.randrange(1, self.nr_regular_columns + 1)
         cur_column = 0
         for column_name, data_type, column_type in self.columns:
             if column_type == 'regular':
@@ -477,45 +1057,103 @@ class TestSchema():
     def getInsertQuerywithRandomData(self, rownum, record_size, uuid4=None):
         if self.counter_table:
             return self.getInsertQuerywithRandomData4CounterTbl(rownum)
-        query_1 = "INSERT INTO %s.%s (" % (self.keyspace_name, self.table_name)
-        query_2 = ") VALUES ("
-        needCommaFlag = False
-        for column_name, data_type, column_type in self.columns:
-            item_length = 16
-            if column_name == self.spaceFiller and record_size > item_length:
-                item_length = record_size
-            if needCommaFlag:
-                query_1 += ','
-                query_2 += ','
-            query_1 += column_name
+        return self.getQueryEncoder().insertQuery(rownum, record_size, uuid4)
 
-            if column_type == 'regular':
-                if uuid4:
-                    column_value, l = getRandomValue(data_type, item_length, 4, uuid4)
-                else:
-                    column_value, l = getRandomValue(data_type, item_length, 4)
-            else:
-                column_value, l = getValueFromRowKey(data_type, rownum)
+    def getWherePart(self, rownum):
+        return self.getQueryEncoder().wherePart(rownum)
 
-            query_2 += column_value
-            record_size -= l
-            needCommaFlag = True
+    def getPartitionKey(self, rownum):
+        return tuple(getValueFromRowKey(data_type, rownum)[0] for column_name, data_type, column_type in self.columns
+                     if column_type == 'partition_key')
 
-        return query_1 + query_2 + ");"
+    def getPartitionKeyColumns(self):
+        return [(column_name, data_type) for column_name, data_type, column_type in self.columns if column_type == 'partition_key']
 
-    def getWherePart(self, rownum):
-        query = ''
-        needAndFlag = False
+    def getKeyColumns(self):
+        return [(column_name, data_type) for column_name, data_type, column_type in self.columns if column_type != 'regular']
+
+    def prepareStatements(self):
+        """
+        Prepares one INSERT, one DELETE and one UPDATE per regular column. The coordinator parses each once, rows are
+        then sent as typed bound values.
+        """
+        session = self.cluster.session
+        table = '%s.%s' % (self.keyspace_name, self.table_name)
+        where = ' AND '.join('%s = ?' % column_name for column_name, _ in self.getKeyColumns())
+
+        if not self.counter_table:
+            column_names = [column_name for column_name, _, _ in self.columns]
+            self.insert_statement = session.prepare('INSERT INTO %s (%s) VALUES (%s)' % (table, ', '.join(column_names), ', '.join(['?'] * len(column_names))))
+
+        self.update_statements = {}
         for column_name, data_type, column_type in self.columns:
             if column_type != 'regular':
-                column_value, l = getValueFromRowKey(data_type, rownum)
-                if needAndFlag:
-                    query += ' and '
+                continue
+            if self.counter_table:
+                cql = 'UPDATE %s SET %s = %s + ? WHERE %s' % (table, column_name, column_name, where)
+            else:
+                cql = 'UPDATE %s SET %s = ? WHERE %s' % (table, column_name, where)
+            self.update_statements[column_name] = session.prepare(cql)
 
-                query += '%s = %s' % (column_name, column_value)
-                needAndFlag = True
+        self.delete_statement = session.prepare('DELETE FROM %s WHERE %s' % (table, where))
+        self.read_statement = session.prepare('SELECT * FROM %s WHERE %s' % (table, where))
+
+        partition_key = [column_name for column_name, _ in self.getPartitionKeyColumns()]
+        self.scan_statements = {}
+        for scan_length in self.scan_lengths:
+            self.scan_statements[scan_length] = session.prepare('SELECT * FROM %s WHERE token(%s) >= token(%s) LIMIT %d' % (
+                table, ', '.join(partition_key), ', '.join(['?'] * len(partition_key)), scan_length))
+
+    def getKeyValues(self, rownum):
+        return [getTypedValueFromRowKey(data_type, rownum)[0] for _, data_type in self.getKeyColumns()]
+
+    def getInsertStatement(self, rownum, record_size, uuid4=None):
+        """
+        Bound statement counterpart of getInsertQuerywithRandomData.
+        """
+        if self.counter_table:
+            column_name, data_type, column_type = self.getRandomTargetColumn()
+            return self.update_statements[column_name].bind([1] + self.getKeyValues(rownum))
 
-        return query
+        values = self.getRowEncoder(uuid4).encode(rownum, record_size, random, getFillerPool())
+        return self.insert_statement.bind(values)
+
+    def getUpdateStatement(self, rownum):
+        """
+        Bound statement counterpart of getUpdateQuery.
+        """
+        column_name, data_type, column_type = self.getRandomTargetColumn()
+        if self.counter_table:
+            column_value = 1
+        else:
+            column_value, l = getTypedRandomValue(data_type, 16, 16)
+        return self.update_statements[column_name].bind([column_value] + self.getKeyValues(rownum))
+
+    def getDeleteStatement(self, rownum):
+        """
+        Bound statement counterpart of getDeleteQuery.
+        """
+        return self.delete_statement.bind(self.getKeyValues(rownum))
+
+    def getReadStatement(self, rownum):
+        return self.read_statement.bind(self.getKeyValues(rownum))
+
+    def getScanStatement(self, rownum, scan_length=100):
+        """
+        Range scan of scan_length rows in token order, starting at the partition of rownum.
+        """
+        values = [getTypedValueFromRowKey(data_type, rownum)[0] for _, data_type in self.getPartitionKeyColumns()]
+        return self.scan_statements[scan_length].bind(values)
+
+    def getScanQuery(self, rownum, scan_length=100):
+        partition_key = self.getPartitionKeyColumns()
+        return "SELECT * FROM %s.%s WHERE token(%s) >= token(%s) LIMIT %d;" % (
+            self.keyspace_name, self.table_name, ', '.join(column_name for column_name, _ in partition_key),
+            ', '.join(getValueFromRowKey(data_type, rownum)[0] for _, data_type in partition_key), scan_length)
+
+    def getReadQuery(self, rownum):
+        whereQuery = self.getWherePart(rownum)
+        return "SELECT * FROM %s.%s WHERE %s;" % (self.keyspace_name, self.table_name, whereQuery)
 
     def getDeleteQuery(self, rownum):
         whereQuery = self.getWherePart(rownum)
@@ -564,10 +1202,7 @@ def createUDT(cluster, keyspace_name, schema):
 
 
 def createKeyspace(cluster, keyspace_name, replication_class='NetworkTopologyStrategy', replication_factor=3):
-    cql = 'SELECT * FROM system.schema_keyspaces;'  # Grab keyspaces.
-    result, success = cluster.runQuery(cql)
-    
-    if keyspace_name in str(result):
+    if keyspace_name in cluster.session.cluster.metadata.keyspaces:
         #print('Keyspace %s already exists.' % keyspace_name)
         pass
         
@@ -588,10 +1223,9 @@ def createKeyspace(cluster, keyspace_name, replication_class='NetworkTopologyStr
 
 
 def createTable(cluster, keyspace_name, table_name, schema_file):
-    cql = "SELECT columnfamily_name FROM system.schema_columnfamilies WHERE keyspace_name = '%s' ;" % (keyspace_name)
-    result, success = cluster.runQuery(cql)
+    keyspace = cluster.session.cluster.metadata.keyspaces.get(keyspace_name)
 
-    if table_name in str(result):
+    if keyspace is not None and table_name in keyspace.tables:
         #print('%s.%s already exists.' % (keyspace_name, table_name))
         pass
     else:  
@@ -618,12 +1252,292 @@ def getKSCFNames(db_name):
     return (w[0], w[1])
 
 
-def do_insert(cluster, target_db, schema_file, record_size, start_record, record_count, uuid4=None, replication_factor=3, suppress_output=False):
+class RowGenerator():
+    """
+    Generates insert statements for chunks of rows. Every value of a row is a pure function of
+    (seed, keyspace.table, rownum, version): the row draws from its own random.Random seeded from those, and filler
+    text is sliced out of a FillerPool built once from the seed. A row is therefore byte-identical whichever chunk,
+    worker or run produces it, and do_verify can regenerate it instead of keeping a copy.
+    """
+    def __init__(self, ts, record_size, seed, uuid4=None, version=0):
+        self.ts = ts
+        self.record_size = int(record_size)
+        self.seed = int(seed)
+        self.uuid4 = uuid4
+        self.version = int(version)
+        self.table = '%s.%s' % (ts.keyspace_name, ts.table_name)
+        self.pool = FillerPool(self.seed)
+        self.encoder = RowEncoder(ts, uuid4)
+
+    def getRowRandom(self, rownum):
+        digest = hashlib.md5('%d:%s:%d:%d' % (self.seed, self.table, rownum, self.version)).hexdigest()
+        return random.Random(int(digest[:16], 16))
+
+    def generateRow(self, rownum):
+        """
+        :return: Values for ts.columns, in order.
+        """
+        return self.encoder.encode(rownum, self.record_size, self.getRowRandom(rownum), self.pool)
+
+    def generateStatements(self, start_record, count):
+        """
+        :return: Bound insert statements (counter increments for counter tables) for rows [start_record, start_record + count).
+        """
+        ts = self.ts
+        statements = []
+        for rownum in xrange(start_record, start_record + count):
+            if ts.counter_table:
+                column_name, data_type, column_type = ts.getRandomTargetColumn(self.getRowRandom(rownum))
+                statements.append(ts.update_statements[column_name].bind([1] + ts.getKeyValues(rownum)))
+            else:
+                statements.append(ts.insert_statement.bind(self.generateRow(rownum)))
+        return statements
+
+
+class LatencyHistogram():
+    """
+    HDR-style histogram of latencies in microseconds. Buckets are log spaced with 32 linear sub-buckets per power of two,
+    so any recorded value is reported within about 3% while memory stays a few hundred counters however many values are
+    recorded.
+    """
+    SUB_BUCKET_BITS = 5
+
+    def __init__(self):
+        self.counts = collections.defaultdict(int)
+        self.count = 0
+        self.max = 0
+
+    @classmethod
+    def bucketIndex(cls, us):
+        if us < (1 << cls.SUB_BUCKET_BITS):
+            return us
+        exponent = us.bit_length() - cls.SUB_BUCKET_BITS - 1
+        return ((exponent + 1) << cls.SUB_BUCKET_BITS) + ((us >> exponent) & ((1 << cls.SUB_BUCKET_BITS) - 1))
+
+    @classmethod
+    def bucketValue(cls, index):
+        if index < (1 << cls.SUB_BUCKET_BITS):
+            return index
+        exponent = (index >> cls.SUB_BUCKET_BITS) - 1
+        return ((1 << cls.SUB_BUCKET_BITS) + (index & ((1 << cls.SUB_BUCKET_BITS) - 1))) << exponent
+
+    def record(self, seconds):
+        us = max(0, int(seconds * 1000000))
+        self.counts[self.bucketIndex(us)] += 1
+        self.count += 1
+        self.max = max(self.max, us)
+
+    def percentiles(self, percentiles):
+        """
+        :param percentiles: Ascending list, e.g. [50, 99, 99.9].
+        :return: Latency in microseconds for each percentile (bucket lower bound), 0 if nothing was recorded.
+        """
+        values = []
+        seen = 0
+        pending = list(percentiles)
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            while pending and seen >= self.count * pending[0] / 100.0:
+                values.append(self.bucketValue(index))
+                pending.pop(0)
+        return values + [0] * len(pending)
+
+
+class WorkloadMetrics():
+    """
+    Latency histograms per operation type. Every `interval` seconds a snapshot of the last interval is appended to
+    `metrics_file` as one JSON line, e.g.
+    {"time": 1500000000.0, "pid": 123, "table": "ks1.table1", "interval": 10.0,
+     "ops": {"insert": {"count": 5000, "ops_per_s": 500.0, "errors": 0, "p50_ms": 1.2, "p95_ms": 3.1, "p99_ms": 8.0,
+                        "p999_ms": 40.2, "max_ms": 61.0}}}
+    """
+    PERCENTILES = [50, 95, 99, 99.9]
+
+    def __init__(self, metrics_file, table, interval=10.0, suppress_output=False):
+        self.metrics_file = metrics_file
+        self.table = table
+        self.interval = float(interval)
+        self.suppress_output = suppress_output
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.errors = collections.defaultdict(int)
+        self.started = time.time()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def record(self, op, seconds):
+        with self.lock:
+            if op not in self.histograms:
+                self.histograms[op] = LatencyHistogram()
+            self.histograms[op].record(seconds)
+
+    def recordError(self, op):
+        with self.lock:
+            self.errors[op] += 1
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.snapshot()
+
+    def snapshot(self):
+        with self.lock:
+            histograms, self.histograms = self.histograms, {}
+            errors, self.errors = self.errors, collections.defaultdict(int)
+            now = time.time()
+            elapsed, self.started = max(now - self.started, 0.001), now
+
+        ops = {}
+        for op in set(histograms) | set(errors):
+            histogram = histograms.get(op, LatencyHistogram())
+            stats = {'count': histogram.count, 'ops_per_s': round(histogram.count / elapsed, 2), 'errors': errors.get(op, 0),
+                     'max_ms': histogram.max / 1000.0}
+            for percentile, us in zip(self.PERCENTILES, histogram.percentiles(self.PERCENTILES)):
+                stats['p%s_ms' % str(percentile).replace('.', '')] = us / 1000.0
+            ops[op] = stats
+
+        if not ops:
+            return
+
+        if self.metrics_file:
+            line = json.dumps({'time': round(now, 3), 'pid': os.getpid(), 'table': self.table, 'interval': round(elapsed, 3), 'ops': ops})
+            with open(self.metrics_file, 'a') as fp:
+                fp.write(line + '\n')  # One write per line, so workers appending to the same file do not interleave.
+
+        if not self.suppress_output:
+            report('%s %s' % (self.table, ' '.join('%s: %.0f/s p99 %.1fms' % (op, stats['ops_per_s'], stats['p99_ms'])
+                                                   for op, stats in sorted(ops.items()))))
+
+    def close(self):
+        """
+        Stops the snapshot thread and writes out what was recorded since the last snapshot.
+        """
+        self.stopped.set()
+        self.thread.join()
+        self.snapshot()
+
+
+class AsyncWriter():
+    """
+    Keeps up to `concurrency` writes in flight with session.execute_async. A failed write is retried on its own after an
+    exponential backoff, holding only its own slot, while the rest of the window keeps going.
+    """
+    BACKOFF_BASE = 0.1
+    BACKOFF_MAX = 30
+
+    def __init__(self, session, concurrency=64, retries=8, on_error=None, on_success=None, metrics=None):
+        self.session = session
+        self.retries = retries
+        self.on_error = on_error
+        self.on_success = on_success  # Called as on_success(context, rows) from the driver's callback thread.
+        self.metrics = metrics  # WorkloadMetrics, gets the latency of every operation submitted with an op name.
+        self.slots = threading.Semaphore(concurrency)
+        self.condition = threading.Condition()
+        self.jitter = random.Random()  # Own generator, so retries do not shift the row data sequence.
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.errors = 0
+        self.last_error = None
+
+    def submit(self, statement, context=None, op=None):
+        """
+        Blocks while the window is full, then sends the statement.
+        :param context: Handed back to on_success with the result rows.
+        :param op: Operation name to record latency under, e.g. 'insert'.
+        """
+        self.slots.acquire()
+        with self.condition:
+            self.in_flight += 1
+        self._execute(statement, 0, (context, op, time.time()))
+
+    def _execute(self, statement, attempt, request):
+        try:
+            future = self.session.execute_async(statement)
+        except Exception as e:
+            self._onError(e, statement, attempt, request)
+            return
+        future.add_callbacks(self._onSuccess, self._onError, callback_args=(request,), errback_args=(statement, attempt, request))
+
+    def _onSuccess(self, rows, request):
+        context, op, start = request
+        try:
+            if self.metrics and op:
+                self.metrics.record(op, time.time() - start)  # Includes retries, as a client would see it.
+            if self.on_success:
+                self.on_success(context, rows)
+        finally:
+            self._release(True)
+
+    def _onError(self, e, statement, attempt, request):
+        with self.condition:
+            self.errors += 1
+            self.last_error = e
+        if self.on_error:
+            self.on_error(e)
+
+        if attempt >= self.retries:
+            context, op, start = request
+            if self.metrics and op:
+                self.metrics.recordError(op)
+            self._release(False)
+            return
+
+        delay = min(self.BACKOFF_MAX, self.BACKOFF_BASE * 2 ** attempt) * self.jitter.uniform(0.5, 1.0)
+        t = threading.Timer(delay, self._execute, (statement, attempt + 1, request))
+        t.daemon = True
+        t.start()
+
+    def _release(self, success):
+        with self.condition:
+            self.in_flight -= 1
+            if success:
+                self.completed += 1
+            else:
+                self.failed += 1
+            self.condition.notify_all()
+        self.slots.release()
+
+    def join(self):
+        """
+        Waits until every submitted write succeeded or ran out of retries.
+        """
+        with self.condition:
+            while self.in_flight:
+                self.condition.wait(1)
+
+
+def restartLocalNodeIfDown():
+    p = subprocess.Popen('nodetool status', stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
+    out, err = p.communicate()
+
+    if "Failed to connect" in err:  # This node's cassandra is down
+        report('**** Restarting Cassandra ****')
+        os.system('sudo service cassandra start')
+    elif 'DN' in out:
+        report('**** Another Node is down, writes to it will be retried. ****')
+
+
+def do_insert(cluster, target_db, schema_file, record_size, start_record, record_count, uuid4=None, replication_factor=3, suppress_output=False, prepared=False, concurrency=64, batch_size=1, progress=None, seed=None, version=0,
+              metrics_file=None, metrics_interval=10):
+    """
+    Inserts record_count rows starting at start_record, keeping up to `concurrency` writes in flight.
+    :param batch_size: Rows of the same partition are grouped into one unlogged batch of up to this many rows. Rows of
+    different partitions are never batched together.
+    :param progress: Optional shared multiprocessing.Value, incremented as rows are submitted.
+    :param seed: Generate rows in chunks with a RowGenerator, byte-identical for a given (seed, table, rownum, version).
+    Implies prepared.
+    :param version: Row version mixed into the seed, bump it to overwrite rows with new verifiable content.
+    :param metrics_file: Append latency and throughput snapshots here every metrics_interval seconds, see WorkloadMetrics.
+    """
     record_size = int(record_size)
     record_num = int(start_record)
     record_count = int(record_count)
+    batch_size = int(batch_size)
     end_record = record_num + record_count
     inserted_record = 0
+    reported_record = 0
 
     #random.seed(0)
 
@@ -636,71 +1550,446 @@ def do_insert(cluster, target_db, schema_file, record_size, start_record, record
 
     ts = TestSchema(cluster, ks_name, cf_name)
     ts.getSchema()
-
-    if ts.counter_table:
-        batch = BatchStatement(batch_type = BatchType.COUNTER)
-    else:
-        batch = BatchStatement()
+    generator = None
+    if seed is not None:
+        prepared = True
+    if prepared:
+        ts.prepareStatements()
+    if seed is not None:
+        generator = RowGenerator(ts, record_size, seed, uuid4, version)
+    chunk = []
+
+    last_check = [0]
+
+    def on_error(e):
+        # Look at the local node at most once a minute, and never on the driver's callback thread.
+        if time.time() - last_check[0] > 60:
+            last_check[0] = time.time()
+            report('**** Detected Exception: %s ****' % e, 'warning')
+            t = threading.Thread(target=restartLocalNodeIfDown)
+            t.daemon = True
+            t.start()
+
+    metrics = WorkloadMetrics(metrics_file, target_db, metrics_interval, suppress_output) if metrics_file else None
+    writer = AsyncWriter(cluster.session, concurrency=int(concurrency), on_error=on_error, metrics=metrics)
+
+    batch = None
+    batch_partition = None
+    batch_rows = 0
 
     i = 0
     while record_num < end_record:
-        if uuid4:
+        if generator is not None:
+            if not chunk:
+                chunk = generator.generateStatements(record_num, min(1000, end_record - record_num))
+                chunk.reverse()
+            query = chunk.pop()
+        elif prepared:
+            query = ts.getInsertStatement(record_num, record_size, uuid4)
+        elif uuid4:
             query = ts.getInsertQuerywithRandomData(record_num, record_size, uuid4)
         else:
             query = ts.getInsertQuerywithRandomData(record_num, record_size)
 
         if i == 0 and not suppress_output:
-            report(query)
-
-        batch.add(query)
+            report(query.prepared_statement.query_string if prepared else query)
+
+        if batch_size > 1:
+            partition = ts.getPartitionKey(record_num)
+            if batch is not None and (partition != batch_partition or batch_rows >= batch_size):
+                writer.submit(batch, op='insert')
+                batch = None
+            if batch is None:
+                batch = BatchStatement(batch_type=BatchType.COUNTER if ts.counter_table else BatchType.UNLOGGED)
+                batch_partition = partition
+                batch_rows = 0
+            batch.add(query)
+            batch_rows += 1
+        else:
+            writer.submit(query, op='insert')
 
         record_num += 1
         inserted_record += 1
 
         if (inserted_record % 100) == 0 or record_num == end_record:
+            if progress is not None:
+                with progress.get_lock():
+                    progress.value += inserted_record - reported_record
+                reported_record = inserted_record
+
             msg = '\rInserting %s %8d / %8d (%3d %%)' % (target_db, inserted_record, record_count,
                                                       inserted_record * 100 / record_count)
             #sys.stdout.write(msg + '\n') ; sys.stdout.flush()
             if not suppress_output:
                 report(msg)
-            try:
-                cluster.session.execute(batch)
-            except Exception as e:
-                print("\n**** Detected Exception ****")
-                print(e)
-                print('\n')
-                p = subprocess.Popen('nodetool status', stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell= True)
-                out, err = p.communicate()
-
-                if "Failed to connect" in err:  # This node's cassandra is down
-                    print("**** Restarting Cassandra ****")
-                    os.system('sudo service cassandra start')
-                    print('**** This Node crashed, sleeping for 3 minutes to reduce load. ****\n')
-                    time.sleep(60*3)
-                    print("")
-                elif 'DN' in out:
-                    print('**** Another Node crashed, sleeping for 3 minutes to reduce load. ****\n')
-                    time.sleep(60*3)
-                else:
-                    print("**** Sleeping for 3 minutes to reduce load. ****\n")
-                    time.sleep(60*3)
-
-            if ts.counter_table:
-                batch = BatchStatement(batch_type = BatchType.COUNTER)
-            else:
-                batch = BatchStatement()
 
         i += 1
 
+    if batch is not None:
+        writer.submit(batch, op='insert')
+    writer.join()
+    if metrics:
+        metrics.close()
+
+    if writer.failed:
+        report('%d of %d writes to %s failed after retries, last error: %s' % (writer.failed, writer.completed + writer.failed,
+                                                                           target_db, writer.last_error), 'error')
+
 
-def do_update(cluster, target_db, schema_file, record_size, start_record, batch_size, insert_percentage, delay, batch_count, replication_factor=3, suppress_output=False):
+def insertWorker(settings, start_record, record_count, progress, kwargs):
+    random.seed()  # Forked workers would otherwise all generate the same data. Seeded rows do not use it.
+
+    cluster = CassandraTestingCluster(**settings)
+    if not cluster.connect():
+        report('Cannot connect to cassandra cluster.', 'error')
+        sys.exit(-1)
+
+    try:
+        do_insert(cluster, start_record=start_record, record_count=record_count, suppress_output=True, progress=progress, **kwargs)
+    finally:
+        cluster.disconnect()
+
+
+def do_insert_parallel(cluster, target_db, schema_file, record_size, start_record, record_count, workers, replication_factor=3, **kwargs):
+    """
+    Splits [start_record, start_record + record_count) into `workers` contiguous ranges and inserts each from its own
+    process and session. Progress is aggregated through a shared counter.
+    :param cluster: Connected cluster, used to create the keyspace and table once before forking, then disconnected.
+    :param kwargs: Passed on to do_insert.
+    :return: False if a worker failed.
+    """
+    start_record = int(start_record)
+    record_count = int(record_count)
+    if record_count <= 0:
+        # mass_population gives nodes beyond the record count an empty range.
+        report('Nothing to insert: the record range of %s is empty (-n %d).' % (target_db, record_count), 'warning')
+        return True
+    workers = max(1, min(int(workers), record_count))
+
+    ks_name, cf_name = getKSCFNames(target_db)
+    if ks_name == None or cf_name == None:
+        return False
+
+    createKeyspace(cluster, ks_name, replication_factor=replication_factor)
+    createTable(cluster, ks_name, cf_name, schema_file)
+    cluster.disconnect()  # Driver sessions do not survive a fork, each worker opens its own.
+
+    kwargs.update(target_db=target_db, schema_file=schema_file, record_size=record_size, replication_factor=replication_factor)
+    progress = multiprocessing.Value('l', 0)
+    processes = []
+    worker_start = start_record
+    for n in range(workers):
+        worker_count = record_count / workers + (1 if n < record_count % workers else 0)
+        p = multiprocessing.Process(target=insertWorker, args=(cluster.getSettings(), worker_start, worker_count, progress, kwargs))
+        p.start()
+        processes.append(p)
+        worker_start += worker_count
+
+    while any(p.is_alive() for p in processes):
+        for p in processes:
+            p.join(5)
+            if p.is_alive():
+                break
+        inserted_record = progress.value
+        report('\rInserting %s %8d / %8d (%3d %%) with %d workers' % (target_db, inserted_record, record_count,
+                                                                      inserted_record * 100 / record_count, workers))
+
+    failed = [p.exitcode for p in processes if p.exitcode != 0]
+    if failed:
+        report('%d of %d population workers failed, exit codes %s' % (len(failed), workers, failed), 'error')
+    return not failed
+
+
+class TokenBucket():
+    """
+    Paces operations to `rate` per second. Tokens accrue with wall time, not with completed operations, so time spent
+    waiting on slow requests is made up afterwards (up to `burst` tokens) instead of lowering the achieved rate.
+    """
+    def __init__(self, rate, burst=None):
+        self.lock = threading.Lock()
+        self.rate = 0.0
+        self.burst = 1.0
+        self.tokens = 0.0
+        self.last = time.time()
+        self.setRate(rate, burst)
+
+    def setRate(self, rate, burst=None):
+        with self.lock:
+            self._refill()
+            self.rate = max(0.0, float(rate))
+            self.burst = float(burst) if burst else max(1.0, self.rate)  # One second worth by default.
+            self.tokens = min(self.tokens, self.burst)
+
+    def _refill(self):
+        now = time.time()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def acquire(self, n=1, timeout=1.0):
+        """
+        Takes n tokens, waiting for them to accrue.
+        :return: False if they did not within timeout seconds, e.g. because the rate was set to 0.
+        """
+        deadline = time.time() + timeout
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= n:
+                    self.tokens -= n
+                    return True
+                wait = (n - self.tokens) / self.rate if self.rate > 0 else timeout
+
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            time.sleep(min(wait, remaining))
+
+
+def bytesRateToOpsRate(bytes_rate, record_size):
+    """
+    Operations per second for a bytes per second target, never below one record per hour. Rates given per hour are
+    often smaller than one record (bytes_per_hour=1), which would otherwise stall the workload for weeks.
+    """
+    return max(float(bytes_rate) / record_size, 1 / 3600.0)
+
+
+class WorkloadControl():
+    """
+    Runtime settings of a running workload, read from a small JSON file that anyone may rewrite, e.g.
+    {"rate": 500} or {"bytes_rate": 1048576, "insert_percentage": 50} or {"mix": "read=90,update=10"} or {"stop": true}.
+    """
+    def __init__(self, control_file, interval=1.0):
+        self.control_file = control_file
+        self.interval = interval
+        self.next_check = 0
+        self.mtime = None
+
+    def poll(self):
+        """
+        :return: Dict of settings if the file changed since the last call, else None. Checks at most once per interval.
+        """
+        now = time.time()
+        if self.control_file is None or now < self.next_check:
+            return None
+        self.next_check = now + self.interval
+
+        try:
+            mtime = os.stat(self.control_file).st_mtime
+            if mtime == self.mtime:
+                return None
+            with open(self.control_file) as fp:
+                settings = json.load(fp)
+            self.mtime = mtime
+            return settings
+        except (OSError, IOError, ValueError):
+            return None  # Missing, or caught halfway through a rewrite; try again next interval.
+
+
+class UniformSelector():
+    """
+    Key selectors pick which existing record an operation targets. next(n) returns a record number in [0, n), where n
+    is the number of records written so far and may grow between calls. Every draw is O(1).
+    """
+    def __init__(self, rng):
+        self.rng = rng
+
+    def next(self, n):
+        return self.rng.randrange(n)
+
+
+class SequentialSelector():
+    """
+    Walks the records in order and wraps around.
+    """
+    def __init__(self, rng):
+        self.position = -1
+
+    def next(self, n):
+        self.position = (self.position + 1) % n
+        return self.position
+
+
+class ZipfianSelector():
+    """
+    Zipfian popularity as in YCSB (Gray et al., "Quickly generating billion-record synthetic databases"): record i is
+    drawn with probability proportional to 1 / (i + 1) ** theta. zeta(n) is summed exactly up to EXACT_TERMS and by its
+    integral beyond, so neither setting up nor growing n costs more than O(1) per new record.
+    With scramble, popularity is spread over the key space by hashing instead of concentrating on the lowest numbers.
+    """
+    EXACT_TERMS = 10000
+
+    def __init__(self, rng, theta=0.99, scramble=True):
+        self.rng = rng
+        self.theta = theta
+        self.scramble = scramble
+        self.alpha = 1.0 / (1.0 - theta)
+        self.zeta2 = 1.0 + 0.5 ** theta
+        self.n = 0
+        self.zetan = 0.0
+        self.eta = 0.0
+
+    def zetaTerms(self, start, end):
+        # Sum of 1 / i ** theta for i in (start, end].
+        exact_end = min(end, self.EXACT_TERMS)
+        total = sum(1.0 / i ** self.theta for i in xrange(start + 1, exact_end + 1))
+        start = max(start, exact_end)
+        if end > start:
+            total += ((end + 0.5) ** (1 - self.theta) - (start + 0.5) ** (1 - self.theta)) / (1 - self.theta)
+        return total
+
+    def grow(self, n):
+        self.zetan += self.zetaTerms(self.n, n)
+        self.n = n
+        if n > 2:  # Up to two records the first two ranks cover every draw and eta is never used (nor defined).
+            self.eta = (1 - (2.0 / n) ** (1 - self.theta)) / (1 - self.zeta2 / self.zetan)
+
+    def next(self, n):
+        if n != self.n:
+            if n < self.n:
+                self.n, self.zetan = 0, 0.0
+            self.grow(n)
+
+        u = self.rng.random()
+        uz = u * self.zetan
+        if uz < 1.0:
+            rank = 0
+        elif uz < self.zeta2:
+            rank = 1
+        else:
+            rank = min(n - 1, int(n * (self.eta * u - self.eta + 1) ** self.alpha))
+
+        if self.scramble:
+            return fnvHash64(rank) % n
+        return rank
+
+
+class LatestSelector():
+    """
+    Zipfian over recency: the most recently inserted records are the most popular.
+    """
+    def __init__(self, rng, theta=0.99):
+        self.zipfian = ZipfianSelector(rng, theta, scramble=False)
+
+    def next(self, n):
+        return n - 1 - self.zipfian.next(n)
+
+
+class HotspotSelector():
+    """
+    hot_op_fraction of the operations go to the first hot_set_fraction of the records, the rest to the others.
+    """
+    def __init__(self, rng, hot_set_fraction=0.2, hot_op_fraction=0.8):
+        self.rng = rng
+        self.hot_set_fraction = hot_set_fraction
+        self.hot_op_fraction = hot_op_fraction
+
+    def next(self, n):
+        hot_n = max(1, int(n * self.hot_set_fraction))
+        if hot_n >= n or self.rng.random() < self.hot_op_fraction:
+            return self.rng.randrange(hot_n)
+        return hot_n + self.rng.randrange(n - hot_n)
+
+
+def fnvHash64(value):
+    # FNV-1a over the 8 bytes of value, as YCSB scrambles zipfian ranks.
+    h = 0xcbf29ce484222325
+    for i in xrange(8):
+        h ^= (value >> (i * 8)) & 0xff
+        h = (h * 0x100000001b3) & 0xffffffffffffffff
+    return h
+
+
+KEY_SELECTORS = {
+    'uniform': UniformSelector,
+    'sequential': SequentialSelector,
+    'zipfian': ZipfianSelector,
+    'latest': LatestSelector,
+    'hotspot': HotspotSelector,
+}
+
+
+class OperationMix():
+    """
+    Picks the next operation by weight, e.g. OperationMix({'read': 50, 'update': 40, 'insert': 10}).
+    """
+    OPERATIONS = ['read', 'scan', 'insert', 'update', 'delete']
+
+    def __init__(self, weights, rng):
+        unknown = set(weights) - set(self.OPERATIONS)
+        if unknown:
+            raise Exception('Unknown operations in mix: %s' % ', '.join(sorted(unknown)))
+        total = float(sum(weights.values()))
+        if total <= 0:
+            raise Exception('Operation mix has no weight.')
+
+        self.rng = rng
+        self.weights = dict(weights)
+        self.cumulative = []
+        running = 0.0
+        for op in self.OPERATIONS:
+            if weights.get(op, 0) > 0:
+                running += weights[op] / total
+                self.cumulative.append((running, op))
+
+    @classmethod
+    def parse(cls, mix, rng):
+        """
+        :param mix: 'op=weight,...' string, e.g. 'read=50,update=40,insert=10'.
+        """
+        weights = {}
+        for item in mix.split(','):
+            op, weight = item.split('=')
+            weights[op.strip()] = float(weight)
+        return cls(weights, rng)
+
+    @classmethod
+    def fromInsertPercentage(cls, insert_percentage, rng):
+        # The original update workload: the given share of inserts, the rest 70% updates and 30% deletes.
+        rest = 100 - insert_percentage
+        return cls({'insert': insert_percentage, 'update': rest * 0.7, 'delete': rest * 0.3}, rng)
+
+    def next(self):
+        u = self.rng.random()
+        for bound, op in self.cumulative:
+            if u < bound:
+                return op
+        return self.cumulative[-1][1]
+
+    def __str__(self):
+        return ','.join('%s=%g' % (op, self.weights[op]) for op in self.OPERATIONS if self.weights.get(op, 0) > 0)
+
+
+def do_update(cluster, target_db, schema_file, record_size, start_record, batch_size, insert_percentage, delay, batch_count, replication_factor=3, suppress_output=False, prepared=False,
+              rate=None, bytes_rate=None, control_file=None, concurrency=64, metrics_file=None, metrics_interval=10,
+              mix=None, distribution='uniform', scan_length=100):
+    """
+    Runs a mix of reads, inserts, updates and deletes paced by a token bucket, with up to `concurrency` requests in
+    flight. Inserts append new records, the other operations target existing ones chosen by a key selector.
+    :param insert_percentage: Share of inserts, the rest split 70/30 between updates and deletes. Ignored with mix.
+    :param batch_size: With delay, the legacy way to give the rate: batch_size operations every delay ms.
+    :param batch_count: Stop after batch_count * batch_size operations, run until stopped if negative.
+    :param rate: Target operations per second.
+    :param bytes_rate: Target bytes per second, counting record_size per operation, at least one record per hour. Takes
+    precedence over rate.
+    :param control_file: JSON file polled for rate, bytes_rate, insert_percentage, mix or stop while running, see
+    WorkloadControl.
+    :param mix: Operation weights as 'op=weight,...' over read, scan, insert, update and delete, see OperationMix.
+    :param distribution: Key selector for non-insert operations: uniform, sequential, zipfian, latest or hotspot.
+    :param scan_length: Rows per range scan.
+    :param metrics_file: Append latency and throughput snapshots here every metrics_interval seconds, see WorkloadMetrics.
+    """
     record_size = int(record_size)
     start_record = int(start_record)
     batch_size = int(batch_size)
     insert_percentage = int(insert_percentage)
     delay = float(delay) / 1000
     batch_count = int(batch_count)
-    nr_batch = 0
+    max_ops = batch_count * batch_size if batch_count >= 0 else None
+
+    if bytes_rate:
+        rate = bytesRateToOpsRate(bytes_rate, record_size)
+    elif not rate:
+        rate = batch_size / delay if delay > 0 else batch_size * 1000.0
 
     random.seed(1)
 
@@ -713,44 +2002,422 @@ def do_update(cluster, target_db, schema_file, record_size, start_record, batch_
 
     ts = TestSchema(cluster, ks_name, cf_name)
     ts.getSchema()
+    ts.scan_lengths = [int(scan_length)]
+    if prepared:
+        ts.prepareStatements()
 
-    while True:
-        if ts.counter_table:
-            batch = BatchStatement(batch_type = BatchType.COUNTER)
-        else:
-            batch = BatchStatement()
-        stat_str = ''
-        for i in range(batch_size):
-            if start_record <= 0 or random.randrange(100) <= insert_percentage:
-                # insert case
-                record_num = start_record
+    if mix:
+        operations = OperationMix.parse(mix, random)
+    else:
+        operations = OperationMix.fromInsertPercentage(insert_percentage, random)
+    if distribution not in KEY_SELECTORS:
+        raise Exception('Unknown key distribution %s.' % distribution)
+    selector = KEY_SELECTORS[distribution](random)
+
+    limiter = TokenBucket(rate)
+    control = WorkloadControl(control_file)
+    metrics = WorkloadMetrics(metrics_file, target_db, metrics_interval, suppress_output) if metrics_file else None
+    writer = AsyncWriter(cluster.session, concurrency=int(concurrency), metrics=metrics)
+    report('Running %s workload at %.2f ops/s, %s, %s keys.' % (target_db, rate, operations, distribution))
+
+    ops = 0
+    while max_ops is None or ops < max_ops:
+        settings = control.poll()
+        if settings:
+            if settings.get('stop'):
+                break
+            if settings.get('bytes_rate'):
+                limiter.setRate(bytesRateToOpsRate(settings['bytes_rate'], record_size))
+            elif 'rate' in settings:
+                limiter.setRate(settings['rate'])
+            if 'mix' in settings:
+                operations = OperationMix.parse(settings['mix'], random)
+            elif 'insert_percentage' in settings:
+                operations = OperationMix.fromInsertPercentage(int(settings['insert_percentage']), random)
+            report('Workload on %s set to %.2f ops/s, %s.' % (target_db, limiter.rate, operations))
+
+        if not limiter.acquire():
+            continue  # Paused or slow rate, look at the control file again.
+
+        op = operations.next()
+        if start_record <= 0 or op == 'insert':
+            op = 'insert'
+            record_num = start_record
+            if prepared:
+                query = ts.getInsertStatement(record_num, record_size)
+            else:
                 query = ts.getInsertQuerywithRandomData(record_num, record_size)
-                stat_str += 'I(%d) ' % record_num
+            start_record += 1
 
+        else:
+            record_num = selector.next(start_record)
+            if op == 'read':
+                if prepared:
+                    query = ts.getReadStatement(record_num)
+                else:
+                    query = ts.getReadQuery(record_num)
+            elif op == 'scan':
+                if prepared:
+                    query = ts.getScanStatement(record_num, int(scan_length))
+                else:
+                    query = ts.getScanQuery(record_num, int(scan_length))
+            elif op == 'update':
+                if prepared:
+                    query = ts.getUpdateStatement(record_num)
+                elif not ts.counter_table:
+                    query = ts.getUpdateQuery(record_num)
+                else:
+                    query = ts.getInsertQuerywithRandomData(record_num, 0)
             else:
-                record_num = random.randrange(0, start_record)
-                if random.randrange(100) <= 70:  # 70% update
-                    if not ts.counter_table:
-                        query = ts.getUpdateQuery(record_num)
-                    else:
-                        query = ts.getInsertQuerywithRandomData(record_num, 0)
-
-                    stat_str += 'U(%d) ' % record_num
-                else:                           # 30% deletion
+                if prepared:
+                    query = ts.getDeleteStatement(record_num)
+                else:
                     query = ts.getDeleteQuery(record_num)
-                    stat_str += 'D(%d) ' % record_num
-            if not suppress_output:
-                report(stat_str)
-            batch.add(query)
-            start_record += 1
 
-        #print stat_str
-        cluster.session.execute(batch)
-        nr_batch += 1
-        if nr_batch == batch_count:
-            if batch_count >= 0:
+        writer.submit(query, op=op)
+        ops += 1
+
+    writer.join()
+    if metrics:
+        metrics.close()
+    if writer.failed:
+        report('%d of %d operations on %s failed after retries, last error: %s' % (writer.failed, ops, target_db, writer.last_error), 'error')
+
+
+def do_read(cluster, target_db, start_record, record_count, max_ops=-1, duration=None, rate=None, mix='read=100', distribution='uniform',
+            scan_length=100, concurrency=64, control_file=None, metrics_file=None, metrics_interval=10, suppress_output=False):
+    """
+    Read-only workload over records [start_record, start_record + record_count), which must have been populated: prepared
+    point reads and range scans, async, paced by an optional rate, with latency histograms per operation.
+    :param max_ops: Stop after this many operations, no limit if negative.
+    :param duration: Stop after this many seconds.
+    :param rate: Target operations per second, as fast as concurrency allows if not given.
+    :param mix: Weights of read (point) and scan (range) operations, e.g. 'read=90,scan=10'.
+    :param distribution: Key selector: uniform, sequential, zipfian, latest or hotspot.
+    :param control_file: JSON file polled for rate, mix or stop while running, see WorkloadControl.
+    """
+    start_record = int(start_record)
+    record_count = int(record_count)
+    max_ops = int(max_ops)
+    if record_count <= 0:
+        report('Nothing to read: the record range of %s is empty (-n %d).' % (target_db, record_count), 'error')
+        return
+
+    ks_name, cf_name = getKSCFNames(target_db)
+    if ks_name == None or cf_name == None:
+        return
+
+    ts = TestSchema(cluster, ks_name, cf_name)
+    if not ts.getSchema() or not ts.columns:
+        report('Cannot read schema of %s.' % target_db, 'error')
+        return
+    ts.scan_lengths = [int(scan_length)]
+    ts.prepareStatements()
+
+    operations = OperationMix.parse(mix, random)
+    if set(operations.weights) - set(['read', 'scan']):
+        raise Exception('The read workload only runs read and scan operations.')
+    if distribution not in KEY_SELECTORS:
+        raise Exception('Unknown key distribution %s.' % distribution)
+    selector = KEY_SELECTORS[distribution](random)
+
+    limiter = TokenBucket(rate) if rate else None
+    control = WorkloadControl(control_file)
+    metrics = WorkloadMetrics(metrics_file, target_db, metrics_interval, suppress_output)
+    reader = AsyncWriter(cluster.session, concurrency=int(concurrency), metrics=metrics)
+    report('Reading %s, %s, %s keys.' % (target_db, operations, distribution))
+
+    end_time = time.time() + float(duration) if duration else None
+    ops = 0
+    while max_ops < 0 or ops < max_ops:
+        if end_time and time.time() >= end_time:
+            break
+
+        settings = control.poll()
+        if settings:
+            if settings.get('stop'):
                 break
-        time.sleep(delay)
+            if 'rate' in settings:
+                if limiter is None:
+                    limiter = TokenBucket(settings['rate'])
+                else:
+                    limiter.setRate(settings['rate'])
+            if 'mix' in settings:
+                operations = OperationMix.parse(settings['mix'], random)
+
+        if limiter and not limiter.acquire():
+            continue
+
+        op = operations.next()
+        record_num = start_record + selector.next(record_count)
+        if op == 'scan':
+            query = ts.getScanStatement(record_num, int(scan_length))
+        else:
+            query = ts.getReadStatement(record_num)
+
+        reader.submit(query, op=op)
+        ops += 1
+
+    reader.join()
+    metrics.close()
+    if reader.failed:
+        report('%d of %d reads of %s failed after retries, last error: %s' % (reader.failed, ops, target_db, reader.last_error), 'error')
+
+
+def normalizeValue(value):
+    # The driver hands collections back as its own SortedSet / OrderedMap types and UDTs as named tuples.
+    if hasattr(value, 'items'):
+        return dict((normalizeValue(k), normalizeValue(v)) for k, v in value.items())
+    if isinstance(value, tuple):
+        return tuple(normalizeValue(v) for v in value)
+    if isinstance(value, list):
+        return [normalizeValue(v) for v in value]
+    if isinstance(value, (set, frozenset)) or type(value).__name__ == 'SortedSet':
+        return set(normalizeValue(v) for v in value)
+    return value
+
+
+def do_verify(cluster, target_db, record_size, start_record, record_count, seed, version=0, uuid4=None, concurrency=64, suppress_output=False,
+              metrics_file=None, metrics_interval=10):
+    """
+    Reads rows [start_record, start_record + record_count) back and checks them against the values a seeded do_insert
+    with the same record_size, seed, version and uuid4 wrote. Nothing but the parameters needs to be kept.
+    :return: (checked, missing, mismatched) row counts, or None if the table cannot be verified.
+    """
+    record_size = int(record_size)
+    start_record = int(start_record)
+    record_count = int(record_count)
+    end_record = start_record + record_count
+
+    ks_name, cf_name = getKSCFNames(target_db)
+    if ks_name == None or cf_name == None:
+        return None
+
+    ts = TestSchema(cluster, ks_name, cf_name)
+    if not ts.getSchema():
+        report('Cannot read schema of %s.' % target_db, 'error')
+        return None
+    if ts.counter_table:
+        report('Counter tables hold accumulated increments, %s cannot be verified by regeneration.' % target_db, 'error')
+        return None
+
+    generator = RowGenerator(ts, record_size, seed, uuid4, version)
+    key_positions = [n for n, (column_name, data_type, column_type) in enumerate(ts.columns) if column_type != 'regular']
+    select = cluster.session.prepare('SELECT %s FROM %s.%s WHERE %s' % (
+        ', '.join(column_name for column_name, _, _ in ts.columns), ks_name, cf_name,
+        ' AND '.join('%s = ?' % ts.columns[n][0] for n in key_positions)))
+
+    lock = threading.Lock()
+    stats = {'checked': 0, 'missing': 0, 'mismatched': 0}
+    samples = []
+
+    def on_success(context, rows):
+        rownum, expected = context
+        rows = list(rows)
+        with lock:
+            stats['checked'] += 1
+            if not rows:
+                stats['missing'] += 1
+                if len(samples) < 10:
+                    samples.append('row %d missing' % rownum)
+                return
+            columns = [ts.columns[n][0] for n, (e, a) in enumerate(zip(expected, rows[0])) if normalizeValue(e) != normalizeValue(a)]
+            if columns:
+                stats['mismatched'] += 1
+                if len(samples) < 10:
+                    samples.append('row %d differs in %s' % (rownum, ', '.join(columns)))
+
+    metrics = WorkloadMetrics(metrics_file, target_db, metrics_interval, suppress_output) if metrics_file else None
+    reader = AsyncWriter(cluster.session, concurrency=int(concurrency), on_success=on_success, metrics=metrics)
+    for rownum in xrange(start_record, end_record):
+        expected = generator.generateRow(rownum)
+        reader.submit(select.bind([expected[n] for n in key_positions]), (rownum, expected), op='read')
+
+        submitted = rownum - start_record + 1
+        if not suppress_output and (submitted % 10000 == 0 or rownum == end_record - 1):
+            report('\rVerifying %s %8d / %8d (%3d %%)' % (target_db, submitted, record_count, submitted * 100 / record_count))
+    reader.join()
+    if metrics:
+        metrics.close()
+
+    for sample in samples:
+        report(sample, 'error')
+    if reader.failed:
+        report('%d reads of %s failed after retries, last error: %s' % (reader.failed, target_db, reader.last_error), 'error')
+
+    report('Verified %s: %d rows checked, %d missing, %d mismatched, %d unreadable.' % (
+        target_db, stats['checked'], stats['missing'], stats['mismatched'], reader.failed))
+    return stats['checked'], stats['missing'], stats['mismatched'] + reader.failed
+
+
+def canonicalRepr(value):
+    # repr() with sets and maps sorted, so equal rows always hash the same.
+    value = normalizeValue(value)
+    if isinstance(value, dict):
+        return '{%s}' % ', '.join(sorted('%s: %s' % (canonicalRepr(k), canonicalRepr(v)) for k, v in value.items()))
+    if isinstance(value, set):
+        return '{%s}' % ', '.join(sorted(canonicalRepr(v) for v in value))
+    if isinstance(value, (list, tuple)):
+        return '[%s]' % ', '.join(canonicalRepr(v) for v in value)
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    return repr(value)
+
+
+class TableComparer():
+    """
+    Diffs two tables with the same columns by splitting the token ring into ranges and comparing a digest per range.
+    A range digest is the row count plus the sum of the rows' md5s, so it does not depend on row order and needs no
+    memory beyond the current page. Only ranges whose digests differ are split further and finally compared row by row.
+    """
+    TOKEN_RANGES = {
+        'Murmur3Partitioner': (-2 ** 63, 2 ** 63 - 1),
+        'RandomPartitioner': (-1, 2 ** 127),
+    }
+
+    def __init__(self, cluster, first, second, ranges=256, concurrency=16, page_size=1000, row_limit=100000, max_samples=20):
+        """
+        :param ranges: Number of token ranges the ring is split into.
+        :param concurrency: Number of ranges scanned at the same time.
+        :param row_limit: A mismatched range holding more rows than this is split again rather than diffed row by row.
+        """
+        self.cluster = cluster
+        self.first = first
+        self.second = second
+        self.ranges = int(ranges)
+        self.concurrency = int(concurrency)
+        self.page_size = int(page_size)
+        self.row_limit = int(row_limit)
+        self.max_samples = max_samples
+
+        self.lock = threading.Lock()
+        self.samples = []
+        self.only_in_first = 0
+        self.only_in_second = 0
+        self.differing = 0
+
+    def getTableMetadata(self, target_db):
+        ks_name, cf_name = getKSCFNames(target_db)
+        metadata = self.cluster.session.cluster.metadata
+        if ks_name not in metadata.keyspaces or cf_name not in metadata.keyspaces[ks_name].tables:
+            raise Exception('Table %s does not exist.' % target_db)
+        return metadata.keyspaces[ks_name].tables[cf_name]
+
+    def prepare(self):
+        first = self.getTableMetadata(self.first)
+        second = self.getTableMetadata(self.second)
+
+        self.columns = sorted(first.columns.keys())
+        if self.columns != sorted(second.columns.keys()):
+            raise Exception('%s and %s do not have the same columns.' % (self.first, self.second))
+        self.partition_key = [c.name for c in first.partition_key]
+        if self.partition_key != [c.name for c in second.partition_key]:
+            raise Exception('%s and %s do not have the same partition key.' % (self.first, self.second))
+        self.key_positions = [self.columns.index(c.name) for c in first.primary_key]
+
+        partitioner = self.cluster.session.cluster.metadata.partitioner.split('.')[-1]
+        if partitioner not in self.TOKEN_RANGES:
+            raise Exception('Cannot split the token ring of %s.' % partitioner)
+        self.min_token, self.max_token = self.TOKEN_RANGES[partitioner]
+
+        self.statements = {}
+        for target_db in (self.first, self.second):
+            query = 'SELECT %s FROM %s WHERE token(%s) > ? AND token(%s) <= ?' % (
+                ', '.join(self.columns), target_db, ', '.join(self.partition_key), ', '.join(self.partition_key))
+            self.statements[target_db] = self.cluster.session.prepare(query)
+
+    def splitRange(self, start, end, count):
+        # Tokens do not fit a C long, so no range() here.
+        count = max(1, min(count, end - start))
+        bounds = [start + (end - start) * n / count for n in xrange(count)] + [end]
+        return zip(bounds[:-1], bounds[1:])
+
+    def scanRange(self, target_db, start, end):
+        statement = self.statements[target_db].bind([start, end])
+        statement.fetch_size = self.page_size
+        for row in self.cluster.session.execute(statement):  # Later pages are fetched as the iteration reaches them.
+            yield row
+
+    def getRangeDigest(self, target_db, start, end):
+        count = 0
+        total = 0
+        for row in self.scanRange(target_db, start, end):
+            count += 1
+            total += int(hashlib.md5(canonicalRepr(list(row))).hexdigest(), 16)
+        return count, total % (1 << 128)
+
+    def diffRows(self, start, end):
+        rows = {}
+        for row in self.scanRange(self.first, start, end):
+            values = list(row)
+            rows[canonicalRepr([values[n] for n in self.key_positions])] = canonicalRepr(values)
+
+        only_in_second = 0
+        differing = 0
+        samples = []
+        for row in self.scanRange(self.second, start, end):
+            values = list(row)
+            key = canonicalRepr([values[n] for n in self.key_positions])
+            expected = rows.pop(key, None)
+            if expected is None:
+                only_in_second += 1
+                if len(samples) < self.max_samples:
+                    samples.append('only in %s: %s' % (self.second, key))
+            elif expected != canonicalRepr(values):
+                differing += 1
+                if len(samples) < self.max_samples:
+                    samples.append('differs: %s' % key)
+        samples.extend('only in %s: %s' % (self.first, key) for key in itertools.islice(rows, self.max_samples))
+
+        with self.lock:
+            self.only_in_first += len(rows)
+            self.only_in_second += only_in_second
+            self.differing += differing
+            self.samples.extend(samples[:self.max_samples - len(self.samples)])
+
+    def compareRange(self, token_range):
+        """
+        :return: Number of rows scanned in the first table.
+        """
+        start, end = token_range
+        first_digest = self.getRangeDigest(self.first, start, end)
+        second_digest = self.getRangeDigest(self.second, start, end)
+        if first_digest == second_digest:
+            return first_digest[0]
+
+        if max(first_digest[0], second_digest[0]) > self.row_limit and end - start > 16:
+            return sum(self.compareRange(r) for r in self.splitRange(start, end, 16))
+
+        self.diffRows(start, end)
+        return first_digest[0]
+
+    def run(self, suppress_output=False):
+        """
+        :return: True if the tables hold the same rows.
+        """
+        self.prepare()
+        token_ranges = self.splitRange(self.min_token, self.max_token, self.ranges)
+
+        pool = multiprocessing.pool.ThreadPool(self.concurrency)
+        try:
+            scanned = 0
+            for n, rows in enumerate(pool.imap_unordered(self.compareRange, token_ranges)):
+                scanned += rows
+                if not suppress_output and ((n + 1) % 16 == 0 or n + 1 == len(token_ranges)):
+                    report('\rComparing %s and %s, %4d / %4d ranges, %d rows' % (self.first, self.second, n + 1, len(token_ranges), scanned))
+        finally:
+            pool.close()
+            pool.join()
+
+        for sample in self.samples:
+            report(sample, 'error')
+        report('Compared %s and %s: %d rows only in %s, %d only in %s, %d differing.' % (
+            self.first, self.second, self.only_in_first, self.first, self.only_in_second, self.second, self.differing))
+        return not (self.only_in_first or self.only_in_second or self.differing)
+
+
+def do_compare(cluster, first, second, ranges=256, concurrency=16, page_size=1000, suppress_output=False):
+    return TableComparer(cluster, first, second, ranges, concurrency, page_size).run(suppress_output)
 
 
 def get_udt_list(schema, ks_name, cf_name):
@@ -818,26 +2485,54 @@ def main():
     if not os.path.exists(args.schema_file):
         sys.exit(-1)
 
-    if args.db_user:
-        cluster = CassandraTestingCluster(args.ip_list, db_user=args.db_user, db_pass=args.db_pass)
-    else:
-        cluster = CassandraTestingCluster(args.ip_list)
+    cluster = CassandraTestingCluster(args.ip_list, db_user=args.db_user, db_pass=args.db_pass, local_dc=args.local_dc,
+                                      protocol_version=args.protocol_version, core_connections=args.core_connections,
+                                      max_connections=args.max_connections,
+                                      max_requests_per_connection=args.max_requests_per_connection)
 
     if not cluster.connect():
         report('Cannot connect to cassandra cluster.', 'error')
         sys.exit(-1)
 
     try:
-        if args.command == 'insert':
-            do_insert(cluster, args.target_db, args.schema_file, args.record_size, args.start_record, args.record_count, args.uuid4, replication_factor=args.replication)
+        if args.command == 'insert' and args.workers > 1:
+            if not do_insert_parallel(cluster, args.target_db, args.schema_file, args.record_size, args.start_record, args.record_count, args.workers,
+                                      replication_factor=args.replication, uuid4=args.uuid4, prepared=args.prepared,
+                                      concurrency=args.concurrency, batch_size=args.batch_size, seed=args.seed, version=args.version,
+                                      metrics_file=args.metrics_file, metrics_interval=args.metrics_interval):
+                cluster.disconnect()
+                sys.exit(1)
+        elif args.command == 'insert':
+            do_insert(cluster, args.target_db, args.schema_file, args.record_size, args.start_record, args.record_count, args.uuid4, replication_factor=args.replication, prepared=args.prepared,
+                      concurrency=args.concurrency, batch_size=args.batch_size, seed=args.seed, version=args.version,
+                      metrics_file=args.metrics_file, metrics_interval=args.metrics_interval)
+        elif args.command == 'read':
+            do_read(cluster, args.target_db, args.start_record, args.record_count, args.max_ops, duration=args.duration, rate=args.rate,
+                    mix=args.mix, distribution=args.distribution, scan_length=args.scan_length, concurrency=args.concurrency,
+                    control_file=args.control_file, metrics_file=args.metrics_file, metrics_interval=args.metrics_interval)
+        elif args.command == 'verify':
+            result = do_verify(cluster, args.target_db, args.record_size, args.start_record, args.record_count, args.seed,
+                               version=args.version, uuid4=args.uuid4, concurrency=args.concurrency,
+                               metrics_file=args.metrics_file, metrics_interval=args.metrics_interval)
+            if result is None or result[1] or result[2]:
+                cluster.disconnect()
+                sys.exit(1)
+        elif args.command == 'compare':
+            if not do_compare(cluster, args.first, args.second, args.ranges, args.concurrency, args.page_size):
+                cluster.disconnect()
+                sys.exit(1)
         elif args.command == 'update':
-            do_update(cluster, args.target_db, args.schema_file, args.record_size, args.start_record, args.batch_size, args.insert_percentage, args.delay, args.batch_count, replication_factor=args.replication)
+            do_update(cluster, args.target_db, args.schema_file, args.record_size, args.start_record, args.batch_size, args.insert_percentage, args.delay, args.batch_count, replication_factor=args.replication, prepared=args.prepared,
+                      rate=args.rate, bytes_rate=args.bytes_rate, control_file=args.control_file, concurrency=args.concurrency,
+                      metrics_file=args.metrics_file, metrics_interval=args.metrics_interval, mix=args.mix, distribution=args.distribution,
+                      scan_length=args.scan_length)
         else:
             report('Unrecognized command.\n')
 
     except Exception as e:
-        report('%s\n' % e)
-        sys.exit()
+        report('%s\n' % e, 'error')
+        cluster.disconnect()
+        sys.exit(1)
 
     cluster.disconnect()
 
@@ -23,7 +23,9 @@ import collections
 
 
 import common
-from common.common import report, rpc, add_test_note
+from common.common import report, rpc, add_test_note, set_test_status, TimeoutException
+from common.fault_journal import journal
+from db_utils.cassandra_utils.chaos import ChaosScheduler
 
 
 def pick_x_different_num(x, min_, max_):
@@ -39,6 +41,66 @@ def pick_x_different_num(x, min_, max_):
 class CassandraFailures(object):
     def __init__(self, cassandra):
         self.cassandra = cassandra
+        self.schedules = []
+
+    def schedule(self, events, seed=None, log_path=None):
+        """
+        Runs a timeline of faults in the background, concurrently with the workload and with each other. See chaos.py
+        for the event format.
+        :param seed: Seed for jitter and random targets, to replay a schedule.
+        :param log_path: File to append the injection and recovery records to, one JSON object per line.
+        :return: The started ChaosScheduler; join() waits for it, records has what happened when.
+        """
+        scheduler = ChaosScheduler(self.cassandra, events, seed=seed, log_path=log_path)
+        self.schedules.append(scheduler)
+        return scheduler.start()
+
+    def _journal(self, fault, ip, recover_commands, wait_for_ssh=False):
+        """
+        Records a fault in the fault journal before it is applied, see common.fault_journal.
+        :return: Journal entry id, to resolve once the fault is recovered.
+        """
+        return journal.record(fault, ip, recover_commands, self.cassandra.username, self.cassandra.password, self.cassandra.key,
+                              wait_for_ssh=wait_for_ssh)
+
+    def _rollback(self, currently_down, e):
+        """
+        Restores the nodes of an interrupted scenario and marks the test aborted.
+        :param currently_down: ip -> journal entry of the faults not recovered yet.
+        """
+        report('Exit detected ... restoring db state', 'critical')
+        journal.recover(entry_ids=set(currently_down.values()))
+        self.cassandra.cluster_state.invalidate()
+        if not self.cassandra.wait_until_all_up(timeout=60*2):
+            report('Cluster did not come back up after the rollback.', 'critical')
+        self.cassandra.status()  # Logs will capture output.
+        set_test_status('Aborted')
+        add_test_note(e)
+
+    def _check(self, converged, what):
+        """
+        Stops a scenario whose cluster did not reach the state it waited for, rather than carrying on as if it had.
+        :param converged: Result of a wait_until_* call.
+        """
+        if not converged:
+            raise TimeoutException('Timed out waiting for %s.' % what)
+
+    def _abort(self, currently_down, e):
+        """
+        Fails the test when a scenario timed out. Its faults stay pending in the journal, they are recovered when the
+        test exits.
+        """
+        report('%s Faults left pending on %s.' % (e, ', '.join('{%s}' % ip for ip in currently_down) or 'no nodes'), 'critical')
+        self.cassandra.status()  # Logs will capture output.
+        set_test_status('Failed')
+        add_test_note(e)
+
+    def stop_schedules(self):
+        """
+        Cancels pending faults of all schedules and recovers the active ones.
+        """
+        while self.schedules:
+            self.schedules.pop().stop()
 
     def single_random_db_failure(self, wait_time_min=0, run_time_min=10, time_length_of_failure=5, max_failure_repeats=1, randomness_time_injection=90):
         """
@@ -57,33 +119,31 @@ class CassandraFailures(object):
         pick = pick_x_different_num(1, 0, len(self.cassandra.ips) - 1)[0]
         for _ in xrange(max_failure_repeats):
             time.sleep(random.randint(0, randomness_time_injection))  # Randomize time that db fails.
-            currently_down = collections.deque()
+            currently_down = collections.OrderedDict()  # ip -> journal entry
 
             try:
                 # Bring down the db node for some time.
-                currently_down.append(pick)
-                add_test_note('%s' % (self.cassandra.ips[pick]))
-                self.cassandra.db_stop(self.cassandra.ips[pick])
+                ip = self.cassandra.ips[pick]
+                currently_down[ip] = self._journal('db_stop', ip, ['sudo service cassandra start'])
+                add_test_note('%s' % ip)
+                self.cassandra.db_stop(ip)
+                self._check(self.cassandra.wait_until_node_down(ip), '{%s} to go down' % ip)
                 self.cassandra.status()  # Let's see the db state.
                 time.sleep(60 * random.randint(time_length_of_failure * 3/4, time_length_of_failure))
 
                 # Bring db node back up.
-                self.cassandra.db_start(self.cassandra.ips[pick])
-                currently_down.popleft()
-                time.sleep(20)
+                self.cassandra.db_start(ip)
+                self._check(self.cassandra.wait_until_all_up(), 'the cluster to come back up')
+                journal.resolve(currently_down.pop(ip))
                 self.cassandra.status()
 
             except(KeyboardInterrupt, SystemExit) as e:
                 # Do some clean up (restore db nodes) and some reporting, then re-raise exception.
-                report('Exit detected ... restoring db state', 'critical')
-                for i in currently_down:
-                    self.cassandra.db_start(self.cassandra.ips[pick])
-                time.sleep(20)
-                self.cassandra.status()  # Logs will capture output.
-                global global_vars
-                global_vars['test_status'] = 'Aborted'
-                add_test_note(e)
-                raise e
+                self._rollback(currently_down, e)
+                raise
+            except TimeoutException as e:
+                self._abort(currently_down, e)
+                raise
 
             # Exit failure loop if we've reached max time.
             if (time.time() + wait_time_min * 60 - start_time >= run_time_min * 60):
@@ -108,39 +168,37 @@ class CassandraFailures(object):
         pick = pick_x_different_num(1, 0, len(self.cassandra.ips) - 1)[0]
         for _ in xrange(max_failure_repeats):
             time.sleep(random.randint(0, randomness_time_injection))  # Randomize time that db fails.
-            currently_down = collections.deque()
+            currently_down = collections.OrderedDict()  # ip -> journal entry
 
             try:
                 # Bring down the db node for some time.
-                currently_down.append(pick)
+                ip = self.cassandra.ips[pick]
+                currently_down[ip] = self._journal('ifdown', ip, ['sudo ifup eth0'], wait_for_ssh=True)
 
                 try:
                     note = ''
                     add_test_note(note)
-                    rpc(self.cassandra.ips[pick], '(nohup sudo ifdown eth0; sleep %s ; sudo ifup eth0 ; ) > /tmp/datos_failure.log &' % (time_length_of_failure * 60), self.cassandra.username, self.cassandra.password, self.cassandra.key)
+                    rpc(ip, '(nohup sudo ifdown eth0; sleep %s ; sudo ifup eth0 ; ) > /tmp/datos_failure.log &' % (time_length_of_failure * 60), self.cassandra.username, self.cassandra.password, self.cassandra.key)
                 except:
-                    report('Could not connect to node {%s}.' % db.ips[pick], 'warning')
+                    report('Could not connect to node {%s}.' % ip, 'warning')
 
+                self._check(self.cassandra.wait_until_node_down(ip), '{%s} to go down' % ip)
                 self.cassandra.status()  # Let's see the db state.
-                time.sleep(60 * time_length_of_failure + 60)
+                time.sleep(60 * time_length_of_failure)
 
                 # Bring db node back up.
-                self.cassandra.node_restore(self.cassandra.ips[pick])  # Currently we don't have good way to restore so this does nothing.
-                currently_down.popleft()
-                time.sleep(20)
+                self.cassandra.node_restore(ip)  # Currently we don't have good way to restore so this does nothing.
+                self._check(self.cassandra.wait_until_all_up(), 'the cluster to come back up')
+                journal.resolve(currently_down.pop(ip))
                 self.cassandra.status()
 
             except(KeyboardInterrupt, SystemExit) as e:
                 # Do some clean up (restore db nodes) and some reporting, then re-raise exception.
-                report('Exit detected ... restoring db state', 'critical')
-                for i in currently_down:
-                    self.cassandra.node_restore(db.ips[pick])
-                time.sleep(20)
-                self.cassandra.status()  # Logs will capture output.
-                global global_vars
-                global_vars['test_status'] = 'Aborted'
-                add_test_note(e)
-                raise e
+                self._rollback(currently_down, e)
+                raise
+            except TimeoutException as e:
+                self._abort(currently_down, e)
+                raise
 
             # Exit failure loop if we've reached max time.
             if (time.time() + wait_time_min * 60 - start_time >= run_time_min * 60):
@@ -163,46 +221,45 @@ class CassandraFailures(object):
         for _ in xrange(max_failure_repeats):
             picks = pick_x_different_num(max_num_failed, 0, len(self.cassandra.ips) - 1)
 
-            currently_down = collections.deque()
+            currently_down = collections.OrderedDict()  # ip -> journal entry
 
             try:
                 # First bring down those db's with some randomness thrown in.
-                for i in xrange(len(picks)):
-                    currently_down.append(i)
-                    self.cassandra.db_stop(self.cassandra.ips[picks[i]])
+                for pick in picks:
+                    ip = self.cassandra.ips[pick]
+                    currently_down[ip] = self._journal('db_stop', ip, ['sudo service cassandra start'])
+                    self.cassandra.db_stop(ip)
                     time.sleep(random.randint(0, 60))  # TODO: (Aaron) Can make this more sophisticated.
 
-                # Let them be down for a random period.
+                # Let them be down for a random period, counted from when the cluster sees them down.
+                for pick in picks:
+                    ip = self.cassandra.ips[pick]
+                    self._check(self.cassandra.wait_until_node_down(ip), '{%s} to go down' % ip)
                 time.sleep(random.randint(0, 60 * 2))  # TODO: (Aaron) Can make this more sophisticated.
 
                 # Let's stay advised with what's down.
                 self.cassandra.status()  # Logs will capture output.
 
                 # Now bring back up, with some randomness thrown in.
-                for i in xrange(len(picks)):
-                    self.cassandra.db_start(self.cassandra.ips[picks[i]])
-                    currently_down.popleft()
+                for pick in picks:
+                    ip = self.cassandra.ips[pick]
+                    self.cassandra.db_start(ip)
                     time.sleep(random.randint(0, 30))  # TODO: (Aaron) Can make this more sophisticated.
 
-                time.sleep(20)  # Need to let Nodes rejoin cluster properly.
+                # Need to let Nodes rejoin cluster properly.
+                self._check(self.cassandra.wait_until_all_up(), 'the cluster to come back up')
+                while currently_down:
+                    journal.resolve(currently_down.popitem()[1])
                 # Let's stay advised with what's up again.
                 self.cassandra.status()  # Logs will capture output.
 
-                # Sleep random time before next cycle.
-                time.sleep(0)
-
             except(KeyboardInterrupt, SystemExit) as e:
                 # Do some clean up (restore db nodes) and some reporting, then re-raise exception.
-                report('Exit detected ... restoring db state', 'critical')
-                for i in currently_down:
-                    self.cassandra.db_start(self.cassandra.ips[picks[i]])
-                time.sleep(20)
-                self.cassandra.status()  # Logs will capture output.
-                global global_vars
-                global_vars['test_status'] = 'Aborted'
-                add_test_note(e)
-
-                raise e
+                self._rollback(currently_down, e)
+                raise
+            except TimeoutException as e:
+                self._abort(currently_down, e)
+                raise
 
             # Exit failure loop if we've reached max time.
             if (time.time() + wait_time_min * 60 - start_time >= run_time_min * 60):
@@ -220,42 +277,44 @@ class CassandraFailures(object):
         time.sleep(60 * wait_time_min)
         for _ in xrange(max_failure_repeats):
             picks = pick_x_different_num(max_num_failed, 0, len(self.cassandra.ips) - 1)
-            currently_down = collections.deque()
+            currently_down = collections.OrderedDict()  # ip -> journal entry
 
             try:
                 # First bring down those db's with some randomness thrown in.
-                for i in xrange(len(picks)):
-                    currently_down.append(i)
-                    self.cassandra.node_reboot(self.cassandra.ips[picks[i]])  # TODO: (Aaron) Let's do this with a ifdown etc like above.
+                for pick in picks:
+                    ip = self.cassandra.ips[pick]
+                    currently_down[ip] = self._journal('reboot', ip, ['sudo service cassandra start'], wait_for_ssh=True)
+                    self.cassandra.node_reboot(ip)  # TODO: (Aaron) Let's do this with a ifdown etc like above.
                     time.sleep(random.randint(0, 30))  # TODO: (Aaron) Can make this more sophisticated.
 
                 # Let's stay advised with what's down.
                 report(self.cassandra.status())
 
                 # This is for future node failure implementation when we have a way to reboot like wake on lan.
-                # Let them be down for a random period ... but long enough to reboot.
-                time.sleep(random.randint(60, 60*2))  # TODO: (Aaron) Can make this more sophisticated.
+                # Wait until the reboots took the nodes down instead of guessing how long that takes.
+                for pick in picks:
+                    ip = self.cassandra.ips[pick]
+                    self._check(self.cassandra.wait_until_node_down(ip, timeout=60*2), '{%s} to go down' % ip)
 
                 # Now bring back up, with some randomness thrown in.
-                for i in xrange(len(picks)):
-                    self.cassandra.node_restore(self.cassandra.ips[picks[i]])
-                    currently_down.popleft()
+                for pick in picks:
+                    self.cassandra.node_restore(self.cassandra.ips[pick])
                     time.sleep(random.randint(0, 30))  # TODO: (Aaron) Can make this more sophisticated.
 
-                time.sleep(60)  # Need to let Nodes rejoin cluster properly.
+                # Need to let Nodes reboot and rejoin cluster properly.
+                self._check(self.cassandra.wait_until_all_up(timeout=60*15), 'the rebooted nodes to come back up')
+                while currently_down:
+                    journal.resolve(currently_down.popitem()[1])
                 # Let's stay advised with what's up again.
                 report(self.cassandra.status())
 
             except(KeyboardInterrupt, SystemExit) as e:
                 # Do some clean up (restore db nodes) and some reporting, then re-raise exception.
-                report('Exit detected ... restoring db state', 'critical')
-                for i in currently_down:
-                    self.cassandra.db_start(self.cassandra.ips[picks[i]])
-                self.cassandra.status()  # Logs will capture output.
-                global global_vars
-                global_vars['test_status'] = 'Aborted'
-                add_test_note(e)
-                raise e
+                self._rollback(currently_down, e)
+                raise
+            except TimeoutException as e:
+                self._abort(currently_down, e)
+                raise
 
             # Exit failure loop if we've reached max time.
             if (time.time() + wait_time_min * 60 - start_time >= 60 * run_time_min):
@@ -286,7 +345,11 @@ class CassandraFailures(object):
         add_test_note(note)
 
         cmd = '(nohup sudo ifdown eth0; sleep %s ; sudo ifup eth0 ; sudo reboot now) > /tmp/datos_failure.log &' % (down_time)  # disable eth0 then reboot at end to simulate failure.
-        rpc(ip, cmd, self.cassandra.username, self.cassandra.password, self.cassandra.key)
+        # The node heals itself once the command is running, so the journal only covers a launch that didn't complete.
+        entry_id = self._journal('ifdown', ip, ['sudo ifup eth0'], wait_for_ssh=True)
+        _, _, exit_status = rpc(ip, cmd, self.cassandra.username, self.cassandra.password, self.cassandra.key, return_exit_status=True)
+        if exit_status == 0:
+            journal.resolve(entry_id)
 
         ip2 = self.cassandra.ips[(pick + 1) % len(self.cassandra.ips)]
         cmd = 'nodetool removenode %s' % ip
@@ -311,7 +374,11 @@ class CassandraFailures(object):
         note = 'Chose {%s} node to be added after %s seconds.' % (ip, down_time)
         add_test_note(note)
         cmd = '(nohup sudo ifdown eth0; sleep %s ; sudo ifup eth0 ; sudo reboot now) > /tmp/datos_failure.log &' % (down_time)  # disable eth0 then reboot at end to simulate failure.
-        rpc(ip, cmd, self.cassandra.username, self.cassandra.password, self.cassandra.key)
+        # The node heals itself once the command is running, so the journal only covers a launch that didn't complete.
+        entry_id = self._journal('ifdown', ip, ['sudo ifup eth0'], wait_for_ssh=True)
+        _, _, exit_status = rpc(ip, cmd, self.cassandra.username, self.cassandra.password, self.cassandra.key, return_exit_status=True)
+        if exit_status == 0:
+            journal.resolve(entry_id)
 
         ip2 = self.cassandra.ips[(pick + 1) % len(self.cassandra.ips)]
         cmd = 'nodetool removenode %s' % ip
@@ -0,0 +1,338 @@
+"""
+The MIT License (MIT)
+Copyright (c) Datos IO, Inc. 2015.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit
+persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the
+Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+
+
+import re
+import time
+import json
+import threading
+import collections
+
+
+from common.common import report, rpc_many
+from db_utils.cassandra_utils.cluster_state import parse_load
+
+# Parsers for nodetool output. Each returns a flat dict of metric name -> number, names dotted like
+# 'tp.ReadStage.pending' or 'table.ks1.table1.sstable_count', so samples of any shape store and diff the same way.
+
+NUMBER = re.compile(r'^-?\d+(\.\d+)?([eE][-+]?\d+)?')
+
+
+def parse_number(value):
+    """
+    Leading number of a nodetool value ('12', '0.123 ms', '1.5E-4'), or None if there is none (NaN, lists ...).
+    """
+    match = NUMBER.match(value.strip())
+    if not match:
+        return None
+    number = match.group(0)
+    if match.group(1) or match.group(2):
+        return float(number)
+    return int(number)
+
+
+def metric_name(label):
+    """
+    'Local read latency' -> 'local_read_latency'
+    """
+    return re.sub(r'[^a-z0-9]+', '_', label.strip().lower()).strip('_')
+
+
+def parse_tpstats(out):
+    metrics = {}
+    dropped = False
+    for line in out.splitlines():
+        if line.startswith('Message type'):
+            dropped = True
+            continue
+        fields = line.split()
+        if dropped:
+            if len(fields) >= 2 and fields[1].isdigit():
+                metrics['dropped.%s' % fields[0]] = int(fields[1])
+        elif len(fields) >= 6 and all(field.isdigit() for field in fields[1:6]):
+            for name, value in zip(['active', 'pending', 'completed', 'blocked', 'all_time_blocked'], fields[1:6]):
+                metrics['tp.%s.%s' % (fields[0], name)] = int(value)
+    return metrics
+
+
+def parse_compactionstats(out):
+    metrics = {}
+    active = None
+    for line in out.splitlines():
+        line = line.strip()
+        if line.startswith('pending tasks:'):
+            metrics['compaction.pending'] = parse_number(line.split(':', 1)[1])
+        elif 'compaction type' in line:
+            active = 0
+        elif line.startswith('Active compaction remaining time'):
+            break
+        elif active is not None and line:
+            active += 1
+    metrics['compaction.active'] = active or 0
+    return metrics
+
+
+GC_COLUMNS = ['interval_ms', 'max_ms', 'total_ms', 'stdev_ms', 'reclaimed_mb', 'collections', 'direct_memory_bytes']
+
+
+def parse_gcstats(out):
+    """
+    nodetool gcstats reports GC since its previous call, so consecutive samples are per interval.
+    """
+    for line in out.splitlines():
+        fields = line.split()
+        if len(fields) >= len(GC_COLUMNS) and parse_number(fields[0]) is not None:
+            return dict(('gc.%s' % name, parse_number(value)) for name, value in zip(GC_COLUMNS, fields)
+                        if parse_number(value) is not None)
+    return {}
+
+
+def parse_info(out):
+    metrics = {}
+    for line in out.splitlines():
+        if ':' not in line:
+            continue
+        label, value = [part.strip() for part in line.split(':', 1)]
+        if label == 'Heap Memory (MB)' and '/' in value:
+            used, total = value.split('/', 1)
+            metrics['heap.used_mb'] = parse_number(used)
+            metrics['heap.max_mb'] = parse_number(total)
+        elif label == 'Off Heap Memory (MB)':
+            metrics['heap.off_heap_mb'] = parse_number(value)
+        elif label == 'Load':
+            metrics['load_bytes'] = parse_load(value)
+        elif label == 'Uptime (seconds)':
+            metrics['uptime_s'] = parse_number(value)
+    return dict((name, value) for name, value in metrics.items() if value is not None)
+
+
+def parse_cfstats(out, keyspaces=None):
+    """
+    :param keyspaces: Only keep these keyspaces. By default all but the system keyspaces are kept.
+    """
+    metrics = {}
+    keyspace = table = None
+    for line in out.splitlines():
+        if ':' not in line:
+            continue
+        label, value = [part.strip() for part in line.split(':', 1)]
+        if label == 'Keyspace':
+            keyspace, table = value, None
+            continue
+        if label in ('Table', 'Column Family', 'Table (index)'):
+            table = value
+            continue
+        if keyspace is None:
+            continue
+        if keyspaces is not None and keyspace not in keyspaces:
+            continue
+        if keyspaces is None and keyspace.startswith('system'):
+            continue
+
+        number = parse_number(value)
+        if number is None:
+            continue
+        if table is None:
+            metrics['keyspace.%s.%s' % (keyspace, metric_name(label))] = number
+        else:
+            metrics['table.%s.%s.%s' % (keyspace, table, metric_name(label))] = number
+    return metrics
+
+
+PARSERS = collections.OrderedDict([
+    ('tpstats', parse_tpstats),
+    ('compactionstats', parse_compactionstats),
+    ('gcstats', parse_gcstats),
+    ('info', parse_info),
+    ('cfstats', parse_cfstats),
+])
+
+# Every nodetool call starts a JVM on the node, so the slow moving sections are sampled less often. Sections not listed
+# are sampled every interval.
+DEFAULT_INTERVALS = {
+    'info': 30,
+    'cfstats': 60,
+}
+
+SECTION_MARKER = '@@geppetto '
+
+
+def build_command(sections, keyspaces=None):
+    """
+    One shell command running the nodetool sections back to back, so a sample costs one SSH round trip per node.
+    """
+    commands = []
+    for section in sections:
+        nodetool = 'nodetool %s' % section
+        if section == 'cfstats' and keyspaces:
+            nodetool += ' ' + ' '.join(keyspaces)
+        commands.append("echo '%s%s'; %s" % (SECTION_MARKER, section, nodetool))
+    return ' ; '.join(commands)
+
+
+def parse_sections(out, keyspaces=None):
+    """
+    Splits the output of build_command() and parses each section.
+    :return: Flat dict of metrics of all sections.
+    """
+    metrics = {}
+    for chunk in out.split(SECTION_MARKER)[1:]:
+        section, _, text = chunk.partition('\n')
+        section = section.strip()
+        if section == 'cfstats':
+            metrics.update(parse_cfstats(text, keyspaces))
+        elif section in PARSERS:
+            metrics.update(PARSERS[section](text))
+    return metrics
+
+
+class MetricsStore(object):
+    """
+    Append only time series file, one JSON line per node sample: {"t": time, "ip": ip, "m": {metric: value}}.
+    Only metrics that changed since the node's previous sample are written, with a full sample ("full": 1) every
+    full_every samples so a reader can start from any full line. See read_metrics().
+    """
+    def __init__(self, path, full_every=360):
+        self.path = path
+        self.full_every = full_every
+        self._last = {}  # ip -> metrics of the previous sample
+        self._count = collections.Counter()
+        self._lock = threading.Lock()
+
+    def append(self, timestamp, ip, metrics):
+        with self._lock:
+            # Sections run on different intervals, so a sample may hold only some of them. Carry the others forward,
+            # so they neither count as changed nor go missing from full lines.
+            previous = self._last.get(ip)
+            merged = dict(previous or {}, **metrics)
+            record = {'t': round(timestamp, 1), 'ip': ip}
+            if previous is None or self._count[ip] % self.full_every == 0:
+                record['full'] = 1
+                record['m'] = merged
+            else:
+                record['m'] = dict((name, value) for name, value in metrics.items() if previous.get(name) != value)
+            self._last[ip] = merged
+            self._count[ip] += 1
+
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(record, separators=(',', ':'), sort_keys=True) + '\n')
+
+
+def read_metrics(path):
+    """
+    Reads a MetricsStore file back into full samples.
+    :return: Generator of (time, ip, metrics dict).
+    """
+    state = {}
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # Partial last line of a collector that was killed.
+            ip = record['ip']
+            if record.get('full') or ip not in state:
+                state[ip] = dict(record['m'])
+            else:
+                state[ip].update(record['m'])
+            yield record['t'], ip, dict(state[ip])
+
+
+class MetricsCollector(object):
+    """
+    Samples nodetool metrics from all nodes at once on a background thread and appends them to a MetricsStore.
+    """
+    def __init__(self, ips, username, password, key, path, interval=10, intervals=None, keyspaces=None, full_every=360):
+        """
+        :param interval: Seconds between samples.
+        :param intervals: Section name -> seconds, overrides DEFAULT_INTERVALS. Sections run at most once per interval.
+        :param keyspaces: Keyspaces to collect table stats of, default all but system keyspaces.
+        """
+        assert(interval > 0)
+        self.ips = list(ips)
+        self.username = username
+        self.password = password
+        self.key = key
+        self.interval = interval
+        self.intervals = dict(DEFAULT_INTERVALS, **(intervals or {}))
+        self.keyspaces = keyspaces
+        self.store = MetricsStore(path, full_every)
+        self.samples = 0
+        self._last_run = {}  # section -> time last sampled
+        self._stop = threading.Event()
+        self._thread = None
+
+    def due_sections(self, now):
+        return [section for section in PARSERS
+                if now - self._last_run.get(section, 0) >= max(self.intervals.get(section, self.interval), self.interval) - 0.5]
+
+    def sample(self):
+        """
+        Takes one sample of the due sections from every node.
+        :return: Dict of ip -> metrics.
+        """
+        now = time.time()
+        sections = self.due_sections(now)
+        if not sections:
+            return {}
+        for section in sections:
+            self._last_run[section] = now
+
+        results = rpc_many(self.ips, build_command(sections, self.keyspaces), self.username, self.password, self.key,
+                           timeout=max(60, self.interval * 3), deadline=max(60, self.interval * 3), retries=0,
+                           suppress_output=True, suppress_errors=True)
+        samples = {}
+        for ip, result in results.items():
+            metrics = parse_sections(result.out or '', self.keyspaces)
+            metrics['collector.ok'] = 1 if result.exit_status == 0 and metrics else 0
+            metrics['collector.elapsed_s'] = round(result.elapsed or 0, 2)
+            self.store.append(now, ip, metrics)
+            samples[ip] = metrics
+        self.samples += 1
+        return samples
+
+    def _run(self):
+        next_sample = time.time()
+        while not self._stop.is_set():
+            try:
+                self.sample()
+            except Exception as e:
+                report('Metrics collection failed: %s' % e, 'warning')
+
+            # Keep the schedule; a sample that overran skips the ticks it missed instead of bunching up.
+            next_sample += self.interval
+            now = time.time()
+            if next_sample < now:
+                next_sample = now + self.interval - (now - next_sample) % self.interval
+            self._stop.wait(next_sample - now)
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='metrics-collector')
+        self._thread.daemon = True
+        self._thread.start()
+        report('Collecting node metrics every %ss into %s.' % (self.interval, self.store.path))
+
+    def stop(self, timeout=60):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
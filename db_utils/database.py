@@ -17,6 +17,9 @@ OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
 """
 
 
+from common.common import global_vars
+
+
 class DatabaseCluster(object):
     """
     Class prototype for db classes.
@@ -24,6 +27,7 @@ class DatabaseCluster(object):
     def __init__(self):
         self.name = '_name_'
         self.ips = ['',]
+        global_vars['databases'].append(self)  # Geppetto closes it when the test exits.
 
     def query(self, sql):
         assert False, 'Implement database.query'
@@ -52,5 +56,8 @@ class DatabaseCluster(object):
     def install(self, version, as_service=True):
         assert False, 'Override database.install'
 
+    def close(self):
+        pass  # Override to release client connections at test teardown.
+
     def __str__(self):
         return self.name
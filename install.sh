@@ -21,7 +21,6 @@
 # Geppetto bootstrap script for CentOS
 #
 
-sudo yum install -y sshpass
 sudo pip install pymongo==3.2
 sudo pip install boto==2.4
 sudo pip install paramiko
@@ -29,7 +28,6 @@ sudo pip install cassandra-driver
 sudo pip install awscli
 sudo pip install IPy
 sudo pip install wget
-sudo pip install scp
 
 # For future graphing
 # sudo yum install -y python-numpy python-matplotlib
@@ -0,0 +1,82 @@
+"""
+The MIT License (MIT)
+Copyright (c) Datos IO, Inc. 2015.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit
+persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the
+Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+
+
+import sys
+import time
+import argparse
+import traceback
+
+
+from common.common import report
+from common.fault_journal import journal
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Rolls back faults that Geppetto runs injected and never recovered.')
+    parser.add_argument('-c', '--config', help="Configuration file, for the credentials of the nodes.")
+    parser.add_argument('-l', '--list', action='store_true', help="Only list the pending faults.")
+    return parser.parse_args()
+
+
+def load_credentials(config_file_name):
+    """
+    :return: Dict of ip -> (username, password, key) of every source in the configuration file.
+    """
+    config_file = config_file_name[:-3].replace('/', '.')
+    mod = __import__(config_file, fromlist=['CONFIG_DICT'])
+    config_dict = getattr(mod, 'CONFIG_DICT')
+
+    credentials = {}
+    for source in config_dict.get('source_configs', []):
+        for ip in source['ips']:
+            credentials[ip] = (source['username'], source.get('password'), source.get('key'))
+    return credentials
+
+
+def main():
+    args = parse_args()
+
+    pending = journal.pending()
+    if not pending:
+        report('No pending faults in %s.' % journal.path, no_date=True)
+        return
+
+    for entry in pending:
+        report('%s on {%s}, injected %s by pid %s: %s' % (entry['fault'], entry['ip'], time.ctime(entry['time']), entry['pid'],
+                                                           ' ; '.join(entry['recover'])), no_date=True)
+    if args.list:
+        return
+
+    credentials = {}
+    if args.config:
+        try:
+            credentials = load_credentials(args.config)
+        except:
+            report("Unable to import the config file: %s" % args.config, 'critical', no_date=True)
+            report(traceback.format_exc(), 'error', no_date=True)
+            sys.exit(1)
+
+    recovered, failed = journal.recover(credentials=credentials.get)
+    report('Recovered %s faults, %s failed.' % (recovered, failed), 'critical' if failed else 'info')
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+"""
+The MIT License (MIT)
+Copyright (c) Datos IO, Inc. 2015.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit
+persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the
+Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+
+import unittest
+
+
+import unittest
+
+from db_utils.cassandra_utils import cluster_state
+from db_utils.cassandra_utils.cluster_state import ClusterState, NodeStatus, format_load, parse_load, parse_nodetool_status
+
+
+STATUS = """Datacenter: dc1
+===============
+Status=Up/Down
+|/ State=Normal/Leaving/Joining/Moving
+--  Address    Load       Tokens       Owns (effective)  Host ID                               Rack
+UN  10.0.0.1   1.21 GB    256          33.4%             2a8c3bd9-4b6d-4f53-9d6a-4f0a2e1c7d55  rack1
+DN  10.0.0.2   ?          256          33,3%             5c1d8e2a-0b7e-4e0c-8d2f-1a2b3c4d5e6f  rack1
+UJ  10.0.0.3   47.66 KiB  256          ?                 9f0e1d2c-3b4a-4c5d-8e7f-6a5b4c3d2e1f
+Datacenter: dc2
+===============
+Status=Up/Down
+|/ State=Normal/Leaving/Joining/Moving
+--  Address    Load       Owns    Host ID                               Token                 Rack
+UL  10.0.1.1   1,024 bytes  ?     0d9e8f7a-6b5c-4d3e-8f1a-2b3c4d5e6f70  -9223372036854775808  rack2
+"""
+
+
+class ParseTest(unittest.TestCase):
+    def test_parse_load(self):
+        self.assertEqual(parse_load('47.66 KB'), int(47.66 * 1024))
+        self.assertEqual(parse_load('1.5 GiB'), 3 * 1024 ** 3 / 2)
+        self.assertEqual(parse_load('1,024 bytes'), 1024)
+        self.assertEqual(parse_load('512bytes'), 512)
+        self.assertIsNone(parse_load('?'))
+        self.assertIsNone(parse_load('12 parsecs'))
+        self.assertIsNone(parse_load(''))
+
+    def test_format_load(self):
+        self.assertEqual(format_load(None), '?')
+        self.assertEqual(format_load(0), '0 bytes')
+        self.assertEqual(format_load(1023), '1023 bytes')
+        self.assertEqual(format_load(1024), '1.00 KB')
+        self.assertEqual(format_load(1299227607), '1.21 GB')
+        self.assertEqual(format_load(5 * 1024 ** 4), '5.00 TB')
+
+    def test_format_load_round_trips_within_rounding(self):
+        for load in [1, 1000, 123456, 1299227607, 7 * 1024 ** 4 + 12345]:
+            self.assertAlmostEqual(parse_load(format_load(load)) / float(load), 1.0, places=2)
+
+    def test_parse_nodetool_status(self):
+        nodes = parse_nodetool_status(STATUS)
+        self.assertEqual(nodes, [
+            NodeStatus('10.0.0.1', 'dc1', 'up', 'normal', parse_load('1.21 GB'), 256, 33.4, '2a8c3bd9-4b6d-4f53-9d6a-4f0a2e1c7d55', 'rack1'),
+            NodeStatus('10.0.0.2', 'dc1', 'down', 'normal', None, 256, 33.3, '5c1d8e2a-0b7e-4e0c-8d2f-1a2b3c4d5e6f', 'rack1'),
+            NodeStatus('10.0.0.3', 'dc1', 'up', 'joining', parse_load('47.66 KiB'), 256, None, '9f0e1d2c-3b4a-4c5d-8e7f-6a5b4c3d2e1f', None),
+            NodeStatus('10.0.1.1', 'dc2', 'up', 'leaving', 1024, '-9223372036854775808', None, '0d9e8f7a-6b5c-4d3e-8f1a-2b3c4d5e6f70', 'rack2'),
+        ])
+
+    def test_parse_nodetool_status_without_nodes(self):
+        self.assertEqual(parse_nodetool_status(''), [])
+        self.assertEqual(parse_nodetool_status('nodetool: Failed to connect to 127.0.0.1:7199'), [])
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self):
+        return self.now
+
+
+class ClusterStateTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.original_time = cluster_state.time
+        cluster_state.time = self.clock
+        self.outputs = [STATUS]
+        self.fetches = 0
+
+    def tearDown(self):
+        cluster_state.time = self.original_time
+
+    def fetch(self):
+        self.fetches += 1
+        return self.outputs[min(self.fetches, len(self.outputs)) - 1]
+
+    def test_snapshot_is_shared_until_ttl(self):
+        state = ClusterState(self.fetch, ttl=5)
+        self.assertIsNone(state.age())
+        self.assertEqual(len(state.nodes()), 4)
+        self.clock.now = 4.9
+        state.nodes()
+        state.is_up('10.0.0.1')
+        self.assertEqual(self.fetches, 1)
+        self.assertAlmostEqual(state.age(), 4.9)
+
+        self.clock.now = 5.0
+        state.nodes()
+        self.assertEqual(self.fetches, 2)
+
+        state.nodes(max_age=0)
+        self.assertEqual(self.fetches, 3)
+        state.invalidate()
+        state.nodes()
+        self.assertEqual(self.fetches, 4)
+
+    def test_membership_queries(self):
+        state = ClusterState(self.fetch)
+        self.assertTrue(state.is_up('10.0.0.1'))
+        self.assertFalse(state.is_up('10.0.0.2'))
+        self.assertFalse(state.is_up('10.0.0.3'))
+        self.assertFalse(state.is_up('10.9.9.9'))
+        self.assertIsNone(state.node('10.9.9.9'))
+        self.assertFalse(state.all_up())
+        self.assertTrue(state.all_up(['10.0.0.1']))
+        self.assertFalse(state.all_up(['10.0.0.1', '10.0.0.2']))
+        self.assertEqual(state.down(), ['10.0.0.2', '10.0.0.3', '10.0.1.1'])
+        self.assertEqual(state.summary(), 'dc1: 10.0.0.1 UN 1.21 GB, 10.0.0.2 DN ?, 10.0.0.3 UJ 47.66 KB\n'
+                                          'dc2: 10.0.1.1 UL 1.00 KB')
+
+    def test_no_node_answered(self):
+        self.outputs = [None]
+        state = ClusterState(self.fetch)
+        self.assertEqual(state.nodes(), [])
+        self.assertFalse(state.all_up())
+        self.assertFalse(state.all_up([]))
+        self.assertEqual(state.down(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,169 @@
+"""
+The MIT License (MIT)
+Copyright (c) Datos IO, Inc. 2015.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit
+persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the
+Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+
+import unittest
+
+
+import os
+import time
+import unittest
+
+try:
+    import common.execution_loop
+    from common.common import TimeoutException
+    from common.execution_loop import ExecutionLoop, Return, TaskCancelled, run_coroutine
+except ImportError:
+    ExecutionLoop = None
+
+
+class FakeChannel(object):
+    """
+    Channel that returns the given chunks of stdout, then exit status 0. Its fd is a pipe kept readable.
+    """
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+        self.read_fd, self.write_fd = os.pipe()
+        os.write(self.write_fd, 'x')
+        self.closed = False
+        self.eof_received = False
+
+    def get_pty(self):
+        pass
+
+    def exec_command(self, command):
+        pass
+
+    def shutdown_write(self):
+        pass
+
+    def setblocking(self, blocking):
+        pass
+
+    def fileno(self):
+        return self.read_fd
+
+    def recv_ready(self):
+        return bool(self.chunks)
+
+    def recv(self, size):
+        data = self.chunks.pop(0)
+        self.eof_received = not self.chunks
+        return data
+
+    def recv_stderr_ready(self):
+        return False
+
+    def exit_status_ready(self):
+        return not self.chunks
+
+    def recv_exit_status(self):
+        return 0
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            os.close(self.read_fd)
+            os.close(self.write_fd)
+
+
+class FakePool(object):
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    def open_channel(self, *args):
+        return FakeChannel(self.chunks)
+
+
+@unittest.skipIf(ExecutionLoop is None, 'paramiko is not installed')
+class ExecutionLoopTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = ExecutionLoop(max_workers=2)
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_coroutine_waits_on_tasks_lists_and_sleeps(self):
+        def coroutine(loop):
+            result = yield loop.shell('echo one; exit 3', suppress_output=True)
+            results = yield [loop.shell('echo two', suppress_output=True), loop.run_in_worker(lambda: 42)]
+            yield 0.01
+            raise Return((result.out, result.exit_status, results[0].out, results[1]))
+
+        self.assertEqual(run_coroutine(coroutine, timeout=10), ('one', 3, 'two', 42))
+
+    def test_timeout_cancels_coroutine_and_runs_its_cleanup(self):
+        cleaned_up = []
+
+        def coroutine(loop):
+            try:
+                yield loop.shell('sleep 10', suppress_output=True)
+            finally:
+                cleaned_up.append(True)
+
+        start = time.time()
+        self.assertRaises(TimeoutException, run_coroutine, coroutine, 0.3)
+        self.assertLess(time.time() - start, 5)
+        self.assertEqual(cleaned_up, [True])
+
+    def test_cancel_cancels_what_the_coroutine_yields_after_the_exception(self):
+        waited_on = []
+
+        def stubborn(loop):
+            try:
+                yield loop.shell('sleep 10', suppress_output=True)
+            except TaskCancelled:
+                task = loop.shell('sleep 10', suppress_output=True)
+                waited_on.append(task)
+                yield task
+
+        task = self.loop.spawn(stubborn(self.loop))
+        self.loop._run_ready()  # Start the coroutine.
+        self.assertTrue(task.cancel())
+
+        self.assertTrue(task.done())
+        self.assertTrue(task.cancelled())
+        self.assertTrue(waited_on[0].cancelled())
+        self.assertIsNotNone(waited_on[0].process.returncode)  # Killed, not left running.
+        self.assertIsNone(task.coroutine.gi_frame)  # Closed.
+
+    def test_gather_cancels_siblings_when_one_fails(self):
+        slow = self.loop.shell('sleep 10', suppress_output=True)
+
+        def fail():
+            raise ValueError('boom')
+
+        self.assertRaises(ValueError, self.loop.run_until_complete, [slow, self.loop.run_in_worker(fail)], 5)
+        self.assertTrue(slow.cancelled())
+
+    def test_rpc_streams_lines_to_on_line(self):
+        original_pool = common.execution_loop.ssh_pool
+        common.execution_loop.ssh_pool = FakePool(['first\r\nsec', 'ond\nlast'])
+        try:
+            lines = []
+            result = self.loop.run_until_complete(self.loop.rpc('10.0.0.1', 'tail -f log', 'user', timeout=None, suppress_output=True,
+                                                                on_line=lambda stream, line: lines.append((stream, line))), 5)
+        finally:
+            common.execution_loop.ssh_pool = original_pool
+
+        self.assertEqual(lines, [('out', 'first'), ('out', 'second'), ('out', 'last')])
+        self.assertEqual((result.out, result.exit_status), ('', 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,169 @@
+"""
+The MIT License (MIT)
+Copyright (c) Datos IO, Inc. 2015.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit
+persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the
+Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+
+import unittest
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    from common import fault_journal
+except ImportError:
+    fault_journal = None
+
+
+class Injector(object):
+    def __init__(self, error=None):
+        self.error = error
+        self.stopped = 0
+
+    def stop(self):
+        self.stopped += 1
+        if self.error:
+            raise self.error
+
+
+@unittest.skipIf(fault_journal is None, 'paramiko is not installed')
+class FaultJournalTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'journal', 'faults.jsonl')
+        self.journal = fault_journal.FaultJournal(self.path)
+        self.commands = []
+        self.failing = set()
+        self.unreachable = set()
+        self.reports = []
+        self.originals = fault_journal.rpc, fault_journal.wait_for_ssh_ready, fault_journal.report
+        fault_journal.rpc = self.rpc
+        fault_journal.wait_for_ssh_ready = lambda ip, user, password, key, timeout: ip not in self.unreachable
+        fault_journal.report = lambda message, level='info': self.reports.append((level, message))
+
+    def tearDown(self):
+        fault_journal.rpc, fault_journal.wait_for_ssh_ready, fault_journal.report = self.originals
+        shutil.rmtree(self.directory)
+
+    def rpc(self, ip, command, user, password, key, **kwargs):
+        self.commands.append((ip, command, user, password))
+        if command in self.failing:
+            return '', 'failed', 1
+        return '', '', 0
+
+    def test_record_and_resolve(self):
+        self.assertEqual(self.journal.pending(), [])
+        first = self.journal.record('netem', '10.0.0.1', ['tc del'], 'user', 'secret', note='delay')
+        second = self.journal.record('firewall', '10.0.0.2', ['iptables -D'], 'user')
+        self.assertEqual([entry['id'] for entry in self.journal.pending()], [first, second])
+
+        entry = self.journal.pending()[0]
+        self.assertEqual((entry['fault'], entry['ip'], entry['recover'], entry['note']), ('netem', '10.0.0.1', ['tc del'], 'delay'))
+        self.assertEqual((entry['pid'], entry['run']), (os.getpid(), self.journal.run_id))
+        self.assertNotIn('secret', open(self.path).read())
+
+        self.journal.resolve(first)
+        self.journal.resolve(first)
+        self.journal.resolve(None)
+        self.assertEqual([entry['id'] for entry in self.journal.pending()], [second])
+
+    def test_pending_filters_by_process_and_run(self):
+        mine = self.journal.record('netem', '10.0.0.1', ['tc del'], 'user')
+        other_run = fault_journal.FaultJournal(self.path)
+        other_run.run_id = 'another run'
+        theirs = other_run.record('netem', '10.0.0.2', ['tc del'], 'user')
+
+        self.assertEqual([entry['id'] for entry in self.journal.pending(run=self.journal.run_id)], [mine])
+        self.assertEqual([entry['id'] for entry in self.journal.pending(run='another run')], [theirs])
+        self.assertEqual(len(self.journal.pending(pid=os.getpid())), 2)
+        self.assertEqual(self.journal.pending(pid=-1), [])
+
+    def test_pending_skips_a_torn_line(self):
+        entry_id = self.journal.record('netem', '10.0.0.1', ['tc del'], 'user')
+        with open(self.path, 'a') as f:
+            f.write('{"op": "resolve", "id": "%s' % entry_id)
+        self.assertEqual([entry['id'] for entry in self.journal.pending()], [entry_id])
+
+    def test_recover_is_idempotent(self):
+        self.journal.record('netem', '10.0.0.1', ['tc del'], 'user', 'secret')
+        self.journal.record('firewall', '10.0.0.2', ['iptables -D a', 'iptables -D b'], 'user', 'secret')
+
+        self.assertEqual(self.journal.recover(), (2, 0))
+        self.assertEqual(self.commands, [('10.0.0.2', 'iptables -D a', 'user', 'secret'),
+                                         ('10.0.0.2', 'iptables -D b', 'user', 'secret'),
+                                         ('10.0.0.1', 'tc del', 'user', 'secret')])
+        self.assertFalse(os.path.exists(self.path))
+
+        self.assertEqual(self.journal.recover(), (0, 0))
+        self.assertEqual(len(self.commands), 3)
+
+    def test_failed_recovery_stays_pending_until_it_succeeds(self):
+        self.journal.record('netem', '10.0.0.1', ['tc del'], 'user')
+        second = self.journal.record('firewall', '10.0.0.2', ['iptables -D a', 'iptables -D b'], 'user')
+        third = self.journal.record('ifdown', '10.0.0.3', ['ifup eth0'], 'user', wait_for_ssh=True)
+        self.failing.add('iptables -D a')
+        self.unreachable.add('10.0.0.3')
+
+        self.assertEqual(self.journal.recover(), (1, 2))
+        self.assertNotIn(('10.0.0.2', 'iptables -D b', 'user', None), self.commands)
+        self.assertNotIn('10.0.0.3', [command[0] for command in self.commands])
+        self.assertEqual([entry['id'] for entry in self.journal.pending()], [second, third])
+        self.assertEqual([level for level, _ in self.reports].count('critical'), 2)
+
+        self.failing.clear()
+        self.unreachable.clear()
+        del self.commands[:]
+        self.assertEqual(self.journal.recover(entry_ids=[third]), (1, 0))
+        self.assertEqual(self.commands, [('10.0.0.3', 'ifup eth0', 'user', None)])
+        self.assertEqual(self.journal.recover(), (1, 0))
+        self.assertEqual(self.journal.pending(), [])
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_recover_only_touches_its_own_run(self):
+        self.journal.record('netem', '10.0.0.1', ['tc del'], 'user')
+        other_run = fault_journal.FaultJournal(self.path)
+        other_run.run_id = 'another run'
+        theirs = other_run.record('netem', '10.0.0.2', ['tc del'], 'user')
+
+        self.assertEqual(self.journal.recover(run=self.journal.run_id), (1, 0))
+        self.assertEqual([entry['id'] for entry in self.journal.pending()], [theirs])
+        self.assertEqual(self.commands, [('10.0.0.1', 'tc del', 'user', None)])
+
+    def test_credentials_for_faults_of_another_process(self):
+        fault_journal.FaultJournal(self.path).record('netem', '10.0.0.1', ['tc del'], 'user', 'lost with the process')
+        self.assertEqual(self.journal.recover(credentials=lambda ip: ('admin', 'password of %s' % ip, None)), (1, 0))
+        self.assertEqual(self.commands, [('10.0.0.1', 'tc del', 'admin', 'password of 10.0.0.1')])
+
+    def test_stop_injectors(self):
+        first, broken, last = Injector(), Injector(Exception('stuck')), Injector()
+        for injector in (first, broken, last):
+            self.journal.track(injector)
+        self.journal.untrack(last)
+        self.journal.untrack(last)
+
+        self.journal.stop_injectors()
+        self.assertEqual((first.stopped, broken.stopped, last.stopped), (1, 1, 0))
+        self.assertEqual([level for level, _ in self.reports], ['critical'])
+
+        self.journal.stop_injectors()
+        self.assertEqual((first.stopped, broken.stopped), (1, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+"""
+The MIT License (MIT)
+Copyright (c) Datos IO, Inc. 2015.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit
+persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the
+Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+
+import unittest
+
+
+import random
+import unittest
+import collections
+
+try:
+    from db_utils.cassandra_utils import data_population
+except ImportError:
+    data_population = None
+
+
+def draw(selector, n, times):
+    return collections.Counter(selector.next(n) for _ in xrange(times))
+
+
+@unittest.skipIf(data_population is None, 'cassandra-driver or paramiko is not installed')
+class KeySelectorTest(unittest.TestCase):
+    def setUp(self):
+        self.rng = random.Random(1234)
+
+    def test_every_selector_stays_in_range_as_n_grows_and_shrinks(self):
+        for name, Selector in sorted(data_population.KEY_SELECTORS.items()):
+            selector = Selector(self.rng)
+            for n in [1, 2, 3, 50, 51, 20000, 7, 1, 100]:
+                for _ in xrange(200):
+                    value = selector.next(n)
+                    self.assertTrue(0 <= value < n, '%s returned %s for n=%s' % (name, value, n))
+
+    def test_sequential_wraps(self):
+        selector = data_population.SequentialSelector(self.rng)
+        self.assertEqual([selector.next(3) for _ in xrange(7)], [0, 1, 2, 0, 1, 2, 0])
+
+    def test_zeta_approximation_beyond_exact_terms(self):
+        selector = data_population.ZipfianSelector(self.rng)
+        exact = sum(1.0 / i ** selector.theta for i in xrange(1, 50001))
+        approximate = selector.zetaTerms(0, 50000)
+        self.assertAlmostEqual(approximate / exact, 1.0, places=5)
+        self.assertAlmostEqual(selector.zetaTerms(0, 20000) + selector.zetaTerms(20000, 50000), approximate)
+
+    def test_zipfian_follows_the_power_law(self):
+        selector = data_population.ZipfianSelector(self.rng, scramble=False)
+        counts = draw(selector, 1000, 100000)
+        zetan = selector.zetan
+        self.assertAlmostEqual(counts[0] / 100000.0, 1 / zetan, delta=0.01)
+        self.assertAlmostEqual(counts[1] / 100000.0, 0.5 ** selector.theta / zetan, delta=0.01)
+        self.assertGreater(counts[0], counts[10])
+        self.assertGreater(counts[10], counts[500])
+
+    def test_zipfian_growing_n_matches_a_fresh_selector(self):
+        grown = data_population.ZipfianSelector(self.rng)
+        for n in [10, 5000, 15000, 30000]:
+            grown.next(n)
+        fresh = data_population.ZipfianSelector(self.rng)
+        fresh.next(30000)
+        self.assertAlmostEqual(grown.zetan, fresh.zetan)
+        self.assertAlmostEqual(grown.eta, fresh.eta)
+
+        grown.next(100)  # Shrinking starts over.
+        fresh = data_population.ZipfianSelector(self.rng)
+        fresh.next(100)
+        self.assertAlmostEqual(grown.zetan, fresh.zetan)
+
+    def test_scrambled_zipfian_spreads_the_hot_keys(self):
+        selector = data_population.ZipfianSelector(self.rng)
+        counts = draw(selector, 1000, 20000)
+        hottest, hits = counts.most_common(1)[0]
+        self.assertEqual(hottest, data_population.fnvHash64(0) % 1000)
+        self.assertGreater(hits / 20000.0, 0.1)
+
+    def test_latest_prefers_recent_records(self):
+        counts = draw(data_population.LatestSelector(self.rng), 1000, 20000)
+        self.assertEqual(counts.most_common(1)[0][0], 999)
+        self.assertGreater(sum(counts[i] for i in xrange(900, 1000)), sum(counts[i] for i in xrange(0, 900)))
+
+    def test_hotspot_split(self):
+        counts = draw(data_population.HotspotSelector(self.rng, hot_set_fraction=0.2, hot_op_fraction=0.8), 1000, 20000)
+        hot = sum(count for value, count in counts.items() if value < 200)
+        self.assertAlmostEqual(hot / 20000.0, 0.8, delta=0.02)
+        self.assertGreater(len([value for value in counts if value >= 200]), 700)
+
+
+@unittest.skipIf(data_population is None, 'cassandra-driver or paramiko is not installed')
+class OperationMixTest(unittest.TestCase):
+    def setUp(self):
+        self.rng = random.Random(1234)
+
+    def test_parse_and_frequencies(self):
+        mix = data_population.OperationMix.parse('read = 50, update=40,insert=10, delete=0', self.rng)
+        self.assertEqual(str(mix), 'read=50,insert=10,update=40')
+        counts = collections.Counter(mix.next() for _ in xrange(20000))
+        self.assertEqual(set(counts), set(['read', 'update', 'insert']))
+        self.assertAlmostEqual(counts['read'] / 20000.0, 0.5, delta=0.02)
+        self.assertAlmostEqual(counts['update'] / 20000.0, 0.4, delta=0.02)
+        self.assertAlmostEqual(counts['insert'] / 20000.0, 0.1, delta=0.02)
+
+    def test_from_insert_percentage(self):
+        mix = data_population.OperationMix.fromInsertPercentage(20, self.rng)
+        self.assertEqual(mix.weights, {'insert': 20, 'update': 56.0, 'delete': 24.0})
+        only_inserts = data_population.OperationMix.fromInsertPercentage(100, self.rng)
+        self.assertEqual(set(only_inserts.next() for _ in xrange(100)), set(['insert']))
+
+    def test_invalid_mixes(self):
+        self.assertRaisesRegexp(Exception, 'Unknown operations in mix: write',
+                                data_population.OperationMix.parse, 'read=1,write=1', self.rng)
+        self.assertRaisesRegexp(Exception, 'no weight', data_population.OperationMix, {'read': 0}, self.rng)
+        self.assertRaises(ValueError, data_population.OperationMix.parse, 'read', self.rng)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+"""
+The MIT License (MIT)
+Copyright (c) Datos IO, Inc. 2015.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit
+persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the
+Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+
+import unittest
+
+
+import os
+import json
+import random
+import shutil
+import tempfile
+import unittest
+
+try:
+    from db_utils.cassandra_utils import data_population
+except ImportError:
+    data_population = None
+
+
+@unittest.skipIf(data_population is None, 'cassandra-driver or paramiko is not installed')
+class LatencyHistogramTest(unittest.TestCase):
+    def test_small_values_are_exact(self):
+        Histogram = data_population.LatencyHistogram
+        for us in xrange(64):
+            self.assertEqual(Histogram.bucketIndex(us), us)
+            self.assertEqual(Histogram.bucketValue(us), us)
+
+    def test_buckets_are_ordered_and_within_three_percent(self):
+        Histogram = data_population.LatencyHistogram
+        rng = random.Random(7)
+        values = sorted(set([rng.randint(64, 1 << 40) for _ in xrange(5000)] + [(1 << e) + d for e in xrange(6, 40) for d in (-1, 0, 1)]))
+        indexes = [Histogram.bucketIndex(us) for us in values]
+        self.assertEqual(indexes, sorted(indexes))
+        for us, index in zip(values, indexes):
+            lower = Histogram.bucketValue(index)
+            self.assertLessEqual(lower, us)
+            self.assertLess(us - lower, us / 32.0)
+            self.assertEqual(Histogram.bucketIndex(lower), index)
+
+    def test_percentiles(self):
+        histogram = data_population.LatencyHistogram()
+        self.assertEqual(histogram.percentiles([50, 99]), [0, 0])
+
+        for ms in xrange(1, 101):
+            histogram.record(ms / 1000.0)
+        self.assertEqual(histogram.count, 100)
+        self.assertEqual(histogram.max, 100000)
+
+        p50, p99, p100 = histogram.percentiles([50, 99, 100])
+        for actual, expected in ((p50, 50000), (p99, 99000), (p100, 100000)):
+            self.assertLessEqual(actual, expected)
+            self.assertLess(expected - actual, expected / 32.0)
+
+    def test_negative_latencies_are_recorded_as_zero(self):
+        histogram = data_population.LatencyHistogram()
+        histogram.record(-0.5)
+        self.assertEqual(histogram.percentiles([100]), [0])
+
+
+@unittest.skipIf(data_population is None, 'cassandra-driver or paramiko is not installed')
+class WorkloadMetricsTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'metrics.jsonl')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_snapshots_are_appended_as_json_lines(self):
+        metrics = data_population.WorkloadMetrics(self.path, 'ks.table', interval=3600, suppress_output=True)
+        for _ in xrange(10):
+            metrics.record('insert', 0.002)
+        metrics.recordError('insert')
+        metrics.recordError('read')
+        metrics.snapshot()
+        metrics.snapshot()  # Nothing new, so no line.
+        metrics.record('read', 0.001)
+        metrics.close()
+
+        with open(self.path) as fp:
+            lines = [json.loads(line) for line in fp]
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(lines[0]['table'], 'ks.table')
+        self.assertEqual(lines[0]['pid'], os.getpid())
+
+        insert = lines[0]['ops']['insert']
+        self.assertEqual((insert['count'], insert['errors'], insert['max_ms']), (10, 1, 2.0))
+        self.assertEqual(sorted(key for key in insert if key.startswith('p')), ['p50_ms', 'p95_ms', 'p999_ms', 'p99_ms'])
+        self.assertEqual(lines[0]['ops']['read']['count'], 0)
+        self.assertEqual(lines[0]['ops']['read']['errors'], 1)
+        self.assertEqual(lines[1]['ops'].keys(), ['read'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,227 @@
+"""
+The MIT License (MIT)
+Copyright (c) Datos IO, Inc. 2015.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit
+persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the
+Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+
+import unittest
+
+
+import os
+import shutil
+import tempfile
+import unittest
+import collections
+
+try:
+    from db_utils.cassandra_utils import node_metrics
+except ImportError:
+    node_metrics = None
+
+
+TPSTATS = """Pool Name                    Active   Pending      Completed   Blocked  All time blocked
+ReadStage                         2         5         123456         0                 0
+MutationStage                     0         0         654321         1                 3
+
+Message type           Dropped
+READ                         7
+MUTATION                     0
+"""
+
+COMPACTIONSTATS = """pending tasks: 3
+   compaction type   keyspace   table   completed      total    unit   progress
+        Compaction        ks1  table1     1048576   4194304   bytes     25.00%
+        Compaction        ks1  table2      524288   1048576   bytes     50.00%
+Active compaction remaining time :   0h00m03s
+"""
+
+GCSTATS = """       Interval (ms) Max GC Elapsed (ms)Total GC Elapsed (ms)Stdev GC Elapsed (ms)   GC Reclaimed (MB)         Collections      Direct Memory Bytes
+               10012                  35                  61                  12           524288000                   2                       -1
+"""
+
+INFO = """ID                     : 2a8c3bd9-4b6d-4f53-9d6a-4f0a2e1c7d55
+Gossip active          : true
+Load                   : 1.5 GiB
+Uptime (seconds)       : 3600
+Heap Memory (MB)       : 512.25 / 2048.00
+Off Heap Memory (MB)   : 12.50
+"""
+
+CFSTATS = """Keyspace : system
+	Read Count: 10
+Keyspace : ks1
+	Read Count: 100
+	Read Latency: 0.25 ms.
+	Table: table1
+	SSTable count: 4
+	Local read latency: NaN ms
+	Space used (live): 2048
+"""
+
+
+@unittest.skipIf(node_metrics is None, 'paramiko is not installed')
+class ParserTest(unittest.TestCase):
+    def test_parse_number(self):
+        self.assertEqual(node_metrics.parse_number(' 12 '), 12)
+        self.assertEqual(node_metrics.parse_number('0.123 ms'), 0.123)
+        self.assertEqual(node_metrics.parse_number('1.5E-4'), 1.5e-4)
+        self.assertEqual(node_metrics.parse_number('-1'), -1)
+        self.assertIsNone(node_metrics.parse_number('NaN'))
+        self.assertIsNone(node_metrics.parse_number('[1, 2]'))
+
+    def test_metric_name(self):
+        self.assertEqual(node_metrics.metric_name(' Space used (live) '), 'space_used_live')
+
+    def test_parse_tpstats(self):
+        self.assertEqual(node_metrics.parse_tpstats(TPSTATS), {
+            'tp.ReadStage.active': 2, 'tp.ReadStage.pending': 5, 'tp.ReadStage.completed': 123456,
+            'tp.ReadStage.blocked': 0, 'tp.ReadStage.all_time_blocked': 0,
+            'tp.MutationStage.active': 0, 'tp.MutationStage.pending': 0, 'tp.MutationStage.completed': 654321,
+            'tp.MutationStage.blocked': 1, 'tp.MutationStage.all_time_blocked': 3,
+            'dropped.READ': 7, 'dropped.MUTATION': 0,
+        })
+
+    def test_parse_compactionstats(self):
+        self.assertEqual(node_metrics.parse_compactionstats(COMPACTIONSTATS), {'compaction.pending': 3, 'compaction.active': 2})
+        self.assertEqual(node_metrics.parse_compactionstats('pending tasks: 0\n'), {'compaction.pending': 0, 'compaction.active': 0})
+
+    def test_parse_gcstats(self):
+        self.assertEqual(node_metrics.parse_gcstats(GCSTATS), {
+            'gc.interval_ms': 10012, 'gc.max_ms': 35, 'gc.total_ms': 61, 'gc.stdev_ms': 12, 'gc.reclaimed_mb': 524288000,
+            'gc.collections': 2, 'gc.direct_memory_bytes': -1,
+        })
+        self.assertEqual(node_metrics.parse_gcstats('error: JMX connection refused'), {})
+
+    def test_parse_info(self):
+        self.assertEqual(node_metrics.parse_info(INFO), {
+            'load_bytes': 3 * 1024 ** 3 / 2, 'uptime_s': 3600, 'heap.used_mb': 512.25, 'heap.max_mb': 2048.0,
+            'heap.off_heap_mb': 12.5,
+        })
+
+    def test_parse_cfstats(self):
+        self.assertEqual(node_metrics.parse_cfstats(CFSTATS), {
+            'keyspace.ks1.read_count': 100, 'keyspace.ks1.read_latency': 0.25,
+            'table.ks1.table1.sstable_count': 4, 'table.ks1.table1.space_used_live': 2048,
+        })
+        self.assertEqual(node_metrics.parse_cfstats(CFSTATS, keyspaces=['system']), {'keyspace.system.read_count': 10})
+
+    def test_sections_round_trip(self):
+        command = node_metrics.build_command(['tpstats', 'cfstats'], keyspaces=['ks1'])
+        self.assertEqual(command, "echo '@@geppetto tpstats'; nodetool tpstats ; echo '@@geppetto cfstats'; nodetool cfstats ks1")
+
+        out = '@@geppetto tpstats\n%s@@geppetto gcstats\n%s@@geppetto cfstats\n%s' % (TPSTATS, GCSTATS, CFSTATS)
+        metrics = node_metrics.parse_sections(out, keyspaces=['ks1'])
+        expected = dict(node_metrics.parse_tpstats(TPSTATS), **node_metrics.parse_gcstats(GCSTATS))
+        expected.update(node_metrics.parse_cfstats(CFSTATS, ['ks1']))
+        self.assertEqual(metrics, expected)
+        self.assertEqual(node_metrics.parse_sections('nodetool: command not found'), {})
+
+
+@unittest.skipIf(node_metrics is None, 'paramiko is not installed')
+class MetricsStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'metrics.jsonl')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def lines(self):
+        with open(self.path) as f:
+            return f.read().splitlines()
+
+    def test_partial_samples_round_trip(self):
+        store = node_metrics.MetricsStore(self.path, full_every=3)
+        samples = [
+            ('10.0.0.1', {'a': 1, 'b': 2}),
+            ('10.0.0.2', {'a': 5}),
+            ('10.0.0.1', {'a': 1}),  # Only some sections were due: b carries forward.
+            ('10.0.0.1', {'a': 2, 'c': 3}),
+            ('10.0.0.1', {'b': 4}),  # Fourth sample of the node, so a full line.
+            ('10.0.0.2', {'a': 5}),
+        ]
+        for timestamp, (ip, metrics) in enumerate(samples):
+            store.append(timestamp, ip, metrics)
+
+        self.assertEqual(list(node_metrics.read_metrics(self.path)), [
+            (0, '10.0.0.1', {'a': 1, 'b': 2}),
+            (1, '10.0.0.2', {'a': 5}),
+            (2, '10.0.0.1', {'a': 1, 'b': 2}),
+            (3, '10.0.0.1', {'a': 2, 'b': 2, 'c': 3}),
+            (4, '10.0.0.1', {'a': 2, 'b': 4, 'c': 3}),
+            (5, '10.0.0.2', {'a': 5}),
+        ])
+
+        lines = self.lines()
+        self.assertEqual(lines[2], '{"ip":"10.0.0.1","m":{},"t":2.0}')
+        self.assertEqual(lines[4], '{"full":1,"ip":"10.0.0.1","m":{"a":2,"b":4,"c":3},"t":4.0}')
+        self.assertEqual(lines[5], '{"ip":"10.0.0.2","m":{},"t":5.0}')
+
+    def test_reader_skips_a_truncated_last_line(self):
+        store = node_metrics.MetricsStore(self.path)
+        store.append(0, '10.0.0.1', {'a': 1})
+        with open(self.path, 'a') as f:
+            f.write('{"ip":"10.0.0.1","m":{"a"')
+        self.assertEqual(list(node_metrics.read_metrics(self.path)), [(0, '10.0.0.1', {'a': 1})])
+
+
+Result = collections.namedtuple('Result', 'out exit_status elapsed')
+
+
+@unittest.skipIf(node_metrics is None, 'paramiko is not installed')
+class MetricsCollectorTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.calls = []
+        self.original_rpc_many = node_metrics.rpc_many
+        node_metrics.rpc_many = self.rpc_many
+
+    def tearDown(self):
+        node_metrics.rpc_many = self.original_rpc_many
+        shutil.rmtree(self.directory)
+
+    def rpc_many(self, ips, command, *args, **kwargs):
+        self.calls.append(command)
+        return {'10.0.0.1': Result('@@geppetto tpstats\n%s' % TPSTATS, 0, 1.234), '10.0.0.2': Result('', 255, None)}
+
+    def test_slow_sections_are_sampled_less_often(self):
+        collector = node_metrics.MetricsCollector(['10.0.0.1'], 'user', 'password', None, os.path.join(self.directory, 'm'),
+                                                  interval=10, intervals={'gcstats': 20})
+        self.assertEqual(collector.due_sections(1000), list(node_metrics.PARSERS))
+        for section in node_metrics.PARSERS:
+            collector._last_run[section] = 1000
+        self.assertEqual(collector.due_sections(1009.4), [])
+        self.assertEqual(collector.due_sections(1010), ['tpstats', 'compactionstats'])
+        self.assertEqual(collector.due_sections(1030), ['tpstats', 'compactionstats', 'gcstats', 'info'])
+        self.assertEqual(collector.due_sections(1060), list(node_metrics.PARSERS))
+
+    def test_sample_marks_failed_nodes(self):
+        path = os.path.join(self.directory, 'm')
+        collector = node_metrics.MetricsCollector(['10.0.0.1', '10.0.0.2'], 'user', 'password', None, path)
+        samples = collector.sample()
+        self.assertEqual(len(self.calls), 1)
+        self.assertIn("nodetool cfstats", self.calls[0])
+        self.assertEqual(samples['10.0.0.1']['tp.ReadStage.pending'], 5)
+        self.assertEqual((samples['10.0.0.1']['collector.ok'], samples['10.0.0.1']['collector.elapsed_s']), (1, 1.23))
+        self.assertEqual(samples['10.0.0.2'], {'collector.ok': 0, 'collector.elapsed_s': 0})
+        self.assertEqual(sorted(ip for _, ip, _ in node_metrics.read_metrics(path)), ['10.0.0.1', '10.0.0.2'])
+
+        self.assertEqual(collector.sample(), {})  # Nothing is due again yet.
+        self.assertEqual(len(self.calls), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
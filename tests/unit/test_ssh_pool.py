@@ -0,0 +1,177 @@
+"""
+The MIT License (MIT)
+Copyright (c) Datos IO, Inc. 2015.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit
+persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the
+Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+
+import unittest
+
+try:
+    import paramiko
+    import common.common
+    from common.common import SSHConnectionPool
+except ImportError:
+    paramiko = None
+
+
+class FakeChannelMap(object):
+    def __init__(self):
+        self.channels = []
+
+    def values(self):
+        return list(self.channels)
+
+
+class FakeTransport(object):
+    def __init__(self, refusals=0, error=None):
+        self.active = True
+        self.refusals = refusals  # open_session raises ChannelException this many times first.
+        self.error = error  # Or raises this every time.
+        self.timeouts = []
+        self._channels = FakeChannelMap()
+
+    def is_active(self):
+        return self.active
+
+    def open_session(self, timeout=None):
+        self.timeouts.append(timeout)
+        if self.error is not None:
+            raise self.error
+        if self.refusals:
+            self.refusals -= 1
+            raise paramiko.ChannelException(1, 'Administratively prohibited')
+        channel = object()
+        self._channels.channels.append(channel)
+        return channel
+
+
+class FakeSSH(object):
+    def __init__(self, transport):
+        self.transport = transport
+        self.closed = False
+
+    def get_transport(self):
+        return self.transport
+
+    def close(self):
+        self.closed = True
+        self.transport.active = False
+
+
+@unittest.skipIf(paramiko is None, 'paramiko is not installed')
+class SSHConnectionPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.pool = SSHConnectionPool(max_idle=60, keepalive=0, channel_retries=2)
+        self.transports = []  # Handed out by the fake handshake, in order.
+        self.connects = []
+        self.pool._connect = self._connect
+        self.sleeps = []
+        self._sleep = common.common.time.sleep
+        common.common.time.sleep = self.sleeps.append
+
+    def tearDown(self):
+        common.common.time.sleep = self._sleep
+
+    def _connect(self, ip, user, password, key, timeout, compress):
+        transport = self.transports.pop(0) if self.transports else FakeTransport()
+        ssh = FakeSSH(transport)
+        self.connects.append(ssh)
+        return ssh
+
+    def test_reuses_connection(self):
+        first = self.pool.get('10.0.0.1', 'user')
+        self.assertIs(self.pool.get('10.0.0.1', 'user'), first)
+        self.assertIsNot(self.pool.get('10.0.0.2', 'user'), first)
+        self.assertIsNot(self.pool.get('10.0.0.1', 'user', compress=True), first)
+        self.assertEqual(len(self.connects), 3)
+
+    def test_evicts_idle_and_dead_connections(self):
+        first = self.pool.get('10.0.0.1', 'user')
+        self.pool.max_idle = -1
+        second = self.pool.get('10.0.0.1', 'user')
+        self.assertIsNot(second, first)
+        self.assertTrue(first.closed)
+
+        self.pool.max_idle = 60
+        second.transport.active = False
+        self.assertIsNot(self.pool.get('10.0.0.1', 'user'), second)
+
+    def test_forked_child_starts_empty_without_closing_parent_connections(self):
+        first = self.pool.get('10.0.0.1', 'user')
+        self.pool._pid = -1  # As if this process was forked after the connection was made.
+        self.assertIsNot(self.pool.get('10.0.0.1', 'user'), first)
+        self.assertFalse(first.closed)
+
+    def test_open_channel_passes_timeout(self):
+        self.pool.open_channel('10.0.0.1', 'user', timeout=7)
+        self.assertEqual(self.connects[0].transport.timeouts, [7])
+
+    def test_refused_channel_backs_off_on_same_transport(self):
+        self.transports.append(FakeTransport(refusals=2))
+        self.pool.open_channel('10.0.0.1', 'user')
+        self.assertEqual(len(self.connects), 1)
+        self.assertFalse(self.connects[0].closed)
+        self.assertEqual(self.sleeps, [0.5, 1.0])
+
+    def test_refused_channel_gives_up_after_retries(self):
+        self.transports.append(FakeTransport(refusals=5))
+        self.assertRaises(paramiko.ChannelException, self.pool.open_channel, '10.0.0.1', 'user')
+        self.assertEqual(len(self.sleeps), 2)
+        self.assertFalse(self.connects[0].closed)
+
+    def test_unresponsive_transport_is_retired_until_its_channels_finish(self):
+        hung = FakeTransport()
+        hung._channels.channels.append(object())  # A command still running on it.
+        hung.error = paramiko.SSHException('Timeout opening channel.')
+        self.transports.append(hung)
+
+        self.pool.open_channel('10.0.0.1', 'user')
+        old, new = self.connects
+        self.assertFalse(old.closed)
+        self.assertIs(self.pool.get('10.0.0.1', 'user'), new)
+
+        hung._channels.channels = []
+        self.pool.get('10.0.0.1', 'user')  # Eviction runs on access.
+        self.assertTrue(old.closed)
+
+    def test_transport_that_dies_is_replaced(self):
+        dying = FakeTransport(error=EOFError())
+        dying.is_active = lambda: not dying.timeouts  # Drops when the channel is opened.
+        self.transports.append(dying)
+        self.pool.open_channel('10.0.0.1', 'user')
+        self.assertEqual(len(self.connects), 2)
+        self.assertTrue(self.connects[0].closed)
+        self.assertIs(self.pool.get('10.0.0.1', 'user'), self.connects[1])
+
+    def test_discard_dead_keeps_live_connections(self):
+        ssh = self.pool.get('10.0.0.1', 'user')
+        self.pool.discard_dead('10.0.0.1', 'user')
+        self.assertIs(self.pool.get('10.0.0.1', 'user'), ssh)
+
+        ssh.transport.active = False
+        self.pool.discard_dead('10.0.0.1', 'user')
+        self.assertTrue(ssh.closed)
+
+    def test_close_all_closes_retired_connections(self):
+        ssh = self.pool.get('10.0.0.1', 'user')
+        ssh.transport._channels.channels.append(object())
+        self.pool.retire('10.0.0.1', 'user')
+        self.pool.close_all()
+        self.assertTrue(ssh.closed)
+
+
+if __name__ == '__main__':
+    unittest.main()
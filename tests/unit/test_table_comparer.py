@@ -0,0 +1,108 @@
+"""
+The MIT License (MIT)
+Copyright (c) Datos IO, Inc. 2015.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit
+persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the
+Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+
+import unittest
+
+
+import unittest
+import collections
+
+try:
+    from db_utils.cassandra_utils.data_population import TableComparer
+except ImportError:
+    TableComparer = None
+
+
+Column = collections.namedtuple('Column', 'name')
+
+
+class FakeTable(object):
+    def __init__(self, columns, partition_key, clustering=()):
+        self.columns = dict((name, Column(name)) for name in columns)
+        self.partition_key = [Column(name) for name in partition_key]
+        self.primary_key = self.partition_key + [Column(name) for name in clustering]
+
+
+class FakeCluster(object):
+    """
+    Stands in for CassandraTestingCluster: session.cluster.metadata with the given tables, session.prepare echoes.
+    """
+    def __init__(self, tables, partitioner='org.apache.cassandra.dht.Murmur3Partitioner'):
+        keyspaces = {}
+        for name, table in tables.items():
+            ks_name, cf_name = name.split('.')
+            keyspaces.setdefault(ks_name, FakeObject(tables={})).tables[cf_name] = table
+        metadata = FakeObject(keyspaces=keyspaces, partitioner=partitioner)
+        self.session = FakeObject(cluster=FakeObject(metadata=metadata), prepare=lambda query: query)
+
+
+class FakeObject(object):
+    def __init__(self, **attributes):
+        self.__dict__.update(attributes)
+
+
+@unittest.skipIf(TableComparer is None, 'cassandra-driver or paramiko is not installed')
+class TableComparerTest(unittest.TestCase):
+    def comparer(self, first, second, **kwargs):
+        return TableComparer(FakeCluster({'ks.a': first, 'ks.b': second}, **kwargs), 'ks.a', 'ks.b')
+
+    def test_split_range_covers_the_ring_without_gaps(self):
+        comparer = self.comparer(None, None)
+        start, end = TableComparer.TOKEN_RANGES['Murmur3Partitioner']
+        ranges = comparer.splitRange(start, end, 256)
+
+        self.assertEqual(len(ranges), 256)
+        self.assertEqual(ranges[0][0], start)
+        self.assertEqual(ranges[-1][1], end)
+        for (_, previous_end), (next_start, _) in zip(ranges, ranges[1:]):
+            self.assertEqual(previous_end, next_start)
+        self.assertTrue(all(low < high for low, high in ranges))
+
+        sizes = [high - low for low, high in ranges]
+        self.assertLessEqual(max(sizes) - min(sizes), 1)
+
+    def test_split_range_never_makes_empty_ranges(self):
+        comparer = self.comparer(None, None)
+        self.assertEqual(comparer.splitRange(10, 13, 100), [(10, 11), (11, 12), (12, 13)])
+        self.assertEqual(comparer.splitRange(10, 13, 0), [(10, 13)])
+
+    def test_prepare_matches_columns_and_keys(self):
+        comparer = self.comparer(FakeTable(['k', 'c', 'v'], ['k'], ['c']), FakeTable(['v', 'c', 'k'], ['k'], ['c']))
+        comparer.prepare()
+        self.assertEqual(comparer.columns, ['c', 'k', 'v'])
+        self.assertEqual(comparer.key_positions, [1, 0])
+        self.assertEqual((comparer.min_token, comparer.max_token), TableComparer.TOKEN_RANGES['Murmur3Partitioner'])
+        self.assertEqual(comparer.statements['ks.a'], 'SELECT c, k, v FROM ks.a WHERE token(k) > ? AND token(k) <= ?')
+
+    def test_prepare_rejects_tables_that_cannot_be_compared(self):
+        different_columns = self.comparer(FakeTable(['k', 'v'], ['k']), FakeTable(['k', 'w'], ['k']))
+        self.assertRaisesRegexp(Exception, 'same columns', different_columns.prepare)
+
+        different_keys = self.comparer(FakeTable(['k', 'v'], ['k']), FakeTable(['k', 'v'], ['v']))
+        self.assertRaisesRegexp(Exception, 'same partition key', different_keys.prepare)
+
+        ordered = self.comparer(FakeTable(['k'], ['k']), FakeTable(['k'], ['k']), partitioner='org.apache.cassandra.dht.ByteOrderedPartitioner')
+        self.assertRaisesRegexp(Exception, 'Cannot split', ordered.prepare)
+
+        missing = TableComparer(FakeCluster({'ks.a': FakeTable(['k'], ['k'])}), 'ks.a', 'ks.b')
+        self.assertRaisesRegexp(Exception, 'does not exist', missing.prepare)
+
+
+if __name__ == '__main__':
+    unittest.main()
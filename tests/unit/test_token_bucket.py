@@ -0,0 +1,139 @@
+"""
+The MIT License (MIT)
+Copyright (c) Datos IO, Inc. 2015.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit
+persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the
+Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+
+import unittest
+
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+try:
+    from db_utils.cassandra_utils import data_population
+except ImportError:
+    data_population = None
+
+
+class FakeClock(object):
+    """
+    Replaces the time module in data_population: sleep() advances time() instantly. Tests use rates that are powers of
+    two so the waits are exact in floating point.
+    """
+    def __init__(self):
+        self.now = 0.0
+        self.slept = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+@unittest.skipIf(data_population is None, 'cassandra-driver or paramiko is not installed')
+class TokenBucketTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.original_time = data_population.time
+        data_population.time = self.clock
+
+    def tearDown(self):
+        data_population.time = self.original_time
+
+    def test_starts_empty_and_paces_to_rate(self):
+        bucket = data_population.TokenBucket(8)
+        for _ in xrange(16):
+            self.assertTrue(bucket.acquire())
+        self.assertEqual(self.clock.now, 2.0)
+
+    def test_idle_time_accrues_up_to_burst(self):
+        bucket = data_population.TokenBucket(8, burst=5)
+        self.clock.now += 60
+        for _ in xrange(5):
+            self.assertTrue(bucket.acquire())
+        self.assertEqual(self.clock.slept, [])
+        self.assertTrue(bucket.acquire())
+        self.assertEqual(sum(self.clock.slept), 0.125)
+
+    def test_zero_rate_times_out(self):
+        bucket = data_population.TokenBucket(0)
+        self.assertFalse(bucket.acquire(timeout=2.0))
+        self.assertEqual(self.clock.now, 2.0)
+
+    def test_set_rate_keeps_accrued_tokens_within_new_burst(self):
+        bucket = data_population.TokenBucket(100)
+        self.clock.now += 1
+        bucket.setRate(0)
+        self.assertEqual(bucket.burst, 1.0)
+        self.assertTrue(bucket.acquire(timeout=0))
+        self.assertFalse(bucket.acquire(timeout=0))
+
+        bucket.setRate(4)
+        self.clock.now += 0.5
+        self.assertTrue(bucket.acquire(2, timeout=0))
+
+    def test_bytes_rate_has_one_record_per_hour_floor(self):
+        self.assertEqual(data_population.bytesRateToOpsRate(2048, 1024), 2.0)
+        self.assertEqual(data_population.bytesRateToOpsRate(1, 8192), 1 / 3600.0)
+        self.assertEqual(data_population.bytesRateToOpsRate(0, 1024), 1 / 3600.0)
+
+
+@unittest.skipIf(data_population is None, 'cassandra-driver or paramiko is not installed')
+class WorkloadControlTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'control.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, settings, mtime):
+        with open(self.path, 'w') as fp:
+            json.dump(settings, fp)
+        os.utime(self.path, (mtime, mtime))
+
+    def test_poll_returns_settings_only_when_the_file_changes(self):
+        control = data_population.WorkloadControl(self.path, interval=0)
+        self.assertIsNone(control.poll())
+
+        self.write({'rate': 500}, 100)
+        self.assertEqual(control.poll(), {'rate': 500})
+        self.assertIsNone(control.poll())
+
+        self.write({'stop': True}, 200)
+        self.assertEqual(control.poll(), {'stop': True})
+
+    def test_poll_retries_a_half_written_file(self):
+        control = data_population.WorkloadControl(self.path, interval=0)
+        with open(self.path, 'w') as fp:
+            fp.write('{"rate": ')
+        self.assertIsNone(control.poll())
+
+        self.write({'rate': 1}, os.stat(self.path).st_mtime)
+        self.assertEqual(control.poll(), {'rate': 1})
+
+    def test_no_control_file(self):
+        self.assertIsNone(data_population.WorkloadControl(None).poll())
+
+
+if __name__ == '__main__':
+    unittest.main()